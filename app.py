@@ -1,29 +1,186 @@
 """
 Single-file Car Maze game with:
-- 3 FIXED mazes
-- Leaderboard (persistent in scores.json)
-- Race rooms (non-real-time 2-player)
+- Mazes from a binary catalogue (mazes.cat, seeded with 3 fixed mazes) plus generated ones
+- Leaderboard (MySQL, or SQLite with LEADERBOARD_DB=sqlite; pooled connections)
+- Race rooms (up to 16 players, quick-join matchmaking)
 - Ad placeholder in center
 - All game & DAA logic in Python (Flask)
 Usage:
-    pip install flask
+    pip install flask mysql-connector-python
     python app.py
+    (no MySQL server?  LEADERBOARD_DB=sqlite python app.py)
+    (several workers:  STATE_BACKEND=sqlite gunicorn -w 4 app:app)
+    (batch enemy ticks: pip install numpy, then REALTIME=1 TICK_BATCH=1)
+    (audit exported runs: python replay.py runs.jsonl)
+    (real-time enemies:  REALTIME=1 TICK_HZ=10 python app.py)
+    (more mazes:         python catalogue.py generate 101x101 --seeds 1-500)
 Open: http://127.0.0.1:5000/
 """
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, g
 from collections import deque
-import random, json, os, time, uuid, threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import random, json, os, sys, time, uuid, threading, queue, sqlite3, atexit, bisect, itertools, struct, heapq, functools, array, base64
+import gzip, hashlib, mmap
+
+try:
+    import numpy as np      # optional: only the batch tick engine needs it
+except ImportError:
+    np = None
+try:
+    import fcntl            # POSIX only: picks the ticking process (REALTIME + SQLite state)
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli           # optional: br-encoded index page
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
+# Locking: LOCK guards process-wide registries (room subscribers, field cache
+# eviction); sessions and rooms are only changed inside SESSIONS.locked(sid) /
+# ROOMS.locked(rid). Never hold a room and a session entry at the same time.
 LOCK = threading.Lock()
 
 # -------------------------
-# Fixed mazes (3 choices)
+# Metrics (Prometheus text format on /metrics)
+# -------------------------
+# Tiny in-process registry: counters and histograms keyed by label values,
+# each guarded by its own lock; gauges are read from callbacks at scrape time.
+METRICS = []
+
+def _labels(names, values):
+    if not names:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join('%s="%s"' % (n, esc(v)) for n, v in zip(names, values)) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *labels, by=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + by
+
+    def expose(self):
+        with self.lock:
+            items = list(self.values.items())
+        return ["%s%s %s" % (self.name, _labels(self.labels, k), v) for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self.values = {}        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, v, *labels):
+        i = bisect.bisect_left(self.buckets, v)
+        with self.lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += v
+
+    def expose(self):
+        with self.lock:
+            items = [(k, list(row)) for k, row in self.values.items()]
+        out = []
+        for k, row in items:
+            acc = 0
+            for le, n in zip(self.buckets + ("+Inf",), row[:-1]):
+                acc += n
+                out.append("%s_bucket%s %d" % (self.name, _labels(self.labels + ("le",), k + (le,)), acc))
+            out.append("%s_sum%s %s" % (self.name, _labels(self.labels, k), row[-1]))
+            out.append("%s_count%s %d" % (self.name, _labels(self.labels, k), acc))
+        return out
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        # fn() -> number, or [(label values, number)] when labels are given
+        self.name, self.help, self.labels, self.fn = name, help, labels, fn
+        METRICS.append(self)
+
+    def expose(self):
+        v = self.fn()
+        items = v if self.labels else [((), v)]
+        return ["%s%s %s" % (self.name, _labels(self.labels, k), x) for k, x in items]
+
+
+def render_metrics():
+    lines = []
+    for m in METRICS:
+        try:
+            body = m.expose()
+        except Exception as exc:
+            app.logger.error("metric %s failed: %s", m.name, exc)
+            continue
+        lines.append("# HELP %s %s" % (m.name, m.help))
+        lines.append("# TYPE %s %s" % (m.name, m.kind))
+        lines.extend(body)
+    return "\n".join(lines) + "\n"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+HTTP_REQUESTS = Counter("carmaze_http_requests_total", "HTTP requests by route, method and status",
+                        ("route", "method", "status"))
+HTTP_LATENCY = Histogram("carmaze_http_request_duration_seconds", "HTTP request latency by route",
+                         LATENCY_BUCKETS, ("route",))
+PATH_SEARCHES = Counter("carmaze_path_searches_total", "Pathfinding searches by algorithm", ("algo",))
+PATH_NODES = Counter("carmaze_path_nodes_expanded_total", "Nodes expanded by pathfinding, by algorithm", ("algo",))
+MOVE_NODES = Histogram("carmaze_move_nodes_expanded", "Pathfinding nodes expanded per applied move",
+                       (0, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000))
+FIELD_CACHE_LOOKUPS = Counter("carmaze_field_cache_lookups_total", "Enemy distance-field cache lookups", ("result",))
+DB_CONNECT = Histogram("carmaze_db_connect_seconds", "Time to open a leaderboard DB connection", LATENCY_BUCKETS)
+DB_QUERY = Histogram("carmaze_db_query_seconds", "Leaderboard DB query time (incl. commit)", LATENCY_BUCKETS, ("op",))
+
+_path_work = threading.local()
+
+def count_path_work(algo, nodes):
+    PATH_SEARCHES.inc(algo)
+    PATH_NODES.inc(algo, by=nodes)
+    _path_work.n = getattr(_path_work, "n", 0) + nodes
+
+def path_work():
+    # nodes expanded so far on this thread; diff around a move to get per-move work
+    return getattr(_path_work, "n", 0)
+
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    t0 = g.pop("t0", None)
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        HTTP_LATENCY.observe(time.perf_counter() - t0, route)
+        HTTP_REQUESTS.inc(route, request.method, response.status_code)
+    return response
+
+# -------------------------
+# Built-in mazes
 # -------------------------
 # 0 = path, 1 = wall, 2 = oil, 3 = exit
-MAZES = []
+# These only seed a new maze catalogue (see Maze catalogue below); the server
+# reads its mazes from the catalogue file.
+SEED_MAZES = []
 
-MAZES.append({
+SEED_MAZES.append({
     "name": "Forest Small",
     "grid": [
         [1,1,1,1,1,1,1,1,1,1,1,1,1,1,1],
@@ -44,7 +201,7 @@ MAZES.append({
     ]
 })
 
-MAZES.append({
+SEED_MAZES.append({
     "name": "Dense Grove",
     "grid": [
         [1,1,1,1,1,1,1,1,1,1,1,1,1,1,1],
@@ -65,7 +222,7 @@ MAZES.append({
     ]
 })
 
-MAZES.append({
+SEED_MAZES.append({
     "name": "Old Track",
     "grid": [
         [1,1,1,1,1,1,1,1,1,1,1,1,1,1,1],
@@ -86,11 +243,1108 @@ MAZES.append({
     ]
 })
 
+# -------------------------
+# Compiled maze index
+# -------------------------
+# Each maze is compiled once at startup. The index is immutable and shared by
+# every session on that maze; a session only keeps the oil tiles it collected.
+class MazeIndex:
+    __slots__ = ("name", "rows", "cols", "grid", "start", "exit", "oil", "_free", "_adj", "_safety")
+
+    def __init__(self, name, grid):
+        self.name = name
+        self.rows = len(grid); self.cols = len(grid[0])
+        # one bytes object per row: grid[r][c] still reads as an int
+        self.grid = tuple(bytes(row) for row in grid)
+        # start = first empty tile near top-left
+        self.start = self._find(0)
+        self.exit = self._find(3)
+        self.oil = frozenset((r, c) for r, row in enumerate(self.grid) for c in self._cols_of(row, 2))
+        # free-tile list and adjacency are built on first use; big generated
+        # mazes never need them (see ENEMY_FIELD_MAX_TILES)
+        self._free = None
+        self._adj = None
+        self._safety = None
+
+    @staticmethod
+    def _cols_of(row, v):
+        c = row.find(v)
+        while c >= 0:
+            yield c
+            c = row.find(v, c + 1)
+
+    def _find(self, v):
+        for r, row in enumerate(self.grid):
+            c = row.find(v)
+            if c >= 0:
+                return (r, c)
+        return None
+
+    @property
+    def tiles(self):
+        return self.rows * self.cols
+
+    @property
+    def free(self):
+        # empty tiles other than the start (enemy spawn candidates)
+        if self._free is None:
+            self._free = tuple((r, c) for r, row in enumerate(self.grid) for c in self._cols_of(row, 0)
+                               if (r, c) != self.start)
+        return self._free
+
+    @property
+    def adj(self):
+        if self._adj is None:
+            grid, R, C = self.grid, self.rows, self.cols
+            adj = {}
+            for r in range(R):
+                for c in range(C):
+                    if grid[r][c] == 1: continue
+                    adj[(r,c)] = tuple((r+dr, c+dc) for dr,dc in ((1,0),(-1,0),(0,1),(0,-1))
+                                       if 0 <= r+dr < R and 0 <= c+dc < C and grid[r+dr][c+dc] != 1)
+            self._adj = adj
+        return self._adj
+
+    @property
+    def safety(self):
+        if self._safety is None:
+            self._safety = MazeSafety(self)
+        return self._safety
+
+    def sample_free(self, k, rng=random):
+        # k distinct empty tiles, without listing every tile on big mazes
+        if self._free is not None or self.tiles <= ENEMY_FIELD_MAX_TILES:
+            return rng.sample(self.free, min(k, len(self.free)))
+        picked = set()
+        for _ in range(k * 1000):
+            if len(picked) == k:
+                break
+            t = (rng.randrange(self.rows), rng.randrange(self.cols))
+            if self.grid[t[0]][t[1]] == 0 and t != self.start:
+                picked.add(t)
+        return list(picked)
+
+    def render(self, collected=()):
+        # mutable list-of-lists view for clients, with collected oil cleared
+        maze = [list(row) for row in self.grid]
+        for r,c in collected:
+            maze[r][c] = 0
+        return maze
+
+ENEMY_FIELD_MAX_TILES = 40000   # above this, enemies path with A* instead of a shared field
+
+# -------------------------
+# Spawn safety & difficulty
+# -------------------------
+# One pass per compiled maze, run on first use (placing enemies, /analysis)
+# over flat tile indices:
+#   dist        hops from the start per tile (-1 = wall or unreachable)
+#   dead_ends   open tiles with one open neighbour
+#   chokepoints tiles every shortest start -> exit route passes through
+#   loops       independent cycles (edges - tiles + 1); braided mazes have many
+#   rating      0-100 heuristic: a route that is mostly chokepoints, many dead
+#               ends and few loops leave a player little room to dodge
+# Enemy placement then draws from a per-level spawn table: free tiles at least
+# min_dist hops from the start (capped at half the farthest distance, so small
+# mazes still have candidates), weighted by the level's scheme and sampled with
+# Vose's alias method, so placing k enemies costs O(k), not a shuffle of every
+# free tile. Weights:
+#   uniform  every candidate alike
+#   far      proportional to distance from the start
+#   route    shortest-route tiles x4, chokepoints x8, dead ends x0.25
+# Levels are DIFFICULTY_LEVELS (override or add with DIFFICULTY_LEVELS='{json}').
+# A session records its level, so its run replays with the same placement;
+# run records without one replay with the old uniform sample_free.
+DIFFICULTY_LEVELS = {
+    "easy":   {"enemies": 2, "min_dist": 12, "weight": "far"},
+    "normal": {"enemies": 3, "min_dist": 8,  "weight": "uniform"},
+    "hard":   {"enemies": 5, "min_dist": 5,  "weight": "route"},
+}
+SPAWN_WEIGHTS = ("uniform", "far", "route")
+DIFFICULTY_LEVELS.update(json.loads(os.environ.get("DIFFICULTY_LEVELS", "{}")))
+DEFAULT_DIFFICULTY = os.environ.get("DIFFICULTY", "normal")
+
+MAX_LEVEL_ENEMIES = 255         # packed sessions store enemy counts as one byte
+
+def check_difficulty_levels(levels, default):
+    # fail at startup, not per request, on a bad DIFFICULTY_LEVELS override
+    for name, level in levels.items():
+        if not isinstance(level, dict):
+            raise ValueError("difficulty %r must be an object" % name)
+        for key in ("enemies", "min_dist"):
+            if not isinstance(level.get(key), int) or isinstance(level[key], bool) or level[key] < 0:
+                raise ValueError("difficulty %r needs a non-negative integer %r" % (name, key))
+        if level["enemies"] > MAX_LEVEL_ENEMIES:
+            raise ValueError("difficulty %r: at most %d enemies" % (name, MAX_LEVEL_ENEMIES))
+        if level.setdefault("weight", "uniform") not in SPAWN_WEIGHTS:
+            raise ValueError("difficulty %r: weight must be one of %s" % (name, ", ".join(SPAWN_WEIGHTS)))
+    if default not in levels:
+        raise ValueError("DIFFICULTY=%r is not a difficulty level" % default)
+
+check_difficulty_levels(DIFFICULTY_LEVELS, DEFAULT_DIFFICULTY)
+
+def difficulty_arg(data):
+    # the request's difficulty level, or None if it isn't one
+    level = data.get("difficulty") or DEFAULT_DIFFICULTY
+    return level if isinstance(level, str) and level in DIFFICULTY_LEVELS else None
+
+def flat_bfs(flat, rows, cols, src, degree=None):
+    # hops from tile src to every tile, indexed r*cols+c (-1 = wall or
+    # unreachable), without building an adjacency dict; degree, if given,
+    # collects each reached tile's open-neighbour count. -> (dist, expanded)
+    n = rows * cols
+    dist = array.array("i", [-1]) * n
+    dist[src] = 0
+    q = deque([src])
+    expanded = 0
+    while q:
+        i = q.popleft()
+        expanded += 1
+        d = dist[i] + 1
+        c = i % cols
+        open_ = 0
+        for j in (i + cols if i + cols < n else -1, i - cols, i + 1 if c + 1 < cols else -1, i - 1 if c else -1):
+            if j >= 0 and flat[j] != 1:
+                open_ += 1
+                if dist[j] < 0:
+                    dist[j] = d
+                    q.append(j)
+        if degree is not None:
+            degree[i] = open_
+    return dist, expanded
+
+class MazeSafety:
+    __slots__ = ("cols", "dist", "max_dist", "route_len", "route", "dead_ends", "chokepoints",
+                 "loops", "rating", "_tables")
+
+    def __init__(self, idx):
+        R, C = idx.rows, idx.cols
+        flat = b"".join(idx.grid)
+
+        def bfs(src, degree=None):
+            return flat_bfs(flat, R, C, src, degree)[0]
+
+        start = idx.start[0] * C + idx.start[1]
+        degree = {}
+        self.cols = C
+        self.dist = bfs(start, degree)
+        self.max_dist = max(self.dist)
+        self.dead_ends = tuple(divmod(i, C) for i, k in degree.items() if k == 1 and i != start)
+        self.loops = sum(degree.values()) // 2 - len(degree) + 1
+        self.route = frozenset()
+        self.chokepoints = ()
+        self.route_len = -1
+        if idx.exit is not None:
+            end = idx.exit[0] * C + idx.exit[1]
+            self.route_len = L = self.dist[end]
+            if L >= 0:
+                to_exit = bfs(end)
+                route = [i for i in degree if self.dist[i] + to_exit[i] == L]
+                width = [0] * (L + 1)
+                for i in route:
+                    width[self.dist[i]] += 1
+                self.route = frozenset(route)
+                self.chokepoints = tuple(sorted(divmod(i, C) for i in route
+                                                if width[self.dist[i]] == 1 and i != start and i != end))
+        tiles = max(1, len(degree))
+        choke = len(self.chokepoints) / max(1, self.route_len - 1)
+        self.rating = round(100 * (0.5 * choke + 0.3 * min(1.0, 4.0 * len(self.dead_ends) / tiles)
+                                   + 0.2 * (1.0 - min(1.0, 8.0 * self.loops / tiles))))
+        self._tables = {}       # level name -> (candidates, prob, alias)
+
+    @property
+    def label(self):
+        return "easy" if self.rating < 35 else "medium" if self.rating < 65 else "hard"
+
+    def min_dist(self, level):
+        return min(int(level["min_dist"]), self.max_dist // 2)
+
+    def _table(self, grid_flat, level):
+        min_dist, scheme = self.min_dist(level), level["weight"]
+        cands = array.array("I", (i for i, d in enumerate(self.dist) if d >= min_dist and d > 0
+                                  and grid_flat[i] == 0))
+        dead = {r * self.cols + c for r, c in self.dead_ends}
+        choke = {r * self.cols + c for r, c in self.chokepoints}
+
+        def weight(i):
+            if scheme == "far":
+                return float(self.dist[i])
+            if scheme == "route":
+                return 8.0 if i in choke else 4.0 if i in self.route else 0.25 if i in dead else 1.0
+            return 1.0
+
+        # Vose's alias method: one uniform column pick and one coin per draw
+        n = len(cands)
+        w = [weight(i) for i in cands]
+        total = sum(w) or 1.0
+        scaled = [x * n / total for x in w]
+        prob, alias = array.array("d", [1.0]) * n, array.array("I", range(n))
+        small = [j for j, x in enumerate(scaled) if x < 1.0]
+        large = [j for j, x in enumerate(scaled) if x >= 1.0]
+        while small and large:
+            j, l = small.pop(), large.pop()
+            prob[j], alias[j] = scaled[j], l
+            scaled[l] -= 1.0 - scaled[j]
+            (small if scaled[l] < 1.0 else large).append(l)
+        return cands, prob, alias
+
+    def spawn(self, idx, k, rng, level_name):
+        # k distinct enemy tiles for a difficulty level, from rng only
+        table = self._tables.get(level_name)
+        if table is None:
+            table = self._tables[level_name] = self._table(b"".join(idx.grid), DIFFICULTY_LEVELS[level_name])
+        cands, prob, alias = table
+        n = len(cands)
+        if k >= n:
+            picked = list(cands)
+        else:
+            picked, seen = [], set()
+            for _ in range(64 * k):
+                if len(picked) == k:
+                    break
+                j = rng.randrange(n)
+                i = cands[j] if rng.random() < prob[j] else cands[alias[j]]
+                if i not in seen:
+                    seen.add(i)
+                    picked.append(i)
+            if len(picked) < k:
+                # weights so skewed that draws keep repeating: fill uniformly
+                picked += rng.sample([i for i in cands if i not in seen], k - len(picked))
+        return [divmod(i, self.cols) for i in picked]
+
+    def summary(self, idx):
+        return {"maze": idx.name, "rating": self.rating, "label": self.label, "route_len": self.route_len,
+                "max_dist": self.max_dist, "loops": self.loops, "dead_ends": len(self.dead_ends),
+                "chokepoints": [list(t) for t in self.chokepoints],
+                "levels": {name: dict(level, min_dist=self.min_dist(level)) for name, level in DIFFICULTY_LEVELS.items()}}
+
+def place_enemies(idx, k, seed, level):
+    # seeded enemy tiles; level "" = the pre-difficulty uniform placement
+    rng = random.Random(seed)
+    if not level:
+        return idx.sample_free(k, rng)
+    return idx.safety.spawn(idx, k, rng, level)
+
+# -------------------------
+# Maze catalogue
+# -------------------------
+# Mazes live in one binary file (MAZE_CATALOGUE, default mazes.cat), mmapped
+# read-only and decoded on demand, so startup only reads the index and memory
+# is bounded by MAZE_CACHE compiled mazes whatever the catalogue size.
+#   header  4s magic "CMZC", u16 version, u16 reserved, u32 maze count
+#   index   per maze: u64 body offset, u16 rows, u16 cols, u16 name length
+#   names   utf-8, back to back in index order
+#   bodies  rows*cols cells, 2 bits each, 4 per byte, first cell in the low
+#           bits (the same packing as the binary wire format's maze section)
+# A missing catalogue is written from SEED_MAZES on first start. catalogue.py
+# builds and extends catalogues offline; a running server keeps the file it
+# mapped, so restart it to pick up new mazes. Mazes generated at runtime
+# (register_generated) are held in memory after the catalogue's mazes.
+CATALOGUE_MAGIC = b"CMZC"
+CATALOGUE_HEAD = struct.Struct("<4sHHI")
+CATALOGUE_ENTRY = struct.Struct("<QHHH")
+CATALOGUE_PATH = os.environ.get("MAZE_CATALOGUE", "mazes.cat")
+MAZE_CACHE = int(os.environ.get("MAZE_CACHE", 32))      # compiled catalogue mazes kept
+_PACK_TABLES = [bytes((v << 2 * k) & 0xff for v in range(256)) for k in range(4)]
+_UNPACK_TABLES = [bytes((v >> 2 * k) & 3 for v in range(256)) for k in range(4)]
+
+def pack_cells(flat):
+    # 2 bits per cell: OR the four shifted column strides together as big
+    # ints (no carries between bytes), so the whole grid packs without a loop
+    flat = bytes(flat) + bytes(-len(flat) % 4)
+    packed = 0
+    for k in range(4):
+        packed |= int.from_bytes(flat[k::4].translate(_PACK_TABLES[k]), "little")
+    return packed.to_bytes(len(flat) // 4, "little")
+
+def unpack_cells(packed, n):
+    packed = bytes(packed)
+    flat = bytearray(4 * len(packed))
+    for k in range(4):
+        flat[k::4] = packed.translate(_UNPACK_TABLES[k])
+    return bytes(flat[:n])
+
+def catalogue_entry(name, grid):
+    # (name, rows, cols, packed body) for write_catalogue; ValueError for a grid
+    # that would not load: ragged, too big, cells outside 0-3, no empty start tile
+    if not grid or not grid[0]:
+        raise ValueError("%s: empty grid" % name)
+    rows, cols = len(grid), len(grid[0])
+    if rows > 0xffff or cols > 0xffff:
+        raise ValueError("%s: %dx%d is too big" % (name, rows, cols))
+    if any(len(row) != cols for row in grid):
+        raise ValueError("%s: rows are not all %d cells" % (name, cols))
+    if any(type(v) is not int or not 0 <= v <= 3 for row in grid for v in row):
+        raise ValueError("%s: cells must be 0-3" % name)
+    flat = b"".join(bytes(row) for row in grid)
+    if 0 not in flat:
+        raise ValueError("%s: no empty tile to start on" % name)
+    return (name, rows, cols, pack_cells(flat))
+
+def write_catalogue(path, entries):
+    # entries: [(name, rows, cols, body)], body packed bytes or a callable
+    # returning them (so big catalogues stream one maze at a time). Written to
+    # a temporary file and renamed into place.
+    names = [e[0].encode("utf-8")[:0xffff] for e in entries]
+    offset = CATALOGUE_HEAD.size + CATALOGUE_ENTRY.size * len(entries) + sum(len(n) for n in names)
+    index = []
+    for name, (_, rows, cols, _) in zip(names, entries):
+        index.append(CATALOGUE_ENTRY.pack(offset, rows, cols, len(name)))
+        offset += (rows * cols + 3) // 4
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(CATALOGUE_HEAD.pack(CATALOGUE_MAGIC, 1, 0, len(entries)))
+        f.write(b"".join(index))
+        f.write(b"".join(names))
+        for _, rows, cols, body in entries:
+            body = body() if callable(body) else body
+            if len(body) != (rows * cols + 3) // 4:
+                raise ValueError("maze body is %d bytes, expected %d" % (len(body), (rows * cols + 3) // 4))
+            f.write(body)
+    os.replace(tmp, path)
+
+
+class MazeCatalogue:
+    # maze_index -> MazeIndex, reads like the list it replaces: catalogue
+    # mazes first (compiled on demand, LRU), then runtime-generated ones
+    def __init__(self, path=None, cache_size=MAZE_CACHE):
+        self.path = path
+        self.cache_size = cache_size
+        self._map = None
+        self._entries = []      # (body offset, rows, cols) per catalogue maze
+        self._names = []
+        self._extra = []        # generated MazeIndex objects, resident
+        self._by_name = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.refresh = None     # called on an index past the end (generated mazes of other workers)
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count = CATALOGUE_HEAD.unpack_from(self._map, 0)
+        if magic != CATALOGUE_MAGIC or version != 1:
+            raise ValueError("%s is not a maze catalogue" % path)
+        pos = CATALOGUE_HEAD.size + CATALOGUE_ENTRY.size * count
+        for offset, rows, cols, name_len in CATALOGUE_ENTRY.iter_unpack(self._map[CATALOGUE_HEAD.size:pos]):
+            self._entries.append((offset, rows, cols))
+            self._names.append(self._map[pos:pos + name_len].decode("utf-8"))
+            pos += name_len
+        for i, name in enumerate(self._names):
+            self._by_name.setdefault(name, i)
+
+    def __len__(self):
+        return len(self._entries) + len(self._extra)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def has(self, i):
+        if not 0 <= i < len(self) and self.refresh is not None:
+            self.refresh()
+        return 0 <= i < len(self)
+
+    def _generated(self, i):
+        if i - len(self._entries) >= len(self._extra) and self.refresh is not None:
+            self.refresh()
+        return self._extra[i - len(self._entries)]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i >= len(self._entries):
+            return self._generated(i)
+        with self._lock:
+            idx = self._cache.get(i)
+            if idx is not None:
+                self._cache.move_to_end(i)
+                self.hits += 1
+                return idx
+            self.misses += 1
+        # decode outside the lock; a racing miss just compiles it twice
+        offset, rows, cols = self._entries[i]
+        flat = unpack_cells(self._map[offset:offset + (rows * cols + 3) // 4], rows * cols)
+        idx = MazeIndex(self._names[i], [flat[r * cols:(r + 1) * cols] for r in range(rows)])
+        with self._lock:
+            idx = self._cache.setdefault(i, idx)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return idx
+
+    @property
+    def builtin(self):
+        return len(self._entries)
+
+    def name(self, i):
+        return self._names[i] if i < len(self._entries) else self._generated(i).name
+
+    def dims(self, i):
+        if i < len(self._entries):
+            return self._entries[i][1:]
+        idx = self._generated(i)
+        return (idx.rows, idx.cols)
+
+    def names(self):
+        return self._names + [idx.name for idx in self._extra]
+
+    def find(self, name):
+        return self._by_name.get(name)
+
+    def packed(self, i):
+        # a catalogue maze's packed cells straight from the map, or None
+        if 0 <= i < len(self._entries):
+            offset, rows, cols = self._entries[i]
+            return self._map[offset:offset + (rows * cols + 3) // 4]
+        return None
+
+    def add(self, idx):
+        # a compiled MazeIndex; caller holds LOCK
+        self._extra.append(idx)
+        i = len(self) - 1
+        self._by_name.setdefault(idx.name, i)
+        return i
+
+    def stats(self):
+        with self._lock:
+            decoded = len(self._cache)
+        return {"mazes": len(self), "catalogue": len(self._entries), "generated": len(self._extra),
+                "decoded": decoded, "cache_size": self.cache_size, "hits": self.hits, "misses": self.misses}
+
+
+def open_catalogue(path=CATALOGUE_PATH):
+    if not os.path.exists(path):
+        try:
+            write_catalogue(path, [catalogue_entry(m["name"], m["grid"]) for m in SEED_MAZES])
+        except OSError as exc:
+            # read-only checkout: serve the seed mazes from memory
+            app.logger.warning("cannot write maze catalogue %s: %s", path, exc)
+            cat = MazeCatalogue()
+            for m in SEED_MAZES:
+                cat.add(MazeIndex(m["name"], m["grid"]))
+            return cat
+    return MazeCatalogue(path)
+
+MAZE_INDEX = open_catalogue()
+
+# -------------------------
+# Procedural maze generator
+# -------------------------
+# Recursive-backtracker ("perfect", exactly one route between any two tiles)
+# on odd-sized grids, optionally braided by knocking out dead ends. The same
+# (rows, cols, seed, braid) always gives the same maze, and recent results are
+# cached, so regenerating a seed is free.
+MAX_GENERATED_DIM = 1001
+MAX_GENERATED_MAZES = 64        # generated mazes registered in MAZE_INDEX at most
+
+def generated_spec(rows, cols, seed, braid=0.0):
+    # -> normalised (rows, cols, seed, braid) and the maze's name, which names
+    # every input so that equal names mean equal grids (generated mazes are
+    # looked up and shared by name). rows/cols are rounded up to odd, braid
+    # to 3 places.
+    rows = max(5, min(MAX_GENERATED_DIM, int(rows) | 1))
+    cols = max(5, min(MAX_GENERATED_DIM, int(cols) | 1))
+    braid = min(1.0, max(0.0, round(float(braid), 3)))
+    # quote string seeds: Random("7") and Random(7) differ
+    name = "Generated %dx%d #%s" % (rows, cols, seed if isinstance(seed, int) else json.dumps(seed))
+    if braid > 0:
+        name += " braid %.3f" % braid
+    return (rows, cols, seed, braid), name
+
+def generate_maze(rows, cols, seed, braid=0.0, oil=None):
+    # {"name", "grid"} like a SEED_MAZES entry
+    spec, name = generated_spec(rows, cols, seed, braid)
+    if oil is not None:
+        name += " oil %d" % oil
+    return {"name": name, "grid": _generate_maze(*spec, oil)}
+
+@functools.lru_cache(maxsize=8)
+def _generate_maze(rows, cols, seed, braid, oil):
+    rng = random.Random(seed)
+    grid = [bytearray(b"\x01" * cols) for _ in range(rows)]
+    steps = ((2,0),(-2,0),(0,2),(0,-2))
+    grid[1][1] = 0
+    stack = [(1,1)]
+    while stack:
+        r, c = stack[-1]
+        nxt = [(r+dr, c+dc) for dr,dc in steps
+               if 0 < r+dr < rows-1 and 0 < c+dc < cols-1 and grid[r+dr][c+dc] == 1]
+        if not nxt:
+            stack.pop()
+            continue
+        nr, nc = nxt[rng.randrange(len(nxt))]
+        grid[(r+nr)//2][(c+nc)//2] = 0
+        grid[nr][nc] = 0
+        stack.append((nr, nc))
+
+    def dead_ends():
+        return [(r, c) for r in range(1, rows-1, 2) for c in range(1, cols-1, 2)
+                if sum(grid[r+dr//2][c+dc//2] == 0 for dr,dc in steps) == 1]
+
+    if braid > 0:
+        for r, c in dead_ends():
+            if rng.random() >= braid:
+                continue
+            walls = [(r+dr//2, c+dc//2) for dr,dc in steps
+                     if 0 < r+dr < rows-1 and 0 < c+dc < cols-1 and grid[r+dr//2][c+dc//2] == 1]
+            if walls:
+                wr, wc = walls[rng.randrange(len(walls))]
+                grid[wr][wc] = 0
+
+    # exit on the tile farthest from the start
+    dist = [-1] * (rows * cols)
+    dist[cols + 1] = 0
+    q = deque([cols + 1])
+    far = cols + 1
+    while q:
+        i = q.popleft()
+        far = i
+        for j in (i+1, i-1, i+cols, i-cols):
+            if dist[j] < 0 and grid[j // cols][j % cols] != 1:
+                dist[j] = dist[i] + 1
+                q.append(j)
+    exit_pos = (far // cols, far % cols)
+    grid[exit_pos[0]][exit_pos[1]] = 3
+
+    # oil on dead ends first (worth the detour), then random corridor tiles
+    n_oil = oil if oil is not None else max(3, (rows * cols) // 200)
+    spots = [t for t in dead_ends() if t != (1,1) and t != exit_pos]
+    rng.shuffle(spots)
+    for r, c in spots[:n_oil]:
+        grid[r][c] = 2
+    placed = min(n_oil, len(spots))
+    for _ in range((n_oil - placed) * 20):
+        if placed >= n_oil:
+            break
+        r, c = rng.randrange(1, rows-1), rng.randrange(1, cols-1)
+        if grid[r][c] == 0 and (r, c) != (1,1):
+            grid[r][c] = 2
+            placed += 1
+
+    return [bytes(row) for row in grid]
+
+# With STATE_BACKEND=sqlite sessions move between workers, so a generated
+# maze's index has to mean the same maze everywhere. Its spec (rows, cols,
+# seed, braid) goes into a table in STATE_SQLITE, in registration order, and a
+# worker that meets an index it hasn't built yet regenerates the mazes from
+# their specs (MAZE_INDEX.refresh). In memory mode MAZE_INDEX is the registry.
+class GeneratedMazeSpecs:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS generated_mazes (n INTEGER PRIMARY KEY, "
+                         "name TEXT UNIQUE NOT NULL, spec TEXT NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def register(self, name, spec, limit):
+        # -> the maze's position among generated mazes, or None past limit
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT n FROM generated_mazes WHERE name=?", (name,)).fetchone()
+            if row is None:
+                n = conn.execute("SELECT COUNT(*) FROM generated_mazes").fetchone()[0]
+                if n >= limit:
+                    conn.execute("ROLLBACK")
+                    return None
+                conn.execute("INSERT INTO generated_mazes (n, name, spec) VALUES (?, ?, ?)",
+                             (n, name, json.dumps(spec)))
+                row = (n,)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return row[0]
+
+    def specs(self, start):
+        return [(n, json.loads(spec)) for n, spec in self._conn().execute(
+            "SELECT n, spec FROM generated_mazes WHERE n >= ? ORDER BY n", (start,))]
+
+def sync_generated():
+    # build generated mazes other workers registered, in order
+    for n, (rows, cols, seed, braid) in GENERATED.specs(len(MAZE_INDEX) - MAZE_INDEX.builtin):
+        m = generate_maze(rows, cols, seed, braid)
+        idx = MazeIndex(m["name"], m["grid"])
+        with LOCK:
+            if len(MAZE_INDEX) - MAZE_INDEX.builtin == n:
+                MAZE_INDEX.add(idx)
+
+GENERATED = None
+if os.environ.get("STATE_BACKEND", "memory") == "sqlite":
+    GENERATED = GeneratedMazeSpecs(os.environ.get("STATE_SQLITE", "state.db"))
+    MAZE_INDEX.refresh = sync_generated
+
+def register_generated(rows, cols, seed, braid=0.0):
+    # add a generated maze to MAZE_INDEX (once per name); returns its index,
+    # or None past MAX_GENERATED_MAZES. Known names and the cap are checked
+    # before anything is generated.
+    spec, name = generated_spec(rows, cols, seed, braid)
+    i = MAZE_INDEX.find(name)
+    if i is not None:
+        return i
+    if GENERATED is not None:
+        n = GENERATED.register(name, list(spec), MAX_GENERATED_MAZES)
+        if n is None:
+            return None
+        sync_generated()
+        return MAZE_INDEX.builtin + n
+    if len(MAZE_INDEX) - MAZE_INDEX.builtin >= MAX_GENERATED_MAZES:
+        return None
+    # generate, compile and analyse outside LOCK; that can take seconds on big
+    # mazes, and the caller is about to start a session on it anyway
+    m = generate_maze(*spec)
+    idx = MazeIndex(m["name"], m["grid"])
+    idx.safety
+    with LOCK:
+        i = MAZE_INDEX.find(m["name"])
+        if i is not None:
+            return i
+        if len(MAZE_INDEX) - MAZE_INDEX.builtin >= MAX_GENERATED_MAZES:
+            return None
+        return MAZE_INDEX.add(idx)
+
 # -------------------------
 # Sessions & Rooms storage
 # -------------------------
-SESSIONS = {}   # session_id -> game state dict
-ROOMS = {}      # room_id -> {maze_index, sessions: [session_ids], results: {session_id: time}}
+# Sessions are __slots__ records; positions are (r, c) tuples. Both stores
+# evict idle and finished entries after a TTL and cap their size (least
+# recently used goes first). A background sweeper runs every SWEEP_INTERVAL.
+#
+# All mutation goes through `with STORE.locked(key) as obj:` so the backend
+# decides how updates are serialised:
+#   STATE_BACKEND=memory (default) -> TTLStore, one lock per entry, one process
+#   STATE_BACKEND=sqlite           -> SQLiteStore on STATE_SQLITE (WAL), shared by
+#                                     every worker process on the box
+# Packed sessions and rooms carry a format tag; a row written by an older
+# layout (before an upgrade) fails to load with StaleRecord and the SQLite
+# store drops it as if it had been evicted. Bump SESSION_FORMAT / ROOM_FORMAT
+# whenever the layout changes.
+# The whole record, run log included, is rewritten on every locked write, so
+# with the SQLite backend a move costs O(run length) in bytes written; the
+# log is capped by MAX_LOG_MOVES.
+SESSION_TAG = b"CMS"
+SESSION_FORMAT = 2
+SESSION_HEAD = struct.Struct("<3sBHIiBddHHBHHBQBIBBd")
+ROOM_FORMAT = 1
+
+class StaleRecord(Exception):
+    pass
+
+# Run log: every input is one entry, appended under the session lock. The
+# direction is packed 2 bits per entry into `log`; `log_t` holds one u32 per
+# entry with the ms since start_time in the low 30 bits and the entry kind in
+# the top 2 (a move, an input that was not a direction, a world tick from
+# batch_tick or the real-time scheduler, or a real-time player-only move).
+# With the spawn seed that is enough to replay the whole run.
+LOG_DIRS = ("up", "down", "left", "right")
+LOG_CODES = {d: i for i, d in enumerate(LOG_DIRS)}
+LOG_MOVE, LOG_IDLE, LOG_WORLD, LOG_INPUT = 0, 1 << 30, 2 << 30, 3 << 30
+LOG_MS_MAX = (1 << 30) - 1
+MAX_LOG_MOVES = 1 << 20         # a longer run stops logging and fails verification
+
+class Session:
+    __slots__ = ("maze_index", "collected", "player_name", "player", "enemies", "start_time",
+                 "finished", "finish_time", "score", "tick", "room", "seed", "spawn", "level", "log", "log_t",
+                 "pending", "last_input")
+
+    def __init__(self, maze_index, player_name, player, enemies, seed=0, level=""):
+        self.maze_index = maze_index
+        self.collected = set()      # oil tiles picked up; the grid itself is shared
+        self.player_name = player_name
+        self.player = player
+        self.enemies = enemies
+        self.start_time = time.time()
+        self.finished = False
+        self.finish_time = None
+        self.score = 0
+        self.tick = 0
+        self.room = None            # race room id, if any
+        self.seed = seed            # enemy spawn seed
+        self.spawn = len(enemies)   # enemies spawned from it
+        self.level = level          # difficulty level they were placed for
+        self.log = bytearray()      # run log, see LOG_*; None while replaying
+        self.log_t = array.array("I")
+        self.pending = bytearray()  # real-time mode: queued direction codes
+        self.last_input = self.start_time   # real-time mode: when the player last sent input
+
+    def record(self, direction, now, player_only=False):
+        # direction None = world tick
+        n = len(self.log_t)
+        if self.log is None or n >= MAX_LOG_MOVES:
+            return
+        code = LOG_CODES.get(direction)
+        kind = (LOG_WORLD if direction is None else LOG_IDLE if code is None
+                else LOG_INPUT if player_only else LOG_MOVE)
+        if n & 3 == 0:
+            self.log.append(0)
+        if code:
+            self.log[-1] |= code << ((n & 3) * 2)
+        self.log_t.append(min(LOG_MS_MAX, max(0, int((now - self.start_time) * 1000))) | kind)
+
+    def nbytes(self):
+        return (sys.getsizeof(self) + sys.getsizeof(self.collected) + sys.getsizeof(self.enemies)
+                + sys.getsizeof(self.player_name) + sys.getsizeof(self.player) * (1 + len(self.enemies))
+                + sys.getsizeof(self.log) + sys.getsizeof(self.log_t) + sys.getsizeof(self.pending))
+
+    def pack(self):
+        # fixed header, then enemy + oil coordinates as u16 pairs, then name, room, level and run log
+        name = self.player_name.encode("utf-8")[:0xffff]
+        room = (self.room or "").encode("utf-8")[:0xff]
+        level = self.level.encode("utf-8")[:0xff]
+        coords = [v for e in self.enemies for v in e] + [v for t in self.collected for v in t]
+        return b"".join((
+            SESSION_HEAD.pack(SESSION_TAG, SESSION_FORMAT, self.maze_index, self.tick, self.score, self.finished, self.start_time,
+                              -1.0 if self.finish_time is None else self.finish_time,
+                              self.player[0], self.player[1], len(self.enemies), len(self.collected),
+                              len(name), len(room), self.seed, self.spawn, len(self.log_t), len(self.pending),
+                              len(level), self.last_input),
+            struct.pack("<%dH" % len(coords), *coords), name, room, level,
+            bytes(self.log), self.log_t.tobytes(), bytes(self.pending)))
+
+    @classmethod
+    def unpack(cls, data):
+        if bytes(data[:4]) != SESSION_TAG + bytes((SESSION_FORMAT,)):
+            raise StaleRecord("session format")
+        (_, _, maze_index, tick, score, finished, start_time, finish_time, pr, pc,
+         n_enemies, n_oil, n_name, n_room, seed, spawn, n_log, n_pending, n_level, last_input) = SESSION_HEAD.unpack_from(data)
+        off = SESSION_HEAD.size
+        coords = struct.unpack_from("<%dH" % (2 * (n_enemies + n_oil)), data, off)
+        off += 4 * (n_enemies + n_oil)
+        s = cls.__new__(cls)
+        s.maze_index = maze_index
+        s.tick = tick
+        s.score = score
+        s.finished = bool(finished)
+        s.start_time = start_time
+        s.finish_time = None if finish_time < 0 else finish_time
+        s.player = (pr, pc)
+        s.enemies = [(coords[2*i], coords[2*i+1]) for i in range(n_enemies)]
+        s.collected = {(coords[2*i], coords[2*i+1]) for i in range(n_enemies, n_enemies + n_oil)}
+        s.player_name = bytes(data[off:off + n_name]).decode("utf-8", "replace")
+        off += n_name
+        s.room = bytes(data[off:off + n_room]).decode("utf-8") or None
+        off += n_room
+        s.level = bytes(data[off:off + n_level]).decode("utf-8")
+        off += n_level
+        s.seed, s.spawn = seed, spawn
+        s.log = bytearray(data[off:off + (n_log + 3) // 4])
+        off += (n_log + 3) // 4
+        s.log_t = array.array("I")
+        s.log_t.frombytes(bytes(data[off:off + 4 * n_log]))
+        off += 4 * n_log
+        s.pending = bytearray(data[off:off + n_pending])
+        s.last_input = last_input
+        return s
+
+
+def pack_room(room):
+    return json.dumps(dict(room, format=ROOM_FORMAT), separators=(",", ":")).encode("utf-8")
+
+def unpack_room(data):
+    room = json.loads(bytes(data).decode("utf-8"))
+    if room.pop("format", None) != ROOM_FORMAT:
+        raise StaleRecord("room format")
+    return room
+
+
+class TTLStore:
+    # dict-like; iteration order is least recently used first
+    def __init__(self, cap, idle_ttl, done_ttl, is_done, nbytes, on_evict=None):
+        self.cap = cap
+        self.idle_ttl = idle_ttl        # seconds without access before eviction
+        self.done_ttl = done_ttl        # seconds a finished entry is kept
+        self.is_done = is_done
+        self.nbytes = nbytes
+        self.on_evict = on_evict
+        self.evicted = 0
+        self._d = OrderedDict()         # key -> [value, last_access, entry lock]
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def __len__(self):
+        return len(self._d)
+
+    def _touch(self, key):
+        with self._lock:
+            item = self._d[key]
+            item[1] = time.time()
+            self._d.move_to_end(key)
+            return item
+
+    def __getitem__(self, key):
+        return self._touch(key)[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        evicted = []
+        with self._lock:
+            self._d[key] = [value, time.time(), threading.Lock()]
+            self._d.move_to_end(key)
+            while len(self._d) > self.cap:
+                evicted.append(self._d.popitem(last=False))
+            self.evicted += len(evicted)
+        self._evicted(evicted)
+        start_sweeper()
+
+    @contextmanager
+    def locked(self, key, write=True, touch=True):
+        # yields the live object (or None) with its entry lock held;
+        # touch=False leaves last access (and so idle eviction) alone
+        try:
+            if touch:
+                item = self._touch(key)
+            else:
+                with self._lock:
+                    item = self._d[key]
+        except KeyError:
+            yield None
+            return
+        with item[2]:
+            yield item[0]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._d.pop(key, None)
+        return default if item is None else item[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._d)
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        evicted = []
+        with self._lock:
+            for key, item in list(self._d.items()):
+                idle = now - item[1]
+                if idle > self.idle_ttl or (idle > self.done_ttl and self.is_done(item[0])):
+                    del self._d[key]
+                    evicted.append((key, item))
+            self.evicted += len(evicted)
+        self._evicted(evicted)
+        return len(evicted)
+
+    def _evicted(self, items):
+        if self.on_evict:
+            for key, item in items:
+                self.on_evict(key, item[0])
+
+    def stats(self):
+        with self._lock:
+            values = [item[0] for item in self._d.values()]
+        return {"live": len(values), "cap": self.cap, "evicted": self.evicted,
+                "bytes": sum(self.nbytes(v) for v in values)}
+
+
+class SQLiteStore:
+    # Same interface as TTLStore, backed by one table in a WAL-mode SQLite file
+    # so every worker process sees the same sessions/rooms. locked() runs the
+    # read-modify-write inside BEGIN IMMEDIATE, which serialises writers across
+    # processes. Reads and lookups don't refresh last-access; writes do.
+    def __init__(self, path, table, dump, load, cap, idle_ttl, done_ttl, is_done, on_evict=None):
+        self.path = path
+        self.table = table
+        self.dump = dump
+        self.load = load
+        self.cap = cap
+        self.idle_ttl = idle_ttl
+        self.done_ttl = done_ttl
+        self.is_done = is_done
+        self.on_evict = on_evict
+        self.evicted = 0
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit; transactions are opened explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, data BLOB NOT NULL, "
+                         "last REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0)" % self.table)
+            conn.execute("CREATE INDEX IF NOT EXISTS %s_last ON %s (last)" % (self.table, self.table))
+            self._local.conn = conn
+        return conn
+
+    def __contains__(self, key):
+        return self._conn().execute("SELECT 1 FROM %s WHERE key=?" % self.table, (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+    def _load(self, conn, key, row):
+        # decoded row, or None for a missing or stale-format one (deleted here)
+        if row is None:
+            return None
+        try:
+            return self.load(row[0])
+        except StaleRecord:
+            conn.execute("DELETE FROM %s WHERE key=?" % self.table, (key,))
+            self.evicted += 1
+            return None
+
+    def __getitem__(self, key):
+        conn = self._conn()
+        value = self._load(conn, key, conn.execute("SELECT data FROM %s WHERE key=?" % self.table, (key,)).fetchone())
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._conn().execute("INSERT OR REPLACE INTO %s (key, data, last, done) VALUES (?, ?, ?, ?)" % self.table,
+                             (key, self.dump(value), time.time(), int(bool(self.is_done(value)))))
+        start_sweeper()
+
+    @contextmanager
+    def locked(self, key, write=True, touch=True):
+        # yields a decoded copy; with write=True it is stored back on success,
+        # refreshing last access unless touch=False
+        conn = self._conn()
+        if not write:
+            yield self.get(key)
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM %s WHERE key=?" % self.table, (key,)).fetchone()
+            value = self._load(conn, key, row)
+            yield value
+            if value is not None and touch:
+                conn.execute("UPDATE %s SET data=?, last=?, done=? WHERE key=?" % self.table,
+                             (self.dump(value), time.time(), int(bool(self.is_done(value))), key))
+            elif value is not None:
+                conn.execute("UPDATE %s SET data=?, done=? WHERE key=?" % self.table,
+                             (self.dump(value), int(bool(self.is_done(value))), key))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def pop(self, key, default=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT data FROM %s WHERE key=?" % self.table, (key,)).fetchone()
+        conn.execute("DELETE FROM %s WHERE key=?" % self.table, (key,))
+        conn.execute("COMMIT")
+        value = self._load(conn, key, row)
+        return default if value is None else value
+
+    def keys(self):
+        return [r[0] for r in self._conn().execute("SELECT key FROM %s" % self.table)]
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keys = [r[0] for r in conn.execute(
+                "SELECT key FROM %s WHERE last < ? OR (done = 1 AND last < ?)" % self.table,
+                (now - self.idle_ttl, now - self.done_ttl))]
+            # over the cap: oldest writes go first
+            keys += [r[0] for r in conn.execute(
+                "SELECT key FROM %s WHERE last >= ? AND NOT (done = 1 AND last < ?) "
+                "ORDER BY last DESC LIMIT -1 OFFSET ?" % self.table,
+                (now - self.idle_ttl, now - self.done_ttl, self.cap))]
+            conn.executemany("DELETE FROM %s WHERE key=?" % self.table, [(k,) for k in keys])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self.evicted += len(keys)
+        if self.on_evict:
+            for key in keys:
+                self.on_evict(key, None)
+        return len(keys)
+
+    def stats(self):
+        live, nbytes = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM %s" % self.table).fetchone()
+        return {"live": live, "cap": self.cap, "evicted": self.evicted, "bytes": nbytes}
+
+
+def room_nbytes(room):
+    return (sys.getsizeof(room) + sys.getsizeof(room["sessions"]) + sys.getsizeof(room["results"])
+            + sum(sys.getsizeof(r) for r in room["results"].values())
+            + sys.getsizeof(room["standings"]) + 72 * len(room["standings"]))
+
+def room_evicted(rid, room):
+    # tell anyone still streaming this room (in this process) that it is gone
+    unlist_room(rid)
+    if room is not None and room["state"] != "complete":
+        room_publish(rid, "standings", {"status": "expired", "results": room_standings(room)})
+    room_publish(rid, None, None)
+
+def make_stores():
+    session_cfg = dict(cap=int(os.environ.get("SESSION_CAP", 100000)),
+                       idle_ttl=float(os.environ.get("SESSION_TTL", 1800)),
+                       done_ttl=float(os.environ.get("SESSION_DONE_TTL", 300)),
+                       is_done=lambda s: s.finished)
+    room_cfg = dict(cap=int(os.environ.get("ROOM_CAP", 20000)),
+                    idle_ttl=float(os.environ.get("ROOM_TTL", 3600)),
+                    done_ttl=float(os.environ.get("ROOM_DONE_TTL", 300)),
+                    is_done=lambda r: room_done(r), on_evict=room_evicted)
+    if os.environ.get("STATE_BACKEND", "memory") == "sqlite":
+        path = os.environ.get("STATE_SQLITE", "state.db")
+        return (SQLiteStore(path, "sessions", Session.pack, Session.unpack, **session_cfg),
+                SQLiteStore(path, "rooms", pack_room, unpack_room, **room_cfg))
+    return TTLStore(nbytes=Session.nbytes, **session_cfg), TTLStore(nbytes=room_nbytes, **room_cfg)
+
+# SESSIONS: session_id -> Session
+# ROOMS: room_id -> room dict, see new_room
+SESSIONS, ROOMS = make_stores()
+
+SWEEP_INTERVAL = float(os.environ.get("SWEEP_INTERVAL", 30))
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        return
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="store-sweeper", daemon=True)
+            _sweeper.start()
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            SESSIONS.sweep()
+            close_overdue_rooms()
+            ROOMS.sweep()
+        except Exception as exc:
+            app.logger.error("store sweep failed: %s", exc)
+
+def store_stats():
+    st = {"sessions": SESSIONS.stats(), "rooms": ROOMS.stats(), "mazes": MAZE_INDEX.stats(),
+          "room_subscribers": sum(len(v) for v in list(ROOM_SUBSCRIBERS.values()))}
+    if SCHEDULER:
+        st["scheduler"] = SCHEDULER.stats()
+    return st
 
 SCORES_FILE = "scores.json"
 # ensure scores.json exists
@@ -98,74 +1352,620 @@ if not os.path.exists(SCORES_FILE):
     with open(SCORES_FILE,"w") as f:
         json.dump([], f)
 
-def load_scores():
-    conn = get_db()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT player, maze, score, time FROM leaderboard ORDER BY score DESC, time ASC LIMIT 100")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
+# -------------------------
+# Leaderboard database (pooled)
+# -------------------------
+# Backends only know how to open, check and close a connection; the pool does
+# reuse. Queries are written with %s placeholders and translated per backend.
+#   LEADERBOARD_DB=mysql  (default) -> MYSQL_HOST / MYSQL_USER / MYSQL_PASSWORD / MYSQL_DATABASE
+#                                      (MYSQL_PASSWORD defaults to empty; set it)
+#   LEADERBOARD_DB=sqlite           -> LEADERBOARD_SQLITE (file path, default leaderboard.db)
+#   DB_POOL_SIZE (default 5), DB_POOL_TIMEOUT seconds (default 10)
+class MySQLBackend:
+    param = "%s"
 
+    def __init__(self, **config):
+        self.config = config
 
-def save_score(entry):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO leaderboard (player, maze, score, time) VALUES (%s, %s, %s, %s)",
-        (entry["player"], entry["maze"], entry["score"], entry["time"])
+    def connect(self):
+        import mysql.connector
+        return mysql.connector.connect(**self.config)
+
+    def ping(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def sql(self, q):
+        return q
+
+
+class SQLiteBackend:
+    param = "?"
+
+    def __init__(self, path="leaderboard.db"):
+        self.path = path
+
+    def connect(self):
+        # connections move between threads through the pool, one user at a time
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS leaderboard ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, player TEXT, maze TEXT, score INTEGER, time REAL)")
+        conn.commit()
+        return conn
+
+    def ping(self, conn):
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def sql(self, q):
+        return q.replace("%s", self.param)
+
+
+class ConnectionPool:
+    # bounded and thread-safe; idle connections are health-checked before reuse
+    def __init__(self, backend, size=5, timeout=10.0, ping_after=30.0):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after    # seconds idle before a connection is pinged
+        self._idle = []                 # [(conn, last_used)], reused LIFO
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                left = deadline - time.time()
+                if left <= 0:
+                    raise TimeoutError("leaderboard connection pool exhausted")
+                self._cond.wait(left)
+        if conn is not None and time.time() - last > self.ping_after and not self.backend.ping(conn):
+            self.backend.close(conn)
+            conn = None
+        if conn is None:
+            try:
+                t0 = time.perf_counter()
+                conn = self.backend.connect()
+                DB_CONNECT.observe(time.perf_counter() - t0)
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+        if broken:
+            self.backend.close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            # state unknown after a failed query: don't hand it out again
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self.backend.close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self.size, "open": self._open, "idle": len(self._idle)}
+
+
+def make_backend():
+    kind = os.environ.get("LEADERBOARD_DB", "mysql")
+    if kind == "sqlite":
+        return SQLiteBackend(os.environ.get("LEADERBOARD_SQLITE", "leaderboard.db"))
+    return MySQLBackend(
+        host=os.environ.get("MYSQL_HOST", "localhost"),
+        user=os.environ.get("MYSQL_USER", "root"),
+        password=os.environ.get("MYSQL_PASSWORD", ""),
+        database=os.environ.get("MYSQL_DATABASE", "carmaze29")
     )
-    conn.commit()
-    cur.close()
-    conn.close()
+
+DB_POOL = ConnectionPool(make_backend(),
+                         size=int(os.environ.get("DB_POOL_SIZE", 5)),
+                         timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)))
+
+def get_db():
+    # pooled connection, returned to the pool when the with-block ends
+    return DB_POOL.connection()
+
+def fetch_dicts(cur):
+    cols = [d[0] for d in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+def load_scores(limit=100, upto=None):
+    # best rows first; upto = only rows with id <= upto
+    where = "" if upto is None else " WHERE id <= %d" % int(upto)
+    with get_db() as conn:
+        t0 = time.perf_counter()
+        cur = conn.cursor()
+        cur.execute("SELECT player, maze, score, time FROM leaderboard%s ORDER BY score DESC, time ASC LIMIT %d"
+                    % (where, int(limit)))
+        rows = fetch_dicts(cur)
+        cur.close()
+        DB_QUERY.observe(time.perf_counter() - t0, "load_scores")
+    return rows
+
+def score_watermark():
+    # highest row id so far (0 for an empty table)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM leaderboard")
+        last = cur.fetchone()[0]
+        cur.close()
+    return int(last)
+
+def load_scores_after(last_id, limit=1000):
+    # rows inserted after id last_id, oldest first
+    with get_db() as conn:
+        t0 = time.perf_counter()
+        cur = conn.cursor()
+        cur.execute("SELECT id, player, maze, score, time FROM leaderboard WHERE id > %d ORDER BY id LIMIT %d"
+                    % (int(last_id), int(limit)))
+        rows = fetch_dicts(cur)
+        cur.close()
+        DB_QUERY.observe(time.perf_counter() - t0, "load_scores_after")
+    return rows
+
+
+def write_scores(entries):
+    # one multi-row INSERT + commit for the whole batch
+    if not entries:
+        return
+    q = "INSERT INTO leaderboard (player, maze, score, time) VALUES " + ", ".join(["(%s, %s, %s, %s)"] * len(entries))
+    args = []
+    for e in entries:
+        args.extend((e["player"], e["maze"], e["score"], e["time"]))
+    with get_db() as conn:
+        t0 = time.perf_counter()
+        cur = conn.cursor()
+        cur.execute(DB_POOL.backend.sql(q), args)
+        conn.commit()
+        cur.close()
+        DB_QUERY.observe(time.perf_counter() - t0, "save_score")
 
 
 # -------------------------
-# Game utilities (per-session)
+# Score write-behind queue
 # -------------------------
-def new_session(maze_index, player_name):
-    maze_template = MAZES[maze_index]["grid"]
-    # deep copy
-    maze = [row[:] for row in maze_template]
-    # find start (first empty tile near top-left)
-    start = None
-    for r in range(len(maze)):
-        for c in range(len(maze[0])):
-            if maze[r][c] == 0:
-                start = (r,c)
-                break
-        if start: break
-    # find exit coordinates
-    exit_pos = None
-    for r in range(len(maze)):
-        for c in range(len(maze[0])):
-            if maze[r][c] == 3:
-                exit_pos = (r,c)
+# A win only enqueues its score; a background thread drains the queue in
+# batches, retries failed batches with backoff and flushes on shutdown. Rows
+# that still fail, or that find the queue full, are dropped and counted; the
+# request that won never waits on the database.
+class ScoreWriter:
+    def __init__(self, write, capacity=10000, batch=200, retries=5, backoff=0.5):
+        self.write = write
+        self.batch = batch
+        self.retries = retries
+        self.backoff = backoff
+        self.q = queue.Queue(maxsize=capacity)
+        self.dropped = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, entry):
+        self._ensure_started()
+        try:
+            self.q.put(entry, timeout=0.05)
+        except queue.Full:
+            # writer can't keep up (or the DB is down): drop it rather than
+            # write inline on the request thread, under the session lock
+            self.dropped += 1
+            app.logger.error("score queue full, dropping leaderboard row for %s", entry.get("player"))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="score-writer", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _run(self):
+        while True:
+            first = self.q.get()
+            if first is None:
+                self.q.task_done()
+                return
+            entries = [first]
+            stop = False
+            while len(entries) < self.batch:
+                try:
+                    e = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if e is None:
+                    stop = True
+                    self.q.task_done()
+                    break
+                entries.append(e)
+            self._write_with_retry(entries)
+            for _ in entries:
+                self.q.task_done()
+            if stop:
+                return
+
+    def _write_with_retry(self, entries):
+        for attempt in range(self.retries + 1):
+            try:
+                self.write(entries)
+                return
+            except Exception as exc:
+                if attempt == self.retries:
+                    self.dropped += len(entries)
+                    app.logger.error("dropping %d leaderboard rows after %d attempts: %s", len(entries), attempt + 1, exc)
+                    return
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def flush(self, timeout=None):
+        # block until everything queued so far has been written (or dropped)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.q.all_tasks_done:
+            while self.q.unfinished_tasks:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return False
+                self.q.all_tasks_done.wait(left)
+        return True
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        self.q.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {"queued": self.q.qsize(), "dropped": self.dropped}
+
+SCORE_WRITER = ScoreWriter(write_scores, capacity=int(os.environ.get("SCORE_QUEUE_SIZE", 10000)))
+atexit.register(SCORE_WRITER.stop)
+
+# -------------------------
+# In-memory leaderboard
+# -------------------------
+# Sorted rankings (global + one per maze name), warmed from the DB once and
+# updated on every save, so reads never touch the database. The warm-up runs on
+# a background thread (retried with backoff while the DB is down); until its
+# first attempt is over, reads wait up to LEADERBOARD_WARM_WAIT and then get a
+# 503 rather than an empty board. Entries are kept ordered by (-score, time);
+# a player's rank is a bisect on their best key.
+#
+# Every worker process holds its own copy. Scores saved by other workers only
+# reach it through the database: the same thread polls for rows past the last
+# id it has seen every LEADERBOARD_SYNC seconds, so they show up that much
+# later (the table needs an auto-increment `id`, as the SQLite backend creates).
+# Rows this worker saved itself are matched off as they come back, so they are
+# not counted twice.
+class Ranking:
+    def __init__(self, cap):
+        self.cap = cap
+        self.keys = []      # (-score, time, seq), ascending = best first
+        self.rows = []      # public row for keys[i]
+        self.best = {}      # player -> best key
+
+    def add(self, key, row):
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.rows.insert(i, row)
+        b = self.best.get(row["player"])
+        if b is None or key < b:
+            self.best[row["player"]] = key
+        if len(self.keys) > self.cap:
+            # a player's other entries rank below their best, so dropping the
+            # best from the tail means none of theirs are left
+            k = self.keys.pop()
+            r = self.rows.pop()
+            if self.best.get(r["player"]) == k:
+                del self.best[r["player"]]
+
+    def page(self, page=1, per_page=100):
+        start = (page - 1) * per_page
+        return self.rows[start:start + per_page]
+
+    def rank(self, player):
+        key = self.best.get(player)
+        if key is None:
+            return None
+        i = bisect.bisect_left(self.keys, key)
+        return i + 1, self.rows[i]
+
+
+class Leaderboard:
+    def __init__(self, cap=10000):
+        self.cap = cap                  # rows kept per ranking
+        self.lock = threading.Lock()
+        self.warmed = False
+        self._warmer = None
+        self._attempted = threading.Event()     # first warm-up attempt is over
+        self._unsynced = []             # (row key, saved at) saved here, not yet read back
+        self.last_id = 0                # highest DB row id merged in
+        self.version = 0                # bumped on every change
+        self._seq = itertools.count()   # tie-break so equal (score, time) keep insert order
+        self.overall = Ranking(cap)
+        self.by_maze = {}
+
+    def _add(self, entry):
+        row = {"player": entry["player"], "maze": entry["maze"], "score": entry["score"], "time": entry["time"]}
+        key = (-row["score"], row["time"] if row["time"] is not None else float("inf"), next(self._seq))
+        self.overall.add(key, row)
+        board = self.by_maze.get(row["maze"])
+        if board is None:
+            board = self.by_maze[row["maze"]] = Ranking(self.cap)
+        board.add(key, row)
+        self.version += 1
+
+    def warm(self):
+        # start the background warm-up if it isn't running; never blocks
+        if self.warmed or self._warmer is not None:
+            return
+        with self.lock:
+            if self._warmer is None:
+                self._warmer = threading.Thread(target=self._warm, name="leaderboard-warm", daemon=True)
+                self._warmer.start()
+
+    @staticmethod
+    def _row_key(r):
+        return (r["player"], r["maze"], r["score"], None if r["time"] is None else round(float(r["time"]), 3))
+
+    def _merge(self, rows, last_id):
+        # add DB rows, skipping the ones this worker already added (lock held)
+        cutoff = time.time() - UNSYNCED_TTL     # older ones were dropped by the writer
+        mine = {}
+        for k, t in self._unsynced:
+            if t > cutoff:
+                mine.setdefault(k, []).append(t)
+        for r in rows:
+            saved = mine.get(self._row_key(r))
+            if saved:
+                saved.pop()
+            else:
+                self._add(r)
+        self._unsynced = [(k, t) for k, ts in mine.items() for t in ts]
+        self.last_id = max(self.last_id, last_id)
+
+    def _warm(self):
+        delay = 1.0
+        while True:
+            try:
+                last_id = score_watermark()
+                rows = load_scores(limit=self.cap * max(1, len(MAZE_INDEX)), upto=last_id)
                 break
-        if exit_pos: break
+            except Exception as exc:
+                app.logger.error("leaderboard warm-up failed, retrying in %.0fs: %s", delay, exc)
+                self._attempted.set()
+                time.sleep(delay)
+                delay = min(WARM_MAX_BACKOFF, delay * 2)
+        with self.lock:
+            self._merge(rows, last_id)
+            self.warmed = True
+        self._attempted.set()
+        while LEADERBOARD_SYNC > 0:
+            time.sleep(LEADERBOARD_SYNC)
+            try:
+                self.sync()
+            except Exception as exc:
+                app.logger.error("leaderboard sync failed: %s", exc)
+
+    def sync(self):
+        # merge rows other workers saved since the last look
+        while True:
+            rows = load_scores_after(self.last_id)
+            if not rows:
+                return
+            with self.lock:
+                self._merge(rows, rows[-1]["id"])
+
+    def add(self, entry):
+        self.warm()
+        with self.lock:
+            self._add(entry)
+            self._unsynced.append((self._row_key(entry), time.time()))
+
+    def ready(self, timeout=None):
+        # True once warmed; waits (up to timeout) for the first warm-up attempt
+        self.warm()
+        self._attempted.wait(timeout)
+        return self.warmed
 
-    # random-ish enemy placements (but not on start)
-    enemies = []
-    free = [(r,c) for r in range(len(maze)) for c in range(len(maze[0])) if maze[r][c] == 0 and (r,c) != start]
-    random.shuffle(free)
-    for i in range(3):
-        if i < len(free):
-            enemies.append(list(free[i]))
+    def board(self, maze=None):
+        self.warm()
+        if maze is None:
+            return self.overall
+        return self.by_maze.get(maze) or Ranking(0)
+
+    def page(self, maze=None, page=1, per_page=100):
+        b = self.board(maze)
+        with self.lock:
+            return {"total": len(b.rows), "entries": b.page(page, per_page)}
+
+    def rank(self, player, maze=None):
+        b = self.board(maze)
+        with self.lock:
+            found = b.rank(player)
+            return {"player": player, "maze": maze, "total": len(b.rows),
+                    "rank": found[0] if found else None, "entry": found[1] if found else None}
+
+WARM_MAX_BACKOFF = 60.0        # seconds between leaderboard warm-up retries, at most
+LEADERBOARD_WARM_WAIT = 2.0     # seconds a read waits for the first warm-up
+LEADERBOARD_SYNC = float(os.environ.get("LEADERBOARD_SYNC", 2))     # seconds between polls; 0 = off
+UNSYNCED_TTL = 300.0            # a row saved here and not read back by then was dropped
+LEADERBOARD = Leaderboard(cap=int(os.environ.get("LEADERBOARD_CACHE_SIZE", 10000)))
+
+def save_score(entry):
+    LEADERBOARD.add(entry)
+    SCORE_WRITER.submit(entry)
+
+
+# -------------------------
+# Game utilities (per-session)
+# -------------------------
+def new_session(maze_index, player_name, enemies=None, seed=None, level=None):
+    idx = MAZE_INDEX[maze_index]
+    level = level or DEFAULT_DIFFICULTY
+    if enemies is None:
+        enemies = DIFFICULTY_LEVELS[level]["enemies"]
+    # seeded enemy placements from the level's spawn table, so the run can be replayed
+    if seed is None:
+        seed = random.getrandbits(63)
+    spawn = place_enemies(idx, enemies, seed, level)
 
     sid = str(uuid.uuid4())
-    SESSIONS[sid] = {
-        "maze_index": maze_index,
-        "maze": maze,
-        "player_name": player_name or "Player",
-        "player": list(start),
-        "enemies": enemies,
-        "start_time": time.time(),
-        "finished": False,
-        "finish_time": None,
-        "score": 0
-    }
+    SESSIONS[sid] = Session(maze_index, player_name or "Player", idx.start, spawn, seed, level)
     return sid
 
+# -------------------------
+# Versioned state protocol
+# -------------------------
+# Every applied move bumps the session's tick. A client that sends the version
+# it last saw gets only what changed; the maze goes out in full on first load
+# or when the client's version has diverged from the server's.
+def dynamic_state(s):
+    return {
+        "version": s.tick,
+        "player": s.player,
+        "enemies": s.enemies,
+        "player_name": s.player_name,
+        "score": s.score,
+        "finished": s.finished
+    }
+
+def full_state(s):
+    st = dynamic_state(s)
+    st["maze"] = MAZE_INDEX[s.maze_index].render(s.collected)
+    return st
+
+def state_update(s, since, base, oil_removed=()):
+    # since = client's version, base = session tick before the move(s) just applied;
+    # a delta only applies on top of base
+    if since is not None and since == base:
+        delta = {
+            "player": s.player,
+            "enemies": s.enemies,
+            "score": s.score,
+            "finished": s.finished,
+            "oil_removed": [list(t) for t in oil_removed]
+        }
+        return {"version": s.tick, "delta": delta}
+    return {"version": s.tick, "full": full_state(s)}
+
+# -------------------------
+# Binary wire format
+# -------------------------
+# Clients that send `Accept: application/vnd.carmaze.state` get /state, /move
+# and /moves replies as one little-endian record instead of JSON:
+#   header  WIRE_HEAD (magic "CM", format, flags, status, version, score,
+#           elapsed, applied, player r/c, enemy count, oil count)
+#   enemies u16 (r, c) pairs, then oil tiles as u16 (r, c) pairs (the tiles
+#           removed by these moves for a delta, every collected tile for a full)
+#   name    u16 length + UTF-8 player name
+#   maze    full replies only: u16 rows, u16 cols, u32 length, then the
+#           maze's static grid, either 2 bits per cell (4 cells per byte,
+#           first cell in the low bits) or, with WIRE_RLE set, runs of one
+#           byte each: value << 6 | (run length - 1)
+# The maze bytes never change, so they are encoded once per maze and every
+# full reply just copies them; collected oil goes in the oil list. /moves
+# replies leave out the per-input events. Errors stay JSON.
+WIRE_MIME = "application/vnd.carmaze.state"
+WIRE_HEAD = struct.Struct("<2sBBBIidHHHHH")
+WIRE_FULL, WIRE_FINISHED, WIRE_RLE, WIRE_ELAPSED = 1, 2, 4, 8
+WIRE_STATUS = {None: 0, "win": 1, "caught": 2}
+_WIRE_MAZE = OrderedDict()      # maze_index -> (flags, maze section bytes), LRU
+WIRE_MAZE_CACHE = 256
+
+def wire_maze(maze_index):
+    with LOCK:
+        enc = _WIRE_MAZE.get(maze_index)
+        if enc is not None:
+            _WIRE_MAZE.move_to_end(maze_index)
+            return enc
+    idx = MAZE_INDEX[maze_index]
+    flat = b"".join(idx.grid)
+    # catalogue mazes are stored in wire packing already
+    packed = MAZE_INDEX.packed(maze_index)
+    packed = bytes(packed) if packed is not None else pack_cells(flat)
+    rle = bytearray()
+    for v, run in itertools.groupby(flat):
+        n = sum(1 for _ in run)
+        while n > 0:
+            rle.append(v << 6 | min(n, 64) - 1)
+            n -= 64
+    flags, body = (WIRE_RLE, bytes(rle)) if len(rle) < len(packed) else (0, packed)
+    enc = (flags, struct.pack("<HHI", idx.rows, idx.cols, len(body)) + body)
+    with LOCK:
+        _WIRE_MAZE[maze_index] = enc
+        while len(_WIRE_MAZE) > WIRE_MAZE_CACHE:
+            _WIRE_MAZE.popitem(last=False)
+    return enc
+
+def pack_state(s, res, since, base, oil_removed=()):
+    # binary twin of state_update (+ the reply's status/elapsed/applied)
+    full = since is None or since != base
+    oil = list(s.collected) if full else list(oil_removed)
+    flags = (WIRE_FULL if full else 0) | (WIRE_FINISHED if s.finished else 0)
+    elapsed = res.get("elapsed")
+    if elapsed is not None:
+        flags |= WIRE_ELAPSED
+    maze = b""
+    if full:
+        maze_flags, maze = wire_maze(s.maze_index)
+        flags |= maze_flags
+    coords = [v for e in s.enemies for v in e] + [v for t in oil for v in t]
+    name = s.player_name.encode("utf-8")[:0xffff]
+    return b"".join((
+        WIRE_HEAD.pack(b"CM", 1, flags, WIRE_STATUS.get(res.get("status"), 0), s.tick, s.score,
+                       elapsed or 0.0, res.get("applied", 1), s.player[0], s.player[1], len(s.enemies), len(oil)),
+        struct.pack("<%dH" % len(coords), *coords),
+        struct.pack("<H", len(name)), name, maze))
+
+def wants_wire():
+    # JSON unless the client asked for the binary format by name
+    return request.accept_mimetypes.best_match(["application/json", WIRE_MIME]) == WIRE_MIME
+
 def bfs_shortest(maze, start, goal):
     R = len(maze); C = len(maze[0])
     sr, sc = start; gr, gc = goal
@@ -184,6 +1984,7 @@ def bfs_shortest(maze, start, goal):
             if 0 <= nr < R and 0 <= nc < C and maze[nr][nc] != 1 and (nr,nc) not in prev:
                 prev[(nr,nc)] = (r,c)
                 q.append((nr,nc))
+    count_path_work("bfs", len(prev))
     if (gr,gc) not in prev:
         return []
     # reconstruct
@@ -195,152 +1996,1218 @@ def bfs_shortest(maze, start, goal):
     path.reverse()
     return path
 
+def astar_shortest(maze, start, goal, limit=None):
+    # same contract as bfs_shortest (list of tiles start..goal, [] if none),
+    # guided by Manhattan distance; gives up after `limit` expansions
+    R = len(maze); C = len(maze[0])
+    sr, sc = start; gr, gc = goal
+    if not (0 <= gr < R and 0 <= gc < C): return []
+    if maze[gr][gc] == 1: return []
+    g = {(sr,sc): 0}
+    prev = {(sr,sc): None}
+    # (f, -g, tile): among equal f prefer the deeper node, it is closer to the goal
+    heap = [(abs(sr-gr) + abs(sc-gc), 0, (sr,sc))]
+    expanded = 0
+    while heap:
+        f, ng, cur = heapq.heappop(heap)
+        if cur == (gr,gc):
+            break
+        if -ng != g[cur]:
+            continue
+        expanded += 1
+        if limit is not None and expanded > limit:
+            count_path_work("astar", expanded)
+            return []
+        r, c = cur
+        d = -ng + 1
+        for dr,dc in MOVES:
+            nr, nc = r+dr, c+dc
+            if 0 <= nr < R and 0 <= nc < C and maze[nr][nc] != 1 and d < g.get((nr,nc), d + 1):
+                g[(nr,nc)] = d
+                prev[(nr,nc)] = cur
+                heapq.heappush(heap, (d + abs(nr-gr) + abs(nc-gc), -d, (nr,nc)))
+    count_path_work("astar", expanded)
+    if (gr,gc) not in prev:
+        return []
+    path = []
+    cur = (gr,gc)
+    while cur is not None:
+        path.append(cur)
+        cur = prev[cur]
+    path.reverse()
+    return path
+
 # -------------------------
-# Session actions
+# Enemy steering (reverse BFS distance field)
 # -------------------------
-def step_session_move(sid, direction):
-    s = SESSIONS.get(sid)
-    if not s:
-        return {"error":"Invalid session id"}, 400
-    maze = s["maze"]
-    pr, pc = s["player"]
+# One BFS outward from the player's tile gives every tile its step distance to
+# the player; each enemy then just walks to a neighbour one step "downhill".
+# Walls never change during a game, so a field only depends on the maze and the
+# player's tile and can be shared between sessions and moves.
+MOVES = [(1,0),(-1,0),(0,1),(0,-1)]
+# Fields are flat array('i') (r*cols+c), 4 bytes a tile; the cache is capped
+# by total tiles held, so big mazes take proportionally more of it.
+FIELD_CACHE = {}        # (maze_index, (r,c)) -> distance field
+FIELD_CACHE_MAX_CELLS = int(os.environ.get("FIELD_CACHE_CELLS", 4000000))   # ~16MB
+_field_cells = 0
+
+def distance_field(idx, target):
+    dist, expanded = flat_bfs(b"".join(idx.grid), idx.rows, idx.cols, target[0] * idx.cols + target[1])
+    count_path_work("field", expanded)
+    return dist
+
+def get_distance_field(maze_index, target):
+    global _field_cells
+    key = (maze_index, target)
+    dist = FIELD_CACHE.get(key)
+    FIELD_CACHE_LOOKUPS.inc("miss" if dist is None else "hit")
+    if dist is None:
+        dist = distance_field(MAZE_INDEX[maze_index], target)
+        with LOCK:
+            if key not in FIELD_CACHE:
+                while FIELD_CACHE and _field_cells + len(dist) > FIELD_CACHE_MAX_CELLS:
+                    # drop the oldest entry (dicts keep insertion order)
+                    _field_cells -= len(FIELD_CACHE.pop(next(iter(FIELD_CACHE))))
+                FIELD_CACHE[key] = dist
+                _field_cells += len(dist)
+    return dist
+
+def step_downhill(idx, dist, pos):
+    # next tile for an enemy at pos, or pos itself if already there / unreachable;
+    # neighbours in MOVES order (the batch engine breaks ties the same way)
+    r, c = pos
+    C = idx.cols
+    d = dist[r * C + c]
+    if d <= 0:
+        return pos
+    for dr, dc in MOVES:
+        nr, nc = r + dr, c + dc
+        if 0 <= nr < idx.rows and 0 <= nc < C and dist[nr * C + nc] == d - 1:
+            return (nr, nc)
+    return pos
+
+# -------------------------
+# Oil route solver (par score / bot routes)
+# -------------------------
+# Best score = every reachable oil tile plus the exit; the best route is the
+# order that collects them in the fewest steps. One BFS field per oil tile and
+# the exit gives all pairwise step counts, then a bitmask DP over
+# (collected set, last tile) finds the exact order. Past ROUTE_EXACT_MAX_OIL
+# tiles the 2^n table gets too slow for a request, so the order comes from
+# nearest-neighbour + 2-opt instead ("exact": false). Enemies are ignored.
+# Mazes with more than ROUTE_MAX_OIL oil tiles in all are refused up front.
+# Results, errors included, are cached per maze (least recently used go first).
+ROUTE_EXACT_MAX_OIL = 13
+ROUTE_MAX_OIL = 64
+ROUTE_CACHE = OrderedDict()     # maze_index -> route dict (mazes never change), LRU
+ROUTE_CACHE_MAX = 256
+DIR_NAMES = {(1,0): "down", (-1,0): "up", (0,1): "right", (0,-1): "left"}
+
+def route_order_exact(D, n):
+    # nodes 0..n-1 are oil, n is the start, n+1 the exit; D[a][b] = steps a->b
+    if n == 0:
+        return []
+    INF = float("inf")
+    full = (1 << n) - 1
+    dp = [[INF] * n for _ in range(1 << n)]
+    par = [[-1] * n for _ in range(1 << n)]
+    for j in range(n):
+        dp[1 << j][j] = D[n][j]
+    for mask in range(1, full):
+        row = dp[mask]
+        for i in range(n):
+            d = row[i]
+            if d == INF:
+                continue
+            Di = D[i]
+            for j in range(n):
+                if mask >> j & 1:
+                    continue
+                m2 = mask | 1 << j
+                if d + Di[j] < dp[m2][j]:
+                    dp[m2][j] = d + Di[j]
+                    par[m2][j] = i
+    last = min(range(n), key=lambda j: dp[full][j] + D[j][n+1])
+    order, mask = [], full
+    while last >= 0:
+        order.append(last)
+        mask, last = mask ^ (1 << last), par[mask][last]
+    order.reverse()
+    return order
+
+def route_order_greedy(D, n):
+    # nearest neighbour from the start, then 2-opt with both ends pinned
+    order, left, cur = [], set(range(n)), n
+    while left:
+        cur = min(left, key=lambda j: D[cur][j])
+        left.discard(cur)
+        order.append(cur)
+    tour = [n] + order + [n+1]
+    improved = True
+    while improved:
+        improved = False
+        for a in range(len(tour) - 3):
+            for b in range(a + 2, len(tour) - 1):
+                p, q, x, y = tour[a], tour[a+1], tour[b], tour[b+1]
+                if D[p][x] + D[q][y] < D[p][q] + D[x][y]:
+                    tour[a+1:b+1] = tour[a+1:b+1][::-1]
+                    improved = True
+    return tour[1:-1]
+
+def solve_route(maze_index):
+    with LOCK:
+        route = ROUTE_CACHE.get(maze_index)
+        if route is not None:
+            ROUTE_CACHE.move_to_end(maze_index)
+            return route
+    idx = MAZE_INDEX[maze_index]
+    if idx.exit is None:
+        route = {"error": "maze has no exit"}
+    elif len(idx.oil) > ROUTE_MAX_OIL:
+        # before any BFS: a maze this oily is refused whatever is reachable
+        route = {"error": "too many oil tiles (%d > %d)" % (len(idx.oil), ROUTE_MAX_OIL)}
+    else:
+        route = _solve_route(idx)
+    with LOCK:
+        ROUTE_CACHE[maze_index] = route     # errors too; the maze won't change
+        while len(ROUTE_CACHE) > ROUTE_CACHE_MAX:
+            ROUTE_CACHE.popitem(last=False)
+    return route
+
+def _solve_route(idx):
+    exit_field = distance_field(idx, idx.exit)
+    C = idx.cols
+    if exit_field[idx.start[0] * C + idx.start[1]] < 0:
+        return {"error": "exit unreachable"}
+    # oil the player can actually reach (same component as the start)
+    oil = sorted(t for t in idx.oil if exit_field[t[0] * C + t[1]] >= 0)
+    n = len(oil)
+    fields = [distance_field(idx, t) for t in oil] + [None, exit_field]
+    nodes = oil + [idx.start, idx.exit]
+    # D[a][b] = steps from node a to node b, read off b's field
+    D = [[fields[b][nodes[a][0] * C + nodes[a][1]] if fields[b] else 0 for b in range(n + 2)]
+         for a in range(n + 2)]
+    exact = n <= ROUTE_EXACT_MAX_OIL
+    order = route_order_exact(D, n) if exact else route_order_greedy(D, n)
+    # walk each leg downhill on the next target's field to get the moves
+    dirs, cur = [], idx.start
+    for k in order + [n + 1]:
+        while cur != nodes[k]:
+            nxt = step_downhill(idx, fields[k], cur)
+            dirs.append(DIR_NAMES[(nxt[0] - cur[0], nxt[1] - cur[1])])
+            cur = nxt
+    route = {
+        "maze": idx.name,
+        "order": [list(oil[k]) for k in order],
+        "steps": len(dirs),
+        "par_score": 25 * n + 200,
+        "oil_total": len(idx.oil),
+        "oil_unreachable": len(idx.oil) - n,
+        "exact": exact,
+        "dirs": dirs,
+    }
+    return route
+
+# -------------------------
+# Vectorized batch tick (NumPy)
+# -------------------------
+# Advances the enemies of many sessions at once, independent of player input.
+# Per maze: the distance field for each distinct player tile comes from
+# FIELD_CACHE (the same flat_bfs fields the scalar path uses), then every
+# enemy gathers its four neighbours' distances in one NumPy pass and steps to
+# the first one a step closer (same tie-break as step_downhill). Unlike
+# apply_move, all enemies of a session move before the catch check, as in
+# world_step. Sessions are read, simulated and written back optimistically:
+# a session whose tick changed meanwhile is skipped this round.
+VECTOR_MAX_TILES = ENEMY_FIELD_MAX_TILES
+VECTOR_CHUNK_CELLS = 8000000    # K*tiles field cells stacked per gather (~32MB)
+
+def vector_step(maze_index, players, enemies, owner):
+    # players: [(r, c)] per session, enemies: (N, 2) int64, owner: (N,) session row
+    # per enemy -> new enemy positions (N, 2) and caught flags (S,)
+    idx = MAZE_INDEX[maze_index]
+    R, C = idx.rows, idx.cols
+    targets = sorted(set(players))
+    slot = {t: k for k, t in enumerate(targets)}
+    field_of = np.array([slot[p] for p in players], dtype=np.int64)
+    moves = np.array(MOVES, dtype=np.int64)
+    new = enemies.copy()
+    chunk = max(1, VECTOR_CHUNK_CELLS // (R * C))
+    for k0 in range(0, len(targets), chunk):
+        fields = np.stack([np.frombuffer(get_distance_field(maze_index, t), dtype=np.int32)
+                           for t in targets[k0:k0 + chunk]])
+        sel = np.nonzero((field_of[owner] >= k0) & (field_of[owner] < k0 + chunk))[0]
+        if not len(sel):
+            continue
+        k = field_of[owner[sel]] - k0
+        er, ec = enemies[sel, 0], enemies[sel, 1]
+        d = fields[k, er * C + ec]
+        nr = er[:, None] + moves[None, :, 0]
+        nc = ec[:, None] + moves[None, :, 1]
+        inside = (nr >= 0) & (nr < R) & (nc >= 0) & (nc < C)
+        nd = np.where(inside, fields[k[:, None], np.where(inside, nr * C + nc, 0)], -2)
+        downhill = nd == (d - 1)[:, None]
+        go = downhill.any(axis=1) & (d > 0)
+        first = downhill.argmax(axis=1)
+        rows = np.arange(len(sel))
+        new[sel, 0] = np.where(go, nr[rows, first], er)
+        new[sel, 1] = np.where(go, nc[rows, first], ec)
+    hit = (new == np.array(players, dtype=np.int64)[owner]).all(axis=1)
+    caught = np.zeros(len(players), dtype=bool)
+    caught[owner[hit]] = True
+    return new, caught
+
+def batch_tick(sids=None, touch=True):
+    # one world tick for every live, unfinished session (or the given ids);
+    # the scheduler passes touch=False so its ticks don't keep sessions alive
+    if np is None:
+        raise RuntimeError("batch tick needs numpy")
+    snaps = {}      # maze_index -> [(sid, tick, player, enemies)]
+    for sid in (SESSIONS.keys() if sids is None else sids):
+        with SESSIONS.locked(sid, write=False, touch=touch) as s:
+            if s and not s.finished and s.enemies:
+                snaps.setdefault(s.maze_index, []).append((sid, s.tick, s.player, list(s.enemies)))
+    applied = 0
+    for maze_index, rows in snaps.items():
+        idx = MAZE_INDEX[maze_index]
+        if idx.tiles > VECTOR_MAX_TILES:
+            continue
+        players = [r[2] for r in rows]
+        enemies = np.array([e for r in rows for e in r[3]], dtype=np.int64)
+        owner = np.repeat(np.arange(len(rows)), [len(r[3]) for r in rows])
+        new, caught = vector_step(maze_index, players, enemies, owner)
+        new, caught = list(map(tuple, new.tolist())), caught.tolist()
+        now = time.time()
+        off = 0
+        for i, (sid, tick, _, old) in enumerate(rows):
+            moved = new[off:off + len(old)]
+            off += len(old)
+            with SESSIONS.locked(sid, touch=touch) as s:
+                if s is None or s.tick != tick:
+                    continue    # player moved meanwhile; catch up next round
+                s.record(None, now)
+                s.enemies = moved
+                s.tick += 1
+                if caught[i]:
+                    s.score = max(0, s.score - 50)
+                    s.player = idx.start
+                applied += 1
+    return {"mazes": len(snaps), "sessions": sum(len(r) for r in snaps.values()), "applied": applied}
+
+# -------------------------
+# Room event streams (Server-Sent Events)
+# -------------------------
+# Each race room fans out opponent positions, finishes and final standings to
+# every subscribed client, so nobody has to poll. Subscribers get a bounded
+# queue; a slow reader just misses position snapshots, never blocks a move.
+ROOM_SUBSCRIBERS = {}   # room_id -> [queue.Queue]
+ROOM_QUEUE_MAX = 256
+ROOM_HEARTBEAT = 15     # seconds between keep-alive comments
+
+def room_subscribe(rid):
+    q = queue.Queue(maxsize=ROOM_QUEUE_MAX)
+    with LOCK:
+        ROOM_SUBSCRIBERS.setdefault(rid, []).append(q)
+    return q
+
+def room_unsubscribe(rid, q):
+    with LOCK:
+        subs = ROOM_SUBSCRIBERS.get(rid)
+        if subs and q in subs:
+            subs.remove(q)
+            if not subs:
+                del ROOM_SUBSCRIBERS[rid]
+
+def room_publish(rid, event, data):
+    # event=None closes the streams
+    msg = None if event is None else "event: %s\ndata: %s\n\n" % (event, json.dumps(data))
+    for q in list(ROOM_SUBSCRIBERS.get(rid, ())):
+        try:
+            q.put_nowait(msg)
+        except queue.Full:
+            pass
+
+def room_snapshot(rid):
+    with ROOMS.locked(rid, write=False) as room:
+        if room is None:
+            return None
+        sids = list(room["sessions"])
+        info = room_info(rid, room)
+        results = room_standings(room)
+    snap = []
+    for sid in sids:
+        with SESSIONS.locked(sid, write=False) as s:
+            if s:
+                snap.append(progress(sid, s))
+    return dict(info, sessions=snap, results=results)
+
+def progress(sid, s):
+    # caller holds the session entry
+    return {"session_id": sid, "player_name": s.player_name, "player": s.player,
+            "score": s.score, "finished": s.finished}
+
+def publish_progress(sid, s, status, elapsed):
+    rid = s.room
+    if not rid or rid not in ROOM_SUBSCRIBERS:
+        return
+    room_publish(rid, "position", progress(sid, s))
+    if status == "win":
+        room_publish(rid, "finish", {"session_id": sid, "player": s.player_name,
+                                     "time": elapsed, "score": s.score})
+
+MAX_BATCH_MOVES = 64    # cap on inputs accepted by one /moves call
+ENEMY_CHASE_RADIUS = 40     # big mazes: enemies farther than this (Manhattan) wait
+ENEMY_SEARCH_LIMIT = 2000   # A* expansions per enemy step on big mazes
+ROOM_ENEMIES_DEFAULT = DIFFICULTY_LEVELS["normal"]["enemies"]
+MAX_ROOM_ENEMIES = 32
+
+def move_player(s, direction, now):
+    # the player's half of a move; returns (status, elapsed, oil tiles removed)
+    removed = []
+    idx = MAZE_INDEX[s.maze_index]
+    maze = idx.grid
+    pr, pc = s.player
     dr = dc = 0
     if direction == "up": dr = -1
     elif direction == "down": dr = 1
     elif direction == "left": dc = -1
     elif direction == "right": dc = 1
     nr, nc = pr + dr, pc + dc
-    R = len(maze); C = len(maze[0])
-    if not (0 <= nr < R and 0 <= nc < C):
-        return {"ok":True, "state":s}
+    if not (0 <= nr < idx.rows and 0 <= nc < idx.cols):
+        return None, None, removed
     if maze[nr][nc] != 1:
-        s["player"] = [nr, nc]
-        if maze[nr][nc] == 2:
-            maze[nr][nc] = 0
-            s["score"] += 25
+        s.player = (nr, nc)
+        if maze[nr][nc] == 2 and (nr,nc) not in s.collected:
+            s.collected.add((nr,nc))
+            removed.append((nr,nc))
+            s.score += 25
         # check exit
         if maze[nr][nc] == 3:
-            s["finished"] = True
-            s["finish_time"] = time.time()
-            # record score
-            elapsed = s["finish_time"] - s["start_time"]
-            s["score"] += 200
-            save_score({"player": s["player_name"], "maze": MAZES[s["maze_index"]]["name"], "time": elapsed, "score": s["score"], "when": time.time()})
-            return {"ok":True, "state":s, "status":"win", "elapsed": elapsed}
-    # move enemies toward player (BFS one step)
-    exit_coord = None
-    for r_ in range(len(maze)):
-        for c_ in range(len(maze[0])):
-            if maze[r_][c_] == 3:
-                exit_coord = (r_, c_)
-                break
-        if exit_coord: break
-    # enemies move
-    for i, e in enumerate(s["enemies"]):
-        path = bfs_shortest(maze, tuple(e), tuple(s["player"]))
-        if len(path) >= 2:
-            s["enemies"][i] = list(path[1])
+            s.finished = True
+            s.finish_time = now
+            elapsed = s.finish_time - s.start_time
+            s.score += 200
+            return "win", elapsed, removed
+    return None, None, removed
+
+def enemy_stepper(s, idx):
+    # one step downhill on the shared distance field, or on big mazes one A*
+    # step each (an enemy that can't find the player waits)
+    if idx.tiles <= ENEMY_FIELD_MAX_TILES:
+        dist = get_distance_field(s.maze_index, s.player)
+        return lambda e: step_downhill(idx, dist, e)
+    pr, pc = s.player
+    def step(e):
+        if abs(e[0]-pr) + abs(e[1]-pc) > ENEMY_CHASE_RADIUS:
+            return e
+        path = astar_shortest(idx.grid, e, s.player, limit=ENEMY_SEARCH_LIMIT)
+        return path[1] if len(path) >= 2 else e
+    return step
+
+def apply_move(s, direction, now=None):
+    # advance one session by one input; returns (status, elapsed, oil tiles removed)
+    if now is None:
+        now = time.time()
+    s.record(direction, now)
+    s.tick += 1
+    idx = MAZE_INDEX[s.maze_index]
+    status, elapsed, removed = move_player(s, direction, now)
+    if status:
+        return status, elapsed, removed
+    # move enemies toward player
+    step = enemy_stepper(s, idx)
+    for i, e in enumerate(s.enemies):
+        s.enemies[i] = step(e)
         # collision
-        if s["enemies"][i][0] == s["player"][0] and s["enemies"][i][1] == s["player"][1]:
+        if s.enemies[i][0] == s.player[0] and s.enemies[i][1] == s.player[1]:
             # player caught: reset to start (but keep score penalty)
-            s["score"] = max(0, s["score"] - 50)
-            # respawn player at initial start (first tile with 0)
-            start = None
-            for rr in range(len(maze)):
-                for cc in range(len(maze[0])):
-                    if maze[rr][cc] == 0:
-                        start = (rr,cc); break
-                if start: break
-            s["player"] = list(start)
-            return {"ok":True, "state":s, "status":"caught"}
-    return {"ok":True, "state":s}
+            s.score = max(0, s.score - 50)
+            # respawn player at initial start
+            s.player = idx.start
+            return "caught", None, removed
+    return None, None, removed
+
+def record_win(s, elapsed):
+    save_score({"player": s.player_name, "maze": MAZE_INDEX.name(s.maze_index),
+                "time": elapsed, "score": s.score, "when": time.time()})
+
+def step_session_move(sid, direction, since=None, wire=False):
+    with SESSIONS.locked(sid) as s:
+        if not s:
+            return {"error":"Invalid session id"}, 400
+        base = s.tick
+        work = path_work()
+        status, elapsed, removed = apply_move(s, direction)
+        MOVE_NODES.observe(path_work() - work)
+        if status == "win":
+            record_win(s, elapsed)
+        res = {"ok": True}
+        if status:
+            res["status"] = status
+        if elapsed is not None:
+            res["elapsed"] = elapsed
+        publish_progress(sid, s, status, elapsed)
+        if wire:
+            return pack_state(s, res, since, base, removed)
+        res.update(state_update(s, since, base, removed))
+    return res
+
+def step_session_moves(sid, directions, since=None, wire=False):
+    # apply buffered inputs in order, stopping at the first win or catch
+    with SESSIONS.locked(sid) as s:
+        if not s:
+            return {"error":"Invalid session id"}, 400
+        base = s.tick
+        removed = []
+        events = []
+        res = {"ok": True}
+        for direction in directions[:MAX_BATCH_MOVES]:
+            work = path_work()
+            status, elapsed, oil = apply_move(s, direction)
+            MOVE_NODES.observe(path_work() - work)
+            if status == "win":
+                record_win(s, elapsed)
+            removed.extend(oil)
+            ev = {"dir": direction, "player": s.player, "score": s.score}
+            if status:
+                ev["status"] = res["status"] = status
+            if elapsed is not None:
+                ev["elapsed"] = res["elapsed"] = elapsed
+            events.append(ev)
+            if status:
+                break
+        res["applied"] = len(events)
+        res["events"] = events
+        publish_progress(sid, s, res.get("status"), res.get("elapsed"))
+        if wire:
+            return pack_state(s, res, since, base, removed)
+        res.update(state_update(s, since, base, removed))
+    return res
+
+# -------------------------
+# Race rooms
+# -------------------------
+# A room holds up to `capacity` racers on one maze and goes
+#   open     -> taking joins; a racer who finishes early waits for the rest
+#   racing   -> full, or started by a member; no more joins
+#   complete -> every member has a result, or RACE_TIMEOUT ran out
+#   expired  -> evicted by the store sweeper, ROOM_DONE_TTL after it completes
+#               or sits open and unfilled past ROOM_OPEN_TTL (ROOM_TTL if idle)
+# Standings are a [time, session_id] list kept sorted by bisect.insort as
+# results come in, so a submission never re-sorts the room. OPEN_ROOMS indexes
+# open rooms by maze for matchmaking; it is per process (with the SQLite
+# backend a worker lists the rooms it created) and every hit is re-checked
+# against the store, so stale ids just drop out.
+MAX_ROOM_PLAYERS = 16
+ROOM_OPEN_TTL = float(os.environ.get("ROOM_OPEN_TTL", 600))
+RACE_TIMEOUT = float(os.environ.get("RACE_TIMEOUT", 900))
+OPEN_ROOMS = {}         # maze_index -> OrderedDict(room_id -> None), oldest first
+
+def new_room(maze_index, sessions=(), enemies=ROOM_ENEMIES_DEFAULT, capacity=2, level=None):
+    rid = str(uuid.uuid4())[:8]
+    ROOMS[rid] = {"maze_index": maze_index, "sessions": list(sessions), "results": {}, "standings": [],
+                  "state": "open", "capacity": capacity, "enemies": enemies,
+                  "difficulty": level or DEFAULT_DIFFICULTY,
+                  "created": time.time(), "started": None}
+    with LOCK:
+        OPEN_ROOMS.setdefault(maze_index, OrderedDict())[rid] = None
+    return rid
+
+def unlist_room(rid, maze_index=None):
+    with LOCK:
+        for rooms in (OPEN_ROOMS.values() if maze_index is None else [OPEN_ROOMS.get(maze_index, {})]):
+            if rid in rooms:
+                del rooms[rid]
+                break
+
+def start_race(rid, room, now):
+    # open -> racing (room entry held); True if the race starts now
+    if room["state"] != "open":
+        return False
+    room["state"] = "racing"
+    room["started"] = now
+    unlist_room(rid, room["maze_index"])
+    return True
+
+def finish_race(room, now):
+    # racing -> complete once everyone has a result or time ran out;
+    # True if the race completes now
+    if room["state"] != "racing":
+        return False
+    if len(room["results"]) >= len(room["sessions"]) or now - room["started"] > RACE_TIMEOUT:
+        room["state"] = "complete"
+        return True
+    return False
+
+def room_done(room):
+    # the store's is_done: finished, or abandoned long enough to drop
+    now = time.time()
+    return (room["state"] == "complete"
+            or (room["state"] == "open" and now - room["created"] > ROOM_OPEN_TTL)
+            or (room["state"] == "racing" and now - room["started"] > RACE_TIMEOUT))
+
+def room_standings(room):
+    return [dict(room["results"][sid], session_id=sid, rank=i + 1)
+            for i, (_, sid) in enumerate(room["standings"])]
+
+def room_info(rid, room):
+    return {"room": rid, "maze_index": room["maze_index"], "state": room["state"],
+            "players": len(room["sessions"]), "capacity": room["capacity"], "enemies": room["enemies"],
+            "difficulty": room.get("difficulty", DEFAULT_DIFFICULTY),
+            "created": room["created"], "started": room["started"]}
+
+def open_rooms(maze_index, limit=50):
+    # oldest open rooms with a free seat on this maze
+    with LOCK:
+        candidates = list(OPEN_ROOMS.get(maze_index, ()))
+    found = []
+    for rid in candidates:
+        with ROOMS.locked(rid, write=False) as room:
+            info = room_info(rid, room) if room and room["state"] == "open" else None
+        if info is None:
+            unlist_room(rid, maze_index)
+        elif info["players"] < info["capacity"]:
+            found.append(info)
+            if len(found) >= limit:
+                break
+    return found
+
+def close_overdue_rooms():
+    # sweeper: complete races past RACE_TIMEOUT so their streams get final standings
+    now = time.time()
+    for rid in ROOMS.keys():
+        with ROOMS.locked(rid, write=False) as room:
+            overdue = room is not None and room["state"] == "racing" and now - room["started"] > RACE_TIMEOUT
+        if not overdue:
+            continue
+        with ROOMS.locked(rid) as room:
+            closed = room is not None and finish_race(room, now)
+            results = room_standings(room) if closed else None
+        if closed:
+            room_publish(rid, "standings", {"status": "complete", "timed_out": True, "results": results})
+            room_publish(rid, None, None)
+
+# -------------------------
+# Run replay & verification
+# -------------------------
+# Re-simulates a run log through the same apply_move rules from the recorded
+# seed. Used to check race submissions, to serve ghost runs, and (through
+# verify_run on exported records, see replay.py) to audit runs offline.
+ELAPSED_TOLERANCE = 0.002       # log times are whole ms
+
+def world_step(s):
+    # batch_tick's rules for one session: every enemy steps, then the catch check
+    idx = MAZE_INDEX[s.maze_index]
+    step = enemy_stepper(s, idx)
+    s.enemies = [step(e) for e in s.enemies]
+    s.tick += 1
+    if s.player in s.enemies:
+        s.score = max(0, s.score - 50)
+        s.player = idx.start
+        return "caught"
+    return None
+
+def replay_run(maze_index, seed, spawn, log, log_t, frames=None, level=""):
+    # -> replayed Session (start_time 0, so finish_time is the elapsed time);
+    # frames, if given, collects (ms, r, c) of the player after every entry
+    idx = MAZE_INDEX[maze_index]
+    s = Session(maze_index, "", idx.start, place_enemies(idx, spawn, seed, level), seed, level)
+    s.log = None
+    s.start_time = 0.0
+    for n, t in enumerate(log_t):
+        kind, ms = t & ~LOG_MS_MAX, t & LOG_MS_MAX
+        if kind == LOG_WORLD:
+            world_step(s)
+        elif kind == LOG_INPUT:
+            s.tick += 1
+            move_player(s, LOG_DIRS[log[n >> 2] >> ((n & 3) * 2) & 3], ms / 1000.0)
+        else:
+            direction = LOG_DIRS[log[n >> 2] >> ((n & 3) * 2) & 3] if kind == LOG_MOVE else "none"
+            apply_move(s, direction, ms / 1000.0)
+        if frames is not None:
+            frames.append((ms, s.player[0], s.player[1]))
+    return s
+
+def check_replay(r, score, finished, elapsed, entries, tick):
+    # compare a replayed Session with what was claimed; None if it matches
+    if entries >= MAX_LOG_MOVES:
+        return "run log truncated"
+    if entries != tick:
+        return "log has %d entries for %d ticks" % (entries, tick)
+    if r.score != score:
+        return "score %d, replay gives %d" % (score, r.score)
+    if r.finished != bool(finished):
+        return "finished mismatch"
+    if finished and abs(r.finish_time - elapsed) > ELAPSED_TOLERANCE:
+        return "time %.3f, replay gives %.3f" % (elapsed, r.finish_time)
+    return None
+
+def verify_session(s):
+    # {"ok", "score", "elapsed", "error"} for a live session, from its own log
+    r = replay_run(s.maze_index, s.seed, s.spawn, s.log, s.log_t, level=s.level)
+    elapsed = s.finish_time - s.start_time if s.finished else None
+    err = check_replay(r, s.score, s.finished, elapsed, len(s.log_t), s.tick)
+    return {"ok": err is None, "score": r.score, "elapsed": r.finish_time if r.finished else None, "error": err}
+
+# -------------------------
+# Real-time mode (REALTIME=1)
+# -------------------------
+# A background scheduler runs the world on a fixed timestep instead of on
+# player input. Request handlers only queue inputs on the session
+# (Session.pending) and reply with the latest snapshot. Every tick the
+# scheduler applies up to TICK_INPUTS queued inputs per session (player only,
+# logged as LOG_INPUT), then steps every live session's enemies once with
+# world_step (sessions share distance fields per maze and player tile).
+# TICK_BATCH=1 (needs numpy) steps them per maze through batch_tick instead;
+# same results, but it is only about even with the scalar path on big mazes
+# and slower on small ones, so it is off by default.
+# A tick that takes longer than its budget is an overrun; when the loop falls
+# more than TICK_MAX_LAG ticks behind it drops them instead of bursting.
+# With the SQLite state backend one process wins an flock and schedules; the
+# others only queue.
+REALTIME = os.environ.get("REALTIME", "") not in ("", "0")
+TICK_HZ = float(os.environ.get("TICK_HZ", 10))
+TICK_INPUTS = int(os.environ.get("TICK_INPUTS", 2))     # inputs applied per session per tick
+TICK_MAX_LAG = 5
+TICK_BATCH = os.environ.get("TICK_BATCH", "") not in ("", "0")
+MAX_PENDING_INPUTS = 16         # queued inputs per session; extras are dropped
+# enemies stop (and the run log stops growing) for a session whose player has
+# sent nothing for this long; the scheduler never refreshes a session's idle
+# timer, so an abandoned one still expires after SESSION_TTL
+TICK_IDLE_AFTER = float(os.environ.get("TICK_IDLE_AFTER", 30))
+
+def apply_pending(sid, s, now):
+    # the scheduler's input phase for one session (session lock held)
+    status = elapsed = None
+    removed = []
+    take = s.pending[:TICK_INPUTS]
+    del s.pending[:TICK_INPUTS]
+    for code in take:
+        direction = LOG_DIRS[code]
+        s.record(direction, now, player_only=True)
+        s.tick += 1
+        status, elapsed, oil = move_player(s, direction, now)
+        removed.extend(oil)
+        if status == "win":
+            s.pending.clear()
+            record_win(s, elapsed)
+            break
+    publish_progress(sid, s, status, elapsed)
+    return removed
+
+
+class TickScheduler:
+    def __init__(self, hz):
+        self.period = 1.0 / hz
+        self.ticks = 0
+        self.overruns = 0
+        self.dropped_ticks = 0
+        self.backlog = 0                # inputs still queued after the last tick
+        self.sessions = 0               # live sessions in the last tick
+        self.idle = 0                   # of those, paused for TICK_IDLE_AFTER
+        self.last = self.worst = self.avg = 0.0
+        self.leader = False
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="tick-scheduler", daemon=True)
+                t.start()
+                self._thread = t
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _lead(self):
+        # in-memory state is per process, so every process ticks its own;
+        # a shared SQLite store gets exactly one ticking process
+        if self.leader or not isinstance(SESSIONS, SQLiteStore):
+            self.leader = True
+            return True
+        if fcntl is None:
+            # no flock here: assume this is the only worker
+            app.logger.warning("no fcntl; run a single worker with REALTIME and STATE_BACKEND=sqlite")
+            self.leader = True
+            return True
+        f = open(SESSIONS.path + ".tick", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f         # held (and the lock with it) for the process lifetime
+        self.leader = True
+        return True
+
+    def _run(self):
+        next_t = time.perf_counter()
+        while not self._stop.is_set():
+            if not self._lead():
+                self._stop.wait(1.0)
+                next_t = time.perf_counter()
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.tick()
+            except Exception as exc:
+                app.logger.error("tick failed: %s", exc)
+            dt = time.perf_counter() - t0
+            self.ticks += 1
+            self.last = dt
+            self.worst = max(self.worst, dt)
+            self.avg = dt if self.ticks == 1 else 0.95 * self.avg + 0.05 * dt
+            TICK_SECONDS.observe(dt)
+            if dt > self.period:
+                self.overruns += 1
+                TICK_OVERRUNS.inc()
+            next_t += self.period
+            delay = next_t - time.perf_counter()
+            if delay < -TICK_MAX_LAG * self.period:
+                # too far behind: skip the missed ticks rather than run them back to back
+                missed = int(-delay / self.period)
+                self.dropped_ticks += missed
+                next_t += missed * self.period
+                delay = next_t - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+
+    def tick(self):
+        now = time.time()
+        by_maze = {}
+        backlog = live = idle = 0
+        for sid in SESSIONS.keys():
+            with SESSIONS.locked(sid, write=False, touch=False) as s:
+                if not s or s.finished:
+                    continue
+                busy, maze_index, last_input = bool(s.pending), s.maze_index, s.last_input
+            live += 1
+            if not busy and now - last_input > TICK_IDLE_AFTER:
+                idle += 1
+                continue
+            if busy:
+                with SESSIONS.locked(sid, touch=False) as s:
+                    if s and not s.finished:
+                        apply_pending(sid, s, now)
+                        backlog += len(s.pending)
+            by_maze.setdefault(maze_index, []).append(sid)
+        for maze_index, sids in by_maze.items():
+            if TICK_BATCH and np is not None and MAZE_INDEX[maze_index].tiles <= VECTOR_MAX_TILES:
+                batch_tick(sids, touch=False)
+                continue
+            for sid in sids:
+                with SESSIONS.locked(sid, touch=False) as s:
+                    if s and not s.finished and s.enemies:
+                        s.record(None, now)
+                        world_step(s)
+        self.backlog = backlog
+        self.sessions = live
+        self.idle = idle
+
+    def stats(self):
+        return {"hz": 1.0 / self.period, "budget_ms": 1000 * self.period, "leader": self.leader,
+                "ticks": self.ticks, "overruns": self.overruns, "dropped_ticks": self.dropped_ticks,
+                "last_ms": 1000 * self.last, "avg_ms": 1000 * self.avg, "worst_ms": 1000 * self.worst,
+                "backlog": self.backlog, "sessions": self.sessions, "idle": self.idle}
+
+TICK_SECONDS = Histogram("carmaze_tick_seconds", "Real-time scheduler tick duration", LATENCY_BUCKETS)
+TICK_OVERRUNS = Counter("carmaze_tick_overruns_total", "Scheduler ticks that ran past their budget")
+SCHEDULER = TickScheduler(TICK_HZ) if REALTIME else None
+if SCHEDULER:
+    Gauge("carmaze_tick_backlog", "Inputs still queued after the last tick", lambda: SCHEDULER.backlog)
+    SCHEDULER.start()
+    atexit.register(SCHEDULER.stop)
+
+def snapshot_update(s, since):
+    # latest state for a client at any earlier version: the delta lists every
+    # collected tile (clearing one twice is harmless), so only a client with
+    # no or a future version needs the whole maze
+    if since is None or since > s.tick:
+        return {"version": s.tick, "full": full_state(s)}
+    return state_update(s, since, since, s.collected)
+
+def queue_inputs(sid, directions, since=None, wire=False):
+    # real-time /move and /moves: queue, don't simulate
+    with SESSIONS.locked(sid) as s:
+        if not s:
+            return {"error":"Invalid session id"}, 400
+        codes = [LOG_CODES[d] for d in directions if d in LOG_CODES]
+        codes = codes[:max(0, MAX_PENDING_INPUTS - len(s.pending))] if not s.finished else []
+        s.pending.extend(codes)
+        s.last_input = time.time()
+        res = {"ok": True, "queued": len(codes), "pending": len(s.pending)}
+        if wire:
+            res["applied"] = 0
+            return pack_state(s, res, since, since if since is not None and since <= s.tick else None, s.collected)
+        res.update(snapshot_update(s, since))
+    return res
+
+def run_record(s):
+    # portable, JSON-safe copy of a run for ghosts and offline verification
+    return {
+        "maze": MAZE_INDEX.name(s.maze_index),
+        "maze_index": s.maze_index,
+        "player": s.player_name,
+        "seed": s.seed,
+        "spawn": s.spawn,
+        "level": s.level,
+        "tick": s.tick,
+        "score": s.score,
+        "finished": s.finished,
+        "elapsed": s.finish_time - s.start_time if s.finished else None,
+        "log": base64.b64encode(bytes(s.log)).decode("ascii"),
+        "log_t": base64.b64encode(s.log_t.tobytes()).decode("ascii"),
+    }
+
+def verify_run(rec):
+    # check an exported run record against a fresh replay; {"ok", ..., "error"}
+    maze_index = rec.get("maze_index")
+    if not (isinstance(maze_index, int) and MAZE_INDEX.has(maze_index)
+            and MAZE_INDEX.name(maze_index) == rec.get("maze")):
+        maze_index = MAZE_INDEX.find(rec.get("maze"))
+        if maze_index is None:
+            return {"ok": False, "error": "unknown maze %r" % rec.get("maze")}
+    try:
+        log = base64.b64decode(rec["log"])
+        log_t = array.array("I")
+        log_t.frombytes(base64.b64decode(rec["log_t"]))
+        if len(log) < (len(log_t) + 3) // 4:
+            raise ValueError("short move log")
+        r = replay_run(maze_index, int(rec["seed"]), int(rec["spawn"]), log, log_t, level=rec.get("level", ""))
+    except (KeyError, TypeError, ValueError) as exc:
+        return {"ok": False, "error": "bad record: %s" % exc}
+    err = check_replay(r, rec.get("score"), rec.get("finished"), rec.get("elapsed"), len(log_t),
+                       rec.get("tick", len(log_t)))
+    return {"ok": err is None, "score": r.score, "elapsed": r.finish_time if r.finished else None,
+            "steps": len(log_t), "error": err}
+
+def room_join_error(room_obj, maze_index):
+    if not room_obj:
+        return "No such room"
+    if room_obj["maze_index"] != maze_index:
+        return "Maze mismatch"
+    if room_obj["state"] != "open":
+        return "Room is not open"
+    if len(room_obj["sessions"]) >= room_obj["capacity"]:
+        return "Room is full"
+    return None
+
+def add_to_room(rid, sid, maze_index):
+    # returns an error message, or None once the session is in the room;
+    # the join that fills the room starts the race
+    with ROOMS.locked(rid) as room_obj:
+        err = room_join_error(room_obj, maze_index)
+        if err:
+            return err
+        room_obj["sessions"].append(sid)
+        started = len(room_obj["sessions"]) >= room_obj["capacity"] and start_race(rid, room_obj, time.time())
+        info = room_info(rid, room_obj)
+    with SESSIONS.locked(sid) as s:
+        s.room = rid
+        joined = progress(sid, s)
+    room_publish(rid, "joined", joined)
+    if started:
+        room_publish(rid, "racing", info)
+    return None
+
+# -------------------------
+# Response encoding & conditional GET
+# -------------------------
+# The index page is rendered and compressed once per maze list (MAZE_INDEX
+# only ever grows; its names come from the catalogue index, nothing is
+# decoded) and served with a strong ETag. Leaderboard pages get an ETag from
+# the leaderboard version, so an unchanged board costs a 304 and no JSON.
+# Other JSON is gzipped on the fly once it passes COMPRESS_MIN_BYTES.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5              # on-the-fly gzip; the index page uses 9
+PROCESS_TAG = uuid.uuid4().hex[:8]  # versions are per process; keep ETags apart across workers
+_INDEX_PAGE = None              # (len(MAZE_INDEX), etag, {encoding: body})
+
+def pick_encoding(available):
+    for enc in ("br", "gzip"):
+        if enc in available and request.accept_encodings[enc]:
+            return enc
+    return "identity"
+
+def encoded(bodies, mimetype, etag=None):
+    # bodies: {"identity": bytes, "gzip": bytes, "br": bytes}, any subset but identity
+    enc = pick_encoding(bodies)
+    resp = Response(bodies[enc], mimetype=mimetype)
+    resp.headers["Vary"] = "Accept-Encoding"
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    if etag:
+        # strong ETags name one exact byte sequence, so each encoding gets its own
+        resp.set_etag(etag if enc == "identity" else "%s-%s" % (etag, enc))
+        resp.headers["Cache-Control"] = "no-cache"
+        resp = resp.make_conditional(request)
+    return resp
+
+def body_response(body, mimetype, etag=None):
+    bodies = {"identity": body}
+    if len(body) >= COMPRESS_MIN_BYTES and request.accept_encodings["gzip"]:
+        bodies["gzip"] = gzip.compress(body, COMPRESS_LEVEL)
+    return encoded(bodies, mimetype, etag)
+
+def json_response(obj, etag=None):
+    return body_response(json.dumps(obj, separators=(",", ":")).encode("utf-8"), "application/json", etag)
+
+def not_modified(etag):
+    # cheap 304 before building a body; matches any encoding of the same version
+    tags = request.if_none_match
+    if etag and tags and any(tags.contains(t) for t in (etag, etag + "-gzip", etag + "-br")):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return None
+
+def index_page():
+    global _INDEX_PAGE
+    page = _INDEX_PAGE
+    if page is None or page[0] != len(MAZE_INDEX):
+        names = MAZE_INDEX.names()
+        n = len(names)
+        html = render_template_string(INDEX_HTML, mazes=[{"idx":i,"name":name} for i,name in enumerate(names)],
+                                      tick_hz=TICK_HZ if REALTIME else 0,
+                                      levels=list(DIFFICULTY_LEVELS), default_level=DEFAULT_DIFFICULTY)
+        html = html.encode("utf-8")
+        bodies = {"identity": html, "gzip": gzip.compress(html, 9)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(html)
+        page = _INDEX_PAGE = (n, hashlib.sha1(html).hexdigest()[:20], bodies)
+    return page
 
 # -------------------------
 # Flask routes
 # -------------------------
 @app.route("/")
 def index():
-    # render the single-page app (HTML+JS inline)
-    return render_template_string(INDEX_HTML, mazes=[{"idx":i,"name":m["name"]} for i,m in enumerate(MAZES)])
+    # the single-page app (HTML+JS inline), pre-rendered
+    _, etag, bodies = index_page()
+    return encoded(bodies, "text/html", etag)
+
+def maze_arg(data):
+    # the request's maze_index, or None if it isn't a maze we serve
+    try:
+        maze_index = int(data.get("maze_index", 0))
+    except (TypeError, ValueError):
+        return None
+    return maze_index if MAZE_INDEX.has(maze_index) else None
 
 @app.route("/create_session", methods=["POST"])
 def create_session():
     data = request.json or {}
-    maze_index = int(data.get("maze_index", 0))
+    maze_index = maze_arg(data)
+    if maze_index is None:
+        return jsonify({"error":"unknown maze"}), 400
     player_name = data.get("player_name","Player")
     mode = data.get("mode","single")  # "single" or "race"
     room = data.get("room")  # optional join room
-    sid = new_session(maze_index, player_name)
+    level = difficulty_arg(data)
+    if level is None:
+        return jsonify({"error":"unknown difficulty"}), 400
+    enemies = DIFFICULTY_LEVELS[level]["enemies"]
+    if mode == "race" and room:
+        room_obj = ROOMS.get(room) or {}
+        enemies = room_obj.get("enemies", enemies)
+        level = room_obj.get("difficulty", level)
+    sid = new_session(maze_index, player_name, enemies, level=level)
     # attach session to room if race mode
     if mode == "race":
         if room:
             # join existing room
-            room_obj = ROOMS.get(room)
-            if room_obj and room_obj["maze_index"] == maze_index:
-                room_obj["sessions"].append(sid)
-            else:
-                return jsonify({"error":"Invalid room or maze mismatch"}), 400
+            err = add_to_room(room, sid, maze_index)
+            if err:
+                SESSIONS.pop(sid)
+                return jsonify({"error":err}), 400
         else:
             # create room
-            rid = str(uuid.uuid4())[:8]
-            ROOMS[rid] = {"maze_index": maze_index, "sessions":[sid], "results":{}}
-            room = rid
+            room = new_room(maze_index, [sid], enemies, level=level)
+            with SESSIONS.locked(sid) as s:
+                s.room = room
     return jsonify({"session_id": sid, "room": room})
 
+@app.route("/generate_maze", methods=["POST"])
+def generate_maze_endpoint():
+    # {rows, cols, seed, braid} -> maze_index usable with create_session
+    data = request.json or {}
+    try:
+        rows = int(data.get("rows", 31)); cols = int(data.get("cols", 31))
+        braid = float(data.get("braid", 0.0))
+    except (TypeError, ValueError):
+        return jsonify({"error":"bad size"}), 400
+    seed = data.get("seed")
+    if seed is None:
+        seed = random.randrange(1 << 30)
+    if not isinstance(seed, (int, str)):
+        return jsonify({"error":"seed must be an int or string"}), 400
+    i = register_generated(rows, cols, seed, braid)
+    if i is None:
+        return jsonify({"error":"generated maze limit reached"}), 400
+    idx = MAZE_INDEX[i]
+    return jsonify({"maze_index": i, "name": idx.name, "rows": idx.rows, "cols": idx.cols, "seed": seed})
+
 @app.route("/create_room", methods=["POST"])
 def create_room():
     data = request.json or {}
-    maze_index = int(data.get("maze_index", 0))
-    rid = str(uuid.uuid4())[:8]
-    ROOMS[rid] = {"maze_index":maze_index, "sessions":[], "results":{}}
-    return jsonify({"room":rid})
+    maze_index = maze_arg(data)
+    if maze_index is None:
+        return jsonify({"error":"unknown maze"}), 400
+    level = difficulty_arg(data)
+    if level is None:
+        return jsonify({"error":"unknown difficulty"}), 400
+    # every racer in the room spawns this many enemies, placed for the room's level
+    enemies = min(MAX_ROOM_ENEMIES, max(0, int(data.get("enemies", DIFFICULTY_LEVELS[level]["enemies"]))))
+    capacity = min(MAX_ROOM_PLAYERS, max(1, int(data.get("capacity", 2))))
+    rid = new_room(maze_index, enemies=enemies, capacity=capacity, level=level)
+    return jsonify({"room":rid, "enemies": enemies, "capacity": capacity, "difficulty": level})
 
 @app.route("/join_room", methods=["POST"])
 def join_room():
     data = request.json or {}
     rid = data.get("room")
-    maze_index = int(data.get("maze_index", 0))
-    if rid not in ROOMS:
-        return jsonify({"error":"No such room"}), 400
-    room_obj = ROOMS[rid]
-    if room_obj["maze_index"] != maze_index:
-        return jsonify({"error":"Maze mismatch"}), 400
+    maze_index = maze_arg(data)
+    if maze_index is None:
+        return jsonify({"error":"unknown maze"}), 400
+    room_obj = ROOMS.get(rid)
+    err = room_join_error(room_obj, maze_index)
+    if err:
+        return jsonify({"error":err}), 400
     # create session and add
-    sid = new_session(maze_index, data.get("player_name","Player"))
-    room_obj["sessions"].append(sid)
+    sid = new_session(maze_index, data.get("player_name","Player"), room_obj.get("enemies", ROOM_ENEMIES_DEFAULT),
+                      level=room_obj.get("difficulty"))
+    err = add_to_room(rid, sid, maze_index)
+    if err:
+        SESSIONS.pop(sid)       # lost the last seat (or the race started) meanwhile
+        return jsonify({"error":err}), 400
     return jsonify({"session_id": sid})
 
+def move_reply(res):
+    # step_* return (body, status) when the session vanished mid-request
+    if isinstance(res, tuple):
+        return jsonify(res[0]), res[1]
+    if isinstance(res, bytes):
+        return body_response(res, WIRE_MIME)
+    return jsonify(res)
+
 @app.route("/move", methods=["POST"])
 def move_endpoint():
     data = request.json or {}
     sid = data.get("session_id")
     direction = data.get("dir", "none")
-    if not sid or sid not in SESSIONS:
+    if not isinstance(direction, str):
+        direction = "none"      # not a direction: a no-op input, as before
+    since = data.get("version")  # client's last known version, if any
+    if not isinstance(sid, str) or sid not in SESSIONS:
         return jsonify({"error":"session missing"}), 400
-    res = step_session_move(sid, direction)
-    return jsonify(res)
+    if REALTIME:
+        return move_reply(queue_inputs(sid, [direction], since, wants_wire()))
+    return move_reply(step_session_move(sid, direction, since, wants_wire()))
+
+@app.route("/moves", methods=["POST"])
+def moves_endpoint():
+    data = request.json or {}
+    sid = data.get("session_id")
+    dirs = data.get("dirs") or []
+    since = data.get("version")
+    if not isinstance(sid, str) or sid not in SESSIONS:
+        return jsonify({"error":"session missing"}), 400
+    if not isinstance(dirs, list):
+        return jsonify({"error":"dirs must be a list"}), 400
+    dirs = [d if isinstance(d, str) else "none" for d in dirs]
+    if REALTIME:
+        return move_reply(queue_inputs(sid, dirs, since, wants_wire()))
+    return move_reply(step_session_moves(sid, dirs, since, wants_wire()))
 
 @app.route("/state/<session_id>")
 def state(session_id):
-    s = SESSIONS.get(session_id)
-    if not s:
-        return jsonify({"error":"invalid"}), 400
-    # give public state
-    return jsonify({
-        "maze": s["maze"],
-        "player": s["player"],
-        "enemies": s["enemies"],
-        "player_name": s["player_name"],
-        "score": s["score"],
-        "finished": s["finished"]
-    })
+    # give public state; skip the maze if the client is already up to date
+    since = request.args.get("version", type=int)
+    with SESSIONS.locked(session_id, write=False) as s:
+        if not s:
+            return jsonify({"error":"invalid"}), 400
+        if wants_wire():
+            # any version the client has seen takes a delta (see snapshot_update)
+            base = since if since is not None and since <= s.tick else None
+            return body_response(pack_state(s, {"applied": 0}, since, base, s.collected), WIRE_MIME)
+        st = dynamic_state(s) if since == s.tick else full_state(s)
+    return json_response(st)
 
 @app.route("/leaderboard")
 def leaderboard():
-    scores = load_scores()
-    # sort by score desc then time ascending
-    scores_sorted = sorted(scores, key=lambda x:(-x["score"], x.get("time",999999)))
-    return jsonify(scores_sorted[:100])
+    # served from the in-memory rankings; ?maze=<name>&page=N&per_page=M
+    maze = request.args.get("maze")
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = min(100, max(1, request.args.get("per_page", 100, type=int)))
+    etag = "lb-%s-%d-%s" % (PROCESS_TAG, LEADERBOARD.version,
+                            hashlib.sha1(("%s|%d|%d" % (maze, page, per_page)).encode("utf-8")).hexdigest()[:8])
+    resp = not_modified(etag)
+    if resp is not None:
+        return resp
+    if not LEADERBOARD.ready(LEADERBOARD_WARM_WAIT):
+        return leaderboard_loading()
+    return json_response(LEADERBOARD.page(maze, page, per_page)["entries"], etag)
+
+def leaderboard_loading():
+    resp = jsonify({"error":"leaderboard is loading, try again shortly"})
+    resp.headers["Retry-After"] = "2"
+    return resp, 503
+
+@app.route("/leaderboard/rank")
+def leaderboard_rank():
+    player = request.args.get("player")
+    if not player:
+        return jsonify({"error":"player missing"}), 400
+    if not LEADERBOARD.ready(LEADERBOARD_WARM_WAIT):
+        return leaderboard_loading()
+    return jsonify(LEADERBOARD.rank(player, request.args.get("maze")))
+
+@app.route("/run/<session_id>")
+def run_export(session_id):
+    # the session's seed and run log, for offline verification (replay.py)
+    with SESSIONS.locked(session_id, write=False) as s:
+        if not s:
+            return jsonify({"error":"invalid"}), 400
+        return jsonify(run_record(s))
+
+@app.route("/ghost/<session_id>")
+def ghost(session_id):
+    # replayed player track [[ms, r, c], ...] of a run, to race against
+    with SESSIONS.locked(session_id, write=False) as s:
+        if not s:
+            return jsonify({"error":"invalid"}), 400
+        maze_index, seed, spawn, level = s.maze_index, s.seed, s.spawn, s.level
+        log, log_t = bytes(s.log), array.array("I", s.log_t)
+    frames = []
+    r = replay_run(maze_index, seed, spawn, log, log_t, frames, level)
+    return jsonify({"maze_index": maze_index, "finished": r.finished, "score": r.score,
+                    "frames": [list(f) for f in frames]})
+
+@app.route("/analysis/route/<int:maze_index>")
+def analysis_route(maze_index):
+    # best-score route for a maze: oil order, step count, par score, moves
+    if not MAZE_INDEX.has(maze_index):
+        return jsonify({"error":"no such maze"}), 400
+    route = solve_route(maze_index)
+    if "error" in route:
+        return jsonify(route), 400
+    return jsonify(route)
+
+@app.route("/analysis/maze/<int:maze_index>")
+def analysis_maze(maze_index):
+    # spawn-safety analysis: difficulty rating, dead ends, chokepoints, levels
+    if not MAZE_INDEX.has(maze_index):
+        return jsonify({"error":"no such maze"}), 400
+    idx = MAZE_INDEX[maze_index]
+    return jsonify(idx.safety.summary(idx))
 
 @app.route("/submit_race", methods=["POST"])
 def submit_race():
@@ -349,20 +3216,146 @@ def submit_race():
     sid = data.get("session_id")
     if rid not in ROOMS:
         return jsonify({"error":"no room"}), 400
-    if sid not in SESSIONS:
-        return jsonify({"error":"no session"}), 400
-    s = SESSIONS[sid]
-    if not s["finished"]:
-        return jsonify({"error":"not finished"}), 400
-    elapsed = s["finish_time"] - s["start_time"]
-    ROOMS[rid]["results"][sid] = {"player": s["player_name"], "time": elapsed, "score": s["score"]}
-    # if both players submitted (we allow up to 2 sessions), compute results
-    if len(ROOMS[rid]["sessions"]) >= 2 and len(ROOMS[rid]["results"]) >= 2:
-        # prepare summary
-        res = sorted(ROOMS[rid]["results"].items(), key=lambda kv: kv[1]["time"])
-        return jsonify({"status":"complete","results":[v for k,v in res]})
+    with SESSIONS.locked(sid, write=False) as s:
+        if not s:
+            return jsonify({"error":"no session"}), 400
+        if not s.finished:
+            return jsonify({"error":"not finished"}), 400
+        # trust the replayed run, not the session's own clock and score
+        v = verify_session(s)
+        if not v["ok"]:
+            app.logger.warning("race run %s rejected: %s", sid, v["error"])
+            return jsonify({"error":"run failed verification", "detail": v["error"]}), 400
+        result = {"player": s.player_name, "time": v["elapsed"], "score": v["score"]}
+    with ROOMS.locked(rid) as room_obj:
+        if not room_obj:
+            return jsonify({"error":"no room"}), 400
+        if sid not in room_obj["sessions"]:
+            return jsonify({"error":"not in this room"}), 400
+        new = room_obj["state"] != "complete" and sid not in room_obj["results"]
+        if new:
+            room_obj["results"][sid] = result
+            bisect.insort(room_obj["standings"], [result["time"], sid])
+        completed = finish_race(room_obj, time.time())
+        done = room_obj["state"] == "complete"
+        results = room_standings(room_obj) if done else None
+    if new:
+        room_publish(rid, "result", dict(result, session_id=sid))
+    if completed:
+        room_publish(rid, "standings", {"status":"complete", "results":results})
+        room_publish(rid, None, None)
+    if done:
+        return jsonify({"status":"complete","results":results})
     return jsonify({"status":"waiting"})
 
+@app.route("/start_room", methods=["POST"])
+def start_room():
+    # a member starts the race before the room is full
+    data = request.json or {}
+    rid = data.get("room")
+    with ROOMS.locked(rid) as room_obj:
+        if not room_obj:
+            return jsonify({"error":"no room"}), 400
+        if data.get("session_id") not in room_obj["sessions"]:
+            return jsonify({"error":"not in this room"}), 400
+        now = time.time()
+        started = start_race(rid, room_obj, now)
+        # members who already finished may be all there is
+        completed = finish_race(room_obj, now)
+        info = room_info(rid, room_obj)
+        results = room_standings(room_obj)
+    if started:
+        room_publish(rid, "racing", info)
+    if completed:
+        room_publish(rid, "standings", {"status":"complete", "results":results})
+        room_publish(rid, None, None)
+    return jsonify(info)
+
+@app.route("/rooms")
+def rooms():
+    # open rooms with a free seat: ?maze=<index>
+    maze_index = request.args.get("maze", 0, type=int)
+    limit = min(100, max(1, request.args.get("limit", 50, type=int)))
+    return jsonify(open_rooms(maze_index, limit))
+
+@app.route("/room/<room_id>")
+def room_status(room_id):
+    with ROOMS.locked(room_id, write=False) as room_obj:
+        if not room_obj:
+            return jsonify({"error":"no room"}), 400
+        return jsonify(dict(room_info(room_id, room_obj), results=room_standings(room_obj)))
+
+@app.route("/quick_join", methods=["POST"])
+def quick_join():
+    # take a seat in the oldest open room on the maze and level, or open a new one
+    data = request.json or {}
+    maze_index = maze_arg(data)
+    if maze_index is None:
+        return jsonify({"error":"unknown maze"}), 400
+    player_name = data.get("player_name", "Player")
+    level = difficulty_arg(data)
+    if level is None:
+        return jsonify({"error":"unknown difficulty"}), 400
+    for info in open_rooms(maze_index, limit=20):
+        if info["difficulty"] != level:
+            continue
+        sid = new_session(maze_index, player_name, info["enemies"], level=level)
+        if add_to_room(info["room"], sid, maze_index) is None:
+            return jsonify({"session_id": sid, "room": info["room"]})
+        SESSIONS.pop(sid)       # lost the seat to someone else; try the next room
+    sid = new_session(maze_index, player_name, level=level)
+    rid = new_room(maze_index, [sid], DIFFICULTY_LEVELS[level]["enemies"], level=level)
+    with SESSIONS.locked(sid) as s:
+        s.room = rid
+    return jsonify({"session_id": sid, "room": rid})
+
+Gauge("carmaze_sessions_live", "Live game sessions", lambda: len(SESSIONS))
+Gauge("carmaze_rooms_live", "Live race rooms", lambda: len(ROOMS))
+Gauge("carmaze_room_subscribers", "Open room event streams",
+      lambda: sum(len(v) for v in list(ROOM_SUBSCRIBERS.values())))
+Gauge("carmaze_score_queue_depth", "Scores waiting for the background writer", lambda: SCORE_WRITER.q.qsize())
+Gauge("carmaze_db_pool_connections", "Leaderboard DB pool connections by state",
+      lambda: [(("open",), DB_POOL.stats()["open"]), (("idle",), DB_POOL.stats()["idle"])], ("state",))
+Gauge("carmaze_field_cache_entries", "Cached enemy distance fields", lambda: len(FIELD_CACHE))
+Gauge("carmaze_field_cache_cells", "Tiles held by cached enemy distance fields", lambda: _field_cells)
+Gauge("carmaze_mazes_decoded", "Catalogue mazes held compiled in memory", lambda: MAZE_INDEX.stats()["decoded"])
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/stats")
+def stats():
+    # live sessions / rooms and approximate bytes they hold
+    return jsonify(store_stats())
+
+@app.route("/room_events/<room_id>")
+def room_events(room_id):
+    # text/event-stream of joined / position / finish / result / standings events
+    # subscribe before the snapshot so nothing published in between is missed
+    q = room_subscribe(room_id)
+    snap = room_snapshot(room_id)
+    if snap is None:
+        room_unsubscribe(room_id, q)
+        return jsonify({"error":"no room"}), 400
+    first = "event: snapshot\ndata: %s\n\n" % json.dumps(snap)
+    def stream():
+        try:
+            yield first
+            while True:
+                try:
+                    msg = q.get(timeout=ROOM_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            room_unsubscribe(room_id, q)
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # -------------------------
 # Minimal HTML + JS client
 # -------------------------
@@ -405,6 +3398,15 @@ INDEX_HTML = """
           </select>
         </label>
       </div>
+      <div class="row">
+        <label>Difficulty:
+          <select id="difficulty">
+            {% for d in levels %}
+            <option value="{{d}}"{% if d == default_level %} selected{% endif %}>{{d}}</option>
+            {% endfor %}
+          </select>
+        </label>
+      </div>
 
       <div class="row">
         <button id="newGame">Start Local Game</button>
@@ -433,14 +3435,21 @@ INDEX_HTML = """
 <script>
 const canvas = document.getElementById("board");
 const ctx = canvas.getContext("2d");
-const TILE = 50;
+let TILE = 50;          // shrinks to fit bigger (generated) mazes
 let sessionId = null;
 let currentState = null;
+let version = null;
+let roomId = null;
+let roomStream = null;
+let pending = [];       // arrow keys pressed while a request was in flight
+let inFlight = false;
+const TICK_HZ = {{ tick_hz }};  // > 0: the server moves enemies on its own clock (REALTIME=1)
 
 // draw function
 function drawState(state){
   if(!state) return;
   const maze = state.maze;
+  TILE = Math.max(1, Math.min(50, Math.floor(canvas.width / maze[0].length)));
   ctx.clearRect(0,0,canvas.width,canvas.height);
   for(let r=0;r<maze.length;r++){
     for(let c=0;c<maze[0].length;c++){
@@ -448,17 +3457,17 @@ function drawState(state){
       const x = c * TILE, y = r * TILE;
       if(v === 1){ ctx.fillStyle="#102010"; ctx.fillRect(x,y,TILE,TILE); ctx.fillStyle="#0a7a3f"; ctx.beginPath(); ctx.ellipse(x+TILE*0.5, y+TILE*0.35, TILE*0.28, TILE*0.18, 0,0,Math.PI*2); ctx.fill(); }
       else { ctx.fillStyle="#2e8b57"; ctx.fillRect(x,y,TILE,TILE); }
-      if(v === 2){ ctx.fillStyle="#ffd54f"; ctx.beginPath(); ctx.arc(x+TILE*0.5,y+TILE*0.5,12,0,Math.PI*2); ctx.fill(); }
-      if(v === 3){ ctx.fillStyle="#553388"; ctx.fillRect(x,y,TILE,TILE); ctx.fillStyle="#ffd27a"; ctx.font="14px monospace"; ctx.textAlign="center"; ctx.fillText('┌───┐', x+TILE/2, y+TILE/2 - 8); ctx.fillText('│   │', x+TILE/2, y+TILE/2 + 6); ctx.fillText('└───┘', x+TILE/2, y+TILE/2 + 20); }
+      if(v === 2){ ctx.fillStyle="#ffd54f"; ctx.beginPath(); ctx.arc(x+TILE*0.5,y+TILE*0.5,TILE*0.24,0,Math.PI*2); ctx.fill(); }
+      if(v === 3){ ctx.fillStyle="#553388"; ctx.fillRect(x,y,TILE,TILE); if(TILE < 50) continue; ctx.fillStyle="#ffd27a"; ctx.font="14px monospace"; ctx.textAlign="center"; ctx.fillText('┌───┐', x+TILE/2, y+TILE/2 - 8); ctx.fillText('│   │', x+TILE/2, y+TILE/2 + 6); ctx.fillText('└───┘', x+TILE/2, y+TILE/2 + 20); }
     }
   }
   // player
   const p = state.player;
-  ctx.fillStyle="#00ffff"; ctx.fillRect(p[1]*TILE+10,p[0]*TILE+10,30,30);
+  ctx.fillStyle="#00ffff"; ctx.fillRect(p[1]*TILE+TILE*0.2,p[0]*TILE+TILE*0.2,TILE*0.6,TILE*0.6);
   // enemies
   state.enemies.forEach(e=>{
-    ctx.fillStyle="#ffffff"; ctx.beginPath(); ctx.arc(e[1]*TILE+25, e[0]*TILE+25, 14,0,Math.PI*2); ctx.fill();
-    ctx.fillStyle="#000"; ctx.beginPath(); ctx.arc(e[1]*TILE+21, e[0]*TILE+22, 3,0,Math.PI*2); ctx.fill();
+    ctx.fillStyle="#ffffff"; ctx.beginPath(); ctx.arc(e[1]*TILE+TILE*0.5, e[0]*TILE+TILE*0.5, TILE*0.28,0,Math.PI*2); ctx.fill();
+    ctx.fillStyle="#000"; ctx.beginPath(); ctx.arc(e[1]*TILE+TILE*0.42, e[0]*TILE+TILE*0.44, TILE*0.06,0,Math.PI*2); ctx.fill();
   });
   // stats
   document.getElementById('chat').innerText = "Name: "+ (state.player_name || "") + "   Score: " + (state.score || 0);
@@ -470,6 +3479,58 @@ async function api(path, opts){
   return res.json();
 }
 
+// game state in the binary wire format (see pack_state); errors come back as JSON
+const WIRE = 'application/vnd.carmaze.state';
+const WIRE_STATUS = [undefined, 'win', 'caught'];
+async function apiState(path, opts){
+  opts = Object.assign({}, opts);
+  opts.headers = Object.assign({'Accept': WIRE}, opts.headers || {});
+  const res = await fetch(path, opts);
+  if(res.headers.get('Content-Type') !== WIRE) return res.json();
+  return decodeState(await res.arrayBuffer());
+}
+
+// -> {ok, version, status, elapsed, applied, full|delta}, mazes as Uint8Array row views
+function decodeState(buf){
+  const v = new DataView(buf);
+  const flags = v.getUint8(3);
+  const reply = {ok: true, status: WIRE_STATUS[v.getUint8(4)], version: v.getUint32(5, true), applied: v.getUint16(21, true)};
+  if(flags & 8) reply.elapsed = v.getFloat64(13, true);
+  const nEnemies = v.getUint16(27, true), nOil = v.getUint16(29, true);
+  let o = 31;
+  const coords = new Uint16Array(buf.slice(o, o + 4 * (nEnemies + nOil)));
+  o += 4 * (nEnemies + nOil);
+  const pair = i => coords.subarray(2 * i, 2 * i + 2);
+  const st = {
+    player: [v.getUint16(23, true), v.getUint16(25, true)],
+    enemies: Array.from({length: nEnemies}, (_, i) => pair(i)),
+    score: v.getInt32(9, true),
+    finished: !!(flags & 2)
+  };
+  const oil = Array.from({length: nOil}, (_, i) => pair(nEnemies + i));
+  const nName = v.getUint16(o, true);
+  st.player_name = new TextDecoder().decode(new Uint8Array(buf, o + 2, nName));
+  o += 2 + nName;
+  if(!(flags & 1)){
+    st.oil_removed = oil;
+    reply.delta = st;
+    return reply;
+  }
+  const rows = v.getUint16(o, true), cols = v.getUint16(o + 2, true), n = v.getUint32(o + 4, true);
+  const bytes = new Uint8Array(buf, o + 8, n);
+  const grid = new Uint8Array(rows * cols);
+  if(flags & 4){
+    for(let k = 0, i = 0; k < n; k++){ const len = (bytes[k] & 63) + 1; grid.fill(bytes[k] >> 6, i, i + len); i += len; }
+  } else {
+    for(let i = 0; i < grid.length; i++) grid[i] = (bytes[i >> 2] >> ((i & 3) * 2)) & 3;
+  }
+  oil.forEach(t => { grid[t[0] * cols + t[1]] = 0; });
+  st.maze = Array.from({length: rows}, (_, r) => grid.subarray(r * cols, (r + 1) * cols));
+  st.version = reply.version;
+  reply.full = st;
+  return reply;
+}
+
 // start new local session
 document.getElementById('newGame').addEventListener('click', async ()=>{
   const player = document.getElementById('playerName').value || 'Player';
@@ -477,7 +3538,7 @@ document.getElementById('newGame').addEventListener('click', async ()=>{
   const resp = await api('/create_session', {
     method:'POST',
     headers:{'Content-Type':'application/json'},
-    body: JSON.stringify({maze_index, player_name: player, mode: 'single'})
+    body: JSON.stringify({maze_index, player_name: player, mode: 'single', difficulty: document.getElementById('difficulty').value})
   });
   sessionId = resp.session_id;
   refresh();
@@ -486,35 +3547,79 @@ document.getElementById('newGame').addEventListener('click', async ()=>{
 // refresh state
 async function refresh(){
   if(!sessionId) return;
-  const res = await api('/state/'+sessionId);
+  const res = await apiState('/state/'+sessionId);
   if(res.error){ console.error(res); return; }
-  currentState = res;
-  drawState(res);
+  applyUpdate(res);
 }
 
+// apply a /move reply: either a full snapshot or a delta on top of currentState
+function applyUpdate(res){
+  const wasFinished = !!(currentState && currentState.finished);
+  if(res.full){
+    currentState = res.full;
+  } else if(res.delta && currentState){
+    const d = res.delta;
+    d.oil_removed.forEach(t => { currentState.maze[t[0]][t[1]] = 0; });
+    delete d.oil_removed;
+    Object.assign(currentState, d);
+  } else {
+    return false;
+  }
+  version = res.version;
+  drawState(currentState);
+  // real-time wins happen on the server's clock, so they show up here
+  if(TICK_HZ > 0 && !wasFinished && currentState.finished){
+    if(roomId) submitRace();
+    setTimeout(() => alert('You won! Score: ' + currentState.score + '. Saved to leaderboard.'), 0);
+  }
+  return true;
+}
+
+// real-time mode: follow the world between key presses
+async function poll(){
+  if(!sessionId || version === null || inFlight) return;
+  const res = await apiState('/state/' + sessionId + '?version=' + version);
+  if(!res.error) applyUpdate(res);
+}
+if(TICK_HZ > 0) setInterval(poll, 1000 / TICK_HZ);
+
 // handle keyboard
 window.addEventListener('keydown', async (e)=>{
   if(!sessionId) return;
   const map = {ArrowUp:'up', ArrowDown:'down', ArrowLeft:'left', ArrowRight:'right'};
   const dir = map[e.key];
   if(!dir) return;
-  const res = await api('/move',{
-    method:'POST',
-    headers:{'Content-Type':'application/json'},
-    body: JSON.stringify({session_id: sessionId, dir})
-  });
-  if(res.status === 'win'){
-    alert('You won! Time: '+ (res.elapsed ? res.elapsed.toFixed(2) : 'N/A') + 's. Score saved to leaderboard.');
-  } else if(res.status === 'caught'){
-    alert('You were caught! Lost some points and respawned.');
-  }
-  // update local view
-  await refresh();
+  pending.push(dir);
+  if(!inFlight) flushMoves();
 });
 
+// send buffered keys as one /moves batch; keys pressed meanwhile go in the next one
+async function flushMoves(){
+  inFlight = true;
+  while(pending.length && sessionId){
+    const dirs = pending.splice(0, pending.length);
+    const res = await apiState('/moves',{
+      method:'POST',
+      headers:{'Content-Type':'application/json'},
+      body: JSON.stringify({session_id: sessionId, dirs, version})
+    });
+    if(res.status){ pending = []; }
+    if(res.status === 'win'){
+      if(roomId) submitRace();
+      alert('You won! Time: '+ (res.elapsed ? res.elapsed.toFixed(2) : 'N/A') + 's. Score saved to leaderboard.');
+    } else if(res.status === 'caught'){
+      alert('You were caught! Lost some points and respawned.');
+    }
+    // update local view (falls back to a full fetch if the reply was unusable)
+    if(!applyUpdate(res)) await refresh();
+  }
+  inFlight = false;
+}
+
 // leaderboard view
 document.getElementById('viewLB').addEventListener('click', async ()=>{
   const sc = await api('/leaderboard');
+  if(!Array.isArray(sc)){ document.getElementById('lb').textContent = sc.error; return; }
   let html = '<ol>';
   sc.forEach(s => { html += `<li>${s.player} — ${s.maze} — score:${s.score} time:${s.time ? s.time.toFixed(2):'N/A'}</li>`; });
   html += '</ol>';
@@ -524,7 +3629,7 @@ document.getElementById('viewLB').addEventListener('click', async ()=>{
 // create room
 document.getElementById('createRoom').addEventListener('click', async ()=>{
   const maze_index = parseInt(document.getElementById('mazeSelect').value);
-  const resp = await api('/create_room',{method:'POST',headers:{'Content-Type':'application/json'}, body: JSON.stringify({maze_index})});
+  const resp = await api('/create_room',{method:'POST',headers:{'Content-Type':'application/json'}, body: JSON.stringify({maze_index, difficulty: document.getElementById('difficulty').value})});
   const rid = resp.room;
   document.getElementById('raceInfo').innerText = 'Room created: ' + rid + '. Share this ID with opponent. Now click Join Room with same ID to join.';
   // automatically create session and join
@@ -532,6 +3637,7 @@ document.getElementById('createRoom').addEventListener('click', async ()=>{
   const cr = await api('/create_session',{method:'POST',headers:{'Content-Type':'application/json'}, body: JSON.stringify({maze_index, player_name:player, mode:'race', room:rid})});
   sessionId = cr.session_id;
   document.getElementById('roomId').value = rid;
+  watchRoom(rid);
   refresh();
 });
 
@@ -546,12 +3652,42 @@ document.getElementById('joinRoom').addEventListener('click', async ()=>{
   if(resp.error){ alert(resp.error); return; }
   sessionId = resp.session_id;
   document.getElementById('raceInfo').innerText = 'Joined room: ' + rid + '. Play and when you finish, click Submit Race (auto submit on win).';
+  watchRoom(rid);
   refresh();
 });
 
-// submit race (automatic when finishing stored in server; client can poll for room results)
-async function pollRoom(rid){
-  // naive: ask server leaderboard for matching results in ROOMS (no direct endpoint) -> rely on submit_race replies
+// submit race (automatic on win); standings arrive on the room stream
+async function submitRace(){
+  await api('/submit_race',{method:'POST',headers:{'Content-Type':'application/json'}, body: JSON.stringify({room:roomId, session_id:sessionId})});
+}
+
+// follow a race room over Server-Sent Events
+function watchRoom(rid){
+  if(roomStream) roomStream.close();
+  roomId = rid;
+  const opponents = {};
+  const info = document.getElementById('raceInfo');
+  const show = (extra) => {
+    let txt = 'Room ' + rid + ':';
+    Object.values(opponents).forEach(o => {
+      if(o.session_id === sessionId) return;
+      txt += '\\n' + o.player_name + ' at [' + o.player + '] score:' + o.score + (o.finished ? ' (finished)' : '');
+    });
+    info.innerText = txt + (extra ? '\\n' + extra : '');
+  };
+  roomStream = new EventSource('/room_events/' + rid);
+  roomStream.addEventListener('snapshot', e => { JSON.parse(e.data).sessions.forEach(o => { opponents[o.session_id] = o; }); show(); });
+  roomStream.addEventListener('joined', e => { const o = JSON.parse(e.data); opponents[o.session_id] = o; show(); });
+  roomStream.addEventListener('position', e => { const o = JSON.parse(e.data); opponents[o.session_id] = o; show(); });
+  roomStream.addEventListener('finish', e => { const f = JSON.parse(e.data); show(f.player + ' finished in ' + f.time.toFixed(2) + 's'); });
+  roomStream.addEventListener('racing', e => { const r = JSON.parse(e.data); show('Race on: ' + r.players + ' racers'); });
+  roomStream.addEventListener('standings', e => {
+    const st = JSON.parse(e.data);
+    const title = st.status === 'expired' ? 'Room expired: ' : st.timed_out ? 'Time up: ' : 'Final: ';
+    show(title + st.results.map(r => r.rank + '. ' + r.player + ' ' + r.time.toFixed(2) + 's').join('  '));
+    roomStream.close();
+    roomStream = null;
+  });
 }
 
 // initial: select default maze, no session
@@ -565,16 +3701,5 @@ async function pollRoom(rid){
 # -------------------------
 if __name__ == "__main__":
     print("Run: http://127.0.0.1:5000/")
-    app.run(debug=True)
-
-
-import mysql.connector
-
-def get_db():
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="Yuiop@09876",
-        database="carmaze29"
-    )
-    return conn
+    LEADERBOARD.warm()
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,305 @@
+"""
+Load generator and latency benchmark for app.py.
+Scripted bots play real games (create_session, /move with the versioned
+delta protocol, /state, /leaderboard, and the create_room / join_room /
+submit_race flow) either through Flask's test client or against a real
+local server, then report throughput and p50/p95/p99 latency per endpoint.
+Usage:
+    python bench.py                              # default sweeps, both drivers
+    python bench.py --driver server --moves 500
+    python bench.py --sessions 1,8,32 --enemies 3,20 --sizes 15,51,101
+    python bench.py --out new.json --compare old.json
+Results are written as JSON (one record per run, tagged with the git commit)
+so runs from different commits can be compared. The leaderboard runs on a
+throwaway SQLite file, no MySQL needed.
+"""
+import os, sys, json, time, random, argparse, tempfile, threading, subprocess, http.client
+
+os.environ.setdefault("LEADERBOARD_DB", "sqlite")
+os.environ.setdefault("LEADERBOARD_SQLITE", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app as game
+
+DIR_NAMES = {(1, 0): "down", (-1, 0): "up", (0, 1): "right", (0, -1): "left"}
+
+
+# -------------------------
+# Drivers
+# -------------------------
+class TestClientDriver:
+    name = "testclient"
+
+    def __init__(self):
+        self.client = game.app.test_client()
+
+    def request(self, method, path, body=None):
+        if method == "GET":
+            r = self.client.get(path)
+        else:
+            r = self.client.post(path, json=body)
+        return r.status_code, r.get_json()
+
+    def close(self):
+        pass
+
+
+class ServerDriver:
+    # real HTTP against a werkzeug server on an ephemeral port; one keep-alive
+    # connection per bot thread
+    name = "server"
+
+    def __init__(self):
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server("127.0.0.1", 0, game.app, threaded=True, request_handler=QuietHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        return conn
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in (0, 1):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                r = conn.getresponse()
+                payload = r.read()
+                return r.status, json.loads(payload) if payload else None
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+    def close(self):
+        self.server.shutdown()
+
+
+# -------------------------
+# Bots
+# -------------------------
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, driver, endpoint, method, path, body=None):
+        t0 = time.perf_counter()
+        status, res = driver.request(method, path, body)
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(dt)
+            if status != 200:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return res
+
+
+def new_game(driver, rec, maze_index, n_enemies, room=None):
+    if room:
+        res = rec.timed(driver, "join_room", "POST", "/join_room",
+                        {"room": room, "maze_index": maze_index, "player_name": "bot"})
+    else:
+        res = rec.timed(driver, "create_session", "POST", "/create_session",
+                        {"maze_index": maze_index, "player_name": "bot", "mode": "single"})
+    sid = res["session_id"]
+    # sessions spawn 3 enemies (rooms set their own); the sweep sets the count directly
+    if n_enemies != 3 and not room:
+        with game.SESSIONS.locked(sid) as s:
+            s.enemies = game.MAZE_INDEX[maze_index].sample_free(n_enemies)
+    st = rec.timed(driver, "state", "GET", "/state/" + sid)
+    return sid, tuple(st["player"]), st["version"]
+
+
+def bot(driver, rec, maze_index, n_enemies, moves, seed):
+    rng = random.Random(seed)
+    idx = game.MAZE_INDEX[maze_index]
+    toward_exit = game.distance_field(idx, idx.exit)
+    sid, player, version = new_game(driver, rec, maze_index, n_enemies)
+    for i in range(moves):
+        # mostly head for the exit, sometimes wander
+        if rng.random() < 0.8:
+            nxt = game.step_downhill(idx, toward_exit, player)
+        else:
+            nxt = rng.choice(idx.adj[player])
+        d = DIR_NAMES.get((nxt[0] - player[0], nxt[1] - player[1]), "up")
+        res = rec.timed(driver, "move", "POST", "/move", {"session_id": sid, "dir": d, "version": version})
+        st = res.get("delta") or res.get("full")
+        player, version = tuple(st["player"]), res["version"]
+        if i % 10 == 9:
+            rec.timed(driver, "state", "GET", "/state/%s?version=%d" % (sid, version))
+        if i % 25 == 24:
+            rec.timed(driver, "leaderboard", "GET", "/leaderboard?per_page=20")
+        if res.get("status") == "win":
+            sid, player, version = new_game(driver, rec, maze_index, n_enemies)
+
+
+def racer(driver, rec, room, maze_index, path_dirs):
+    sid, _, version = new_game(driver, rec, maze_index, 0, room=room)
+    step = game.MAX_BATCH_MOVES
+    for i in range(0, len(path_dirs), step):
+        res = rec.timed(driver, "moves", "POST", "/moves",
+                        {"session_id": sid, "dirs": path_dirs[i:i + step], "version": version})
+        version = res["version"]
+    rec.timed(driver, "submit_race", "POST", "/submit_race", {"room": room, "session_id": sid})
+
+
+def race_rounds(driver, rec, maze_index, rounds):
+    idx = game.MAZE_INDEX[maze_index]
+    path = game.bfs_shortest(idx.grid, idx.start, idx.exit)
+    dirs = [DIR_NAMES[(b[0] - a[0], b[1] - a[1])] for a, b in zip(path, path[1:])]
+    for _ in range(rounds):
+        room = rec.timed(driver, "create_room", "POST", "/create_room", {"maze_index": maze_index, "enemies": 0})["room"]
+        ts = [threading.Thread(target=racer, args=(driver, rec, room, maze_index, dirs)) for _ in range(2)]
+        for t in ts: t.start()
+        for t in ts: t.join()
+
+
+# -------------------------
+# Runs & reporting
+# -------------------------
+def percentile(sorted_xs, p):
+    if not sorted_xs:
+        return None
+    k = min(len(sorted_xs) - 1, max(0, int(round(p / 100.0 * len(sorted_xs) + 0.5)) - 1))
+    return sorted_xs[k]
+
+
+def summarize(rec, wall):
+    out = {}
+    for endpoint, xs in sorted(rec.samples.items()):
+        xs = sorted(xs)
+        out[endpoint] = {
+            "count": len(xs),
+            "rps": len(xs) / wall if wall else None,
+            "mean_ms": 1000 * sum(xs) / len(xs),
+            "p50_ms": 1000 * percentile(xs, 50),
+            "p95_ms": 1000 * percentile(xs, 95),
+            "p99_ms": 1000 * percentile(xs, 99),
+            "errors": rec.errors.get(endpoint, 0),
+        }
+    return out
+
+
+def maze_for(size):
+    # builtin 15x15 mazes as-is, anything else generated (braided so enemies chase)
+    if size <= 15:
+        return 0
+    return game.register_generated(size, size, seed=size, braid=0.3)
+
+
+def run(driver, sessions, enemies, size, moves, race):
+    maze_index = maze_for(size)
+    rec = Recorder()
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=bot, args=(driver, rec, maze_index, enemies, moves, i)) for i in range(sessions)]
+    if race:
+        ts.append(threading.Thread(target=race_rounds, args=(driver, rec, maze_index, race)))
+    for t in ts: t.start()
+    for t in ts: t.join()
+    wall = time.perf_counter() - t0
+    total = sum(len(v) for v in rec.samples.values())
+    return {
+        "driver": driver.name, "sessions": sessions, "enemies": enemies,
+        "maze_size": size, "moves_per_bot": moves, "race_rounds": race,
+        "wall_s": wall, "requests": total, "rps": total / wall, "errors": sum(rec.errors.values()),
+        "endpoints": summarize(rec, wall),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_run(r):
+    print("%-10s sessions=%-3d enemies=%-3d size=%-4d %7.0f req/s  errors=%d" % (
+        r["driver"], r["sessions"], r["enemies"], r["maze_size"], r["rps"], r["errors"]))
+    for ep, st in r["endpoints"].items():
+        print("    %-15s n=%-6d p50=%7.2fms p95=%7.2fms p99=%7.2fms" % (
+            ep, st["count"], st["p50_ms"], st["p95_ms"], st["p99_ms"]))
+
+
+def run_key(r):
+    return (r["driver"], r["sessions"], r["enemies"], r["maze_size"])
+
+
+def compare(old_path, runs):
+    with open(old_path) as f:
+        old = {run_key(r): r for r in json.load(f)["runs"]}
+    print("\ncompared with %s:" % old_path)
+    for r in runs:
+        o = old.get(run_key(r))
+        if not o:
+            continue
+        for ep, st in r["endpoints"].items():
+            ost = o["endpoints"].get(ep)
+            if ost:
+                print("  %-10s s=%-3d e=%-3d z=%-4d %-15s p50 %+6.1f%%  p99 %+6.1f%%" % (
+                    r["driver"], r["sessions"], r["enemies"], r["maze_size"], ep,
+                    100.0 * (st["p50_ms"] / ost["p50_ms"] - 1), 100.0 * (st["p99_ms"] / ost["p99_ms"] - 1)))
+
+
+def ints(s):
+    return [int(x) for x in s.split(",") if x]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--driver", choices=["testclient", "server", "both"], default="both")
+    ap.add_argument("--sessions", type=ints, default=[1, 8, 32], help="concurrent bots sweep")
+    ap.add_argument("--enemies", type=ints, default=[3, 20, 100], help="enemies per session sweep")
+    ap.add_argument("--sizes", type=ints, default=[15, 51, 101], help="maze size sweep")
+    ap.add_argument("--moves", type=int, default=200, help="moves per bot")
+    ap.add_argument("--race", type=int, default=5, help="race rounds per run")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="earlier results file to diff against")
+    args = ap.parse_args(argv)
+
+    base_s, base_e, base_z = args.sessions[len(args.sessions) // 2], args.enemies[0], args.sizes[0]
+    # one-dimensional sweeps around a base point, not the full cross product
+    configs = []
+    for s in args.sessions: configs.append((s, base_e, base_z))
+    for e in args.enemies: configs.append((base_s, e, base_z))
+    for z in args.sizes: configs.append((base_s, base_e, z))
+    configs = list(dict.fromkeys(configs))
+
+    drivers = ["testclient", "server"] if args.driver == "both" else [args.driver]
+    runs = []
+    for name in drivers:
+        driver = TestClientDriver() if name == "testclient" else ServerDriver()
+        try:
+            for s, e, z in configs:
+                r = run(driver, s, e, z, args.moves, args.race)
+                print_run(r)
+                runs.append(r)
+        finally:
+            driver.close()
+    game.SCORE_WRITER.flush(10)
+
+    result = {"commit": git_commit(), "when": time.time(), "python": sys.version.split()[0], "runs": runs}
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=1)
+    print("wrote", args.out)
+    if args.compare:
+        compare(args.compare, runs)
+
+
+if __name__ == "__main__":
+    main()
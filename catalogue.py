@@ -0,0 +1,82 @@
+"""
+Maze catalogue tool for app.py.
+Lists, imports and generates mazes into the binary catalogue the server
+mmaps (MAZE_CATALOGUE, default mazes.cat). Existing mazes are copied packed,
+never decoded, and the file is rewritten atomically; restart the server to
+serve the new mazes. Mazes keep their index, new ones are appended, and
+names already in the catalogue are skipped. A grid that is ragged or has
+cells outside 0-3 or no empty (0) tile rejects the whole import.
+Usage:
+    python catalogue.py list
+    python catalogue.py import mazes.json        # [{"name": ..., "grid": [[0,1,2,3], ...]}, ...]
+    python catalogue.py generate 101x101 --seeds 1-500 [--braid 0.3]
+    python catalogue.py --catalogue other.cat list
+"""
+import os, sys, json, argparse
+
+import app as game
+
+
+def parse_range(s):
+    lo, _, hi = s.partition("-")
+    return range(int(lo), int(hi or lo) + 1)
+
+
+def parse_size(s):
+    rows, _, cols = s.lower().partition("x")
+    return int(rows), int(cols or rows)
+
+
+def extend(path, new):
+    # rewrite the catalogue with `new` [(name, grid)] appended; returns how many were added
+    cat = game.MazeCatalogue(path) if os.path.exists(path) else game.MazeCatalogue()
+    entries = [(cat.name(i),) + cat.dims(i) + (lambda i=i: bytes(cat.packed(i)),) for i in range(cat.builtin)]
+    seen = set(cat.names())
+    for name, grid in new:
+        if name in seen:
+            continue
+        seen.add(name)
+        entries.append(game.catalogue_entry(name, grid))
+    game.write_catalogue(path, entries)
+    return len(entries) - cat.builtin
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--catalogue", default=game.CATALOGUE_PATH)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    p = sub.add_parser("import")
+    p.add_argument("file", help="JSON list of {name, grid}")
+    p = sub.add_parser("generate")
+    p.add_argument("size", type=parse_size, help="ROWSxCOLS, rounded up to odd")
+    p.add_argument("--seeds", type=parse_range, default=range(1, 2), help="seed or first-last")
+    p.add_argument("--braid", type=float, default=0.0)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "list":
+        cat = game.MazeCatalogue(args.catalogue)
+        for i, name in enumerate(cat.names()):
+            rows, cols = cat.dims(i)
+            print("%5d  %4dx%-4d  %s" % (i, rows, cols, name))
+        print("%d mazes in %s" % (len(cat), args.catalogue))
+        return 0
+
+    if args.cmd == "import":
+        with open(args.file) as f:
+            mazes = [(m["name"], m["grid"]) for m in json.load(f)]
+    else:
+        rows, cols = args.size
+        mazes = ((m["name"], m["grid"]) for m in
+                 (game.generate_maze(rows, cols, seed, args.braid) for seed in args.seeds))
+    try:
+        added = extend(args.catalogue, mazes)
+    except ValueError as exc:
+        print("rejected %s; catalogue unchanged" % exc, file=sys.stderr)
+        return 1
+    print("added %d mazes to %s" % (added, args.catalogue))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Offline run verifier for app.py.
+Replays exported runs (the JSON from GET /run/<session_id>, one record per
+line, or a JSON list) through the game rules and checks the claimed score,
+finish and time against the replay.
+Usage:
+    python replay.py runs.jsonl [-j workers] [--show-ok]
+Exits non-zero if any run fails. Runs on generated mazes only verify if the
+maze has been registered under the same name in this process.
+"""
+import os, sys, json, time, argparse, multiprocessing
+
+os.environ.setdefault("LEADERBOARD_DB", "sqlite")
+os.environ.setdefault("LEADERBOARD_SQLITE", ":memory:")
+
+import app as game
+
+
+def load(path):
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def verify(rec):
+    return game.verify_run(rec)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("runs", help="file of exported run records")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--show-ok", action="store_true", help="print passing runs too")
+    args = ap.parse_args(argv)
+
+    recs = load(args.runs)
+    t0 = time.perf_counter()
+    if args.jobs > 1 and len(recs) > 1:
+        with multiprocessing.Pool(args.jobs) as pool:
+            results = pool.map(verify, recs, chunksize=max(1, len(recs) // (args.jobs * 8)))
+    else:
+        results = [verify(r) for r in recs]
+    wall = time.perf_counter() - t0
+
+    bad = 0
+    for rec, res in zip(recs, results):
+        if not res["ok"]:
+            bad += 1
+        if not res["ok"] or args.show_ok:
+            print("%-4s %-20s %-24s score=%-5s %s" % ("ok" if res["ok"] else "FAIL", rec.get("player"),
+                                                     rec.get("maze"), rec.get("score"), res.get("error") or ""))
+    print("%d runs verified in %.2fs (%.0f/s), %d failed" % (len(recs), wall, len(recs) / wall if wall else 0, bad))
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Concurrency stress check for app.py.
+Hammers /move, /moves, /state, /join_room, /start_room and /submit_race from
+many threads through Flask's test client, then checks that no update was lost
+or torn and that a room never seats more racers than its capacity.
+Usage:
+    python stress.py [threads] [moves_per_thread]
+Runs the leaderboard on a throwaway SQLite file, no MySQL needed.
+"""
+import os, sys, random, tempfile, threading
+
+os.environ.setdefault("LEADERBOARD_DB", "sqlite")
+os.environ.setdefault("LEADERBOARD_SQLITE", os.path.join(tempfile.mkdtemp(), "stress.db"))
+
+import app as game
+
+DIRS = ["up", "down", "left", "right"]
+
+
+def check(cond, msg, errors):
+    if not cond:
+        errors.append(msg)
+
+
+def run(threads=16, moves=200):
+    client = game.app.test_client()
+    errors = []
+    sids = [client.post("/create_session", json={"maze_index": i % len(game.MAZE_INDEX)}).get_json()["session_id"]
+            for i in range(4)]
+    # racers spawn no enemies, so the scripted route below always wins
+    capacity = 4
+    rid = client.post("/create_room", json={"maze_index": 0, "enemies": 0, "capacity": capacity}).get_json()["room"]
+    sent = {sid: 0 for sid in sids}
+    sent_lock = threading.Lock()
+    joined = []
+    refused = []
+
+    def player(n):
+        c = game.app.test_client()
+        rnd = random.Random(n)
+        for i in range(moves):
+            sid = sids[rnd.randrange(len(sids))]
+            if i % 5 == 0:
+                dirs = [rnd.choice(DIRS) for _ in range(rnd.randint(1, 8))]
+                r = c.post("/moves", json={"session_id": sid, "dirs": dirs}).get_json()
+                applied = r["applied"]
+            else:
+                r = c.post("/move", json={"session_id": sid, "dir": rnd.choice(DIRS)}).get_json()
+                applied = 1
+            check(r.get("ok"), "move failed: %r" % r, errors)
+            with sent_lock:
+                sent[sid] += applied
+            if i % 7 == 0:
+                st = c.get("/state/" + sid).get_json()
+                check(st["score"] >= 0, "negative score", errors)
+            if i % 25 == 0:
+                r = c.post("/join_room", json={"room": rid, "maze_index": 0, "player_name": "bot%d" % n})
+                if r.status_code == 200:
+                    joined.append(r.get_json()["session_id"])
+                else:
+                    refused.append(r.get_json().get("error"))
+
+    ts = [threading.Thread(target=player, args=(n,)) for n in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+
+    # every applied input bumped the tick exactly once
+    for sid in sids:
+        s = game.SESSIONS[sid]
+        check(s.tick == sent[sid], "lost moves on %s: tick %d != %d" % (sid, s.tick, sent[sid]), errors)
+        idx = game.MAZE_INDEX[s.maze_index]
+        for r, c in [s.player] + list(s.enemies):
+            check(idx.grid[r][c] != 1, "entity inside a wall on %s" % sid, errors)
+        check(s.collected <= idx.oil, "collected tiles that are not oil", errors)
+        v = game.verify_session(s)
+        check(v["ok"], "run log of %s does not replay: %s" % (sid, v["error"]), errors)
+    room = game.ROOMS[rid]
+    check(len(room["sessions"]) == len(joined), "lost room joins: %d != %d" % (len(room["sessions"]), len(joined)), errors)
+    check(len(set(room["sessions"])) == len(room["sessions"]), "duplicate room members", errors)
+    check(len(joined) <= capacity, "room overfilled: %d > %d" % (len(joined), capacity), errors)
+    check(all(e in ("Room is full", "Room is not open") for e in refused), "bad refusals: %r" % set(refused), errors)
+    if joined:
+        r = client.post("/start_room", json={"room": rid, "session_id": joined[0]}).get_json()
+        check(r.get("state") == "racing", "room did not start: %r" % r, errors)
+
+    # finish every room member at once; exactly one standings result set
+    idx = game.MAZE_INDEX[0]
+    path = game.bfs_shortest(idx.grid, idx.start, idx.exit)
+    names = {(1, 0): "down", (-1, 0): "up", (0, 1): "right", (0, -1): "left"}
+    dirs = [names[(b[0] - a[0], b[1] - a[1])] for a, b in zip(path, path[1:])]
+    racers = list(joined)
+    replies = []
+
+    def racer(sid):
+        c = game.app.test_client()
+        c.post("/moves", json={"session_id": sid, "dirs": dirs})
+        replies.append(c.post("/submit_race", json={"room": rid, "session_id": sid}).get_json())
+
+    ts = [threading.Thread(target=racer, args=(sid,)) for sid in racers]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    if racers:
+        check(any(r["status"] == "complete" for r in replies), "race never completed: %r" % replies, errors)
+        room = game.ROOMS[rid]
+        check(room["state"] == "complete", "room not marked complete", errors)
+        times = [t for t, _ in room["standings"]]
+        check(times == sorted(times) and len(times) == len(racers), "standings out of order: %r" % times, errors)
+
+    game.SCORE_WRITER.flush(10)
+    return errors, sum(sent.values())
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    errors, total = run(threads, moves)
+    for e in errors[:20]:
+        print("FAIL:", e)
+    print("%d inputs from %d threads, %d invariant violations" % (total, threads, len(errors)))
+    sys.exit(1 if errors else 0)
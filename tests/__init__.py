@@ -0,0 +1,4 @@
+"""
+Tests for app.py. Run from the repository root with `python -m unittest`
+(or `python -m pytest`).
+"""
@@ -0,0 +1,45 @@
+"""
+Shared setup for the tests: points app.py's data files (leaderboard, maze
+catalogue, scores.json) at a scratch directory and imports it with in-memory
+state, so the tests never touch the working tree or a real database.
+"""
+import os, sys, tempfile
+from contextlib import contextmanager
+
+TMP = tempfile.mkdtemp()
+os.environ["STATE_BACKEND"] = "memory"
+os.environ.pop("REALTIME", None)
+os.environ["LEADERBOARD_DB"] = "sqlite"
+os.environ["LEADERBOARD_SQLITE"] = os.path.join(TMP, "leaderboard.db")
+os.environ["LEADERBOARD_SYNC"] = "0"          # tests call Leaderboard.sync() themselves
+os.environ["MAZE_CATALOGUE"] = os.path.join(TMP, "mazes.cat")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_cwd = os.getcwd()
+os.chdir(TMP)           # app creates scores.json in the working directory
+import app as game
+os.chdir(_cwd)
+
+
+@contextmanager
+def scratch_maze(name, grid):
+    # a maze registered in MAZE_INDEX for one test, dropped (with anything
+    # cached under its index) afterwards so later tests see the stock list
+    with game.LOCK:
+        i = game.MAZE_INDEX.add(game.MazeIndex(name, grid))
+    try:
+        yield i
+    finally:
+        for sid in list(game.SESSIONS.keys()):
+            s = game.SESSIONS.get(sid)
+            if s is not None and s.maze_index == i:
+                game.SESSIONS.pop(sid)
+        with game.LOCK:
+            cat = game.MAZE_INDEX
+            assert len(cat) - 1 == i, "scratch mazes must be dropped in reverse order"
+            cat._extra.pop()
+            if cat._by_name.get(name) == i:
+                del cat._by_name[name]
+            for key in [k for k in game.FIELD_CACHE if k[0] == i]:
+                game._field_cells -= len(game.FIELD_CACHE.pop(key))
+            game.ROUTE_CACHE.pop(i, None)
+            game._WIRE_MAZE.pop(i, None)
@@ -0,0 +1,49 @@
+"""
+batch_tick must advance every session exactly as world_step does: replay
+verification re-runs logged world ticks through world_step.
+"""
+import random, unittest
+
+from tests.support import game, scratch_maze
+
+
+@unittest.skipIf(game.np is None, "batch tick needs numpy")
+class BatchTickTest(unittest.TestCase):
+    def check_maze(self, maze_index, sessions=40, seed=1):
+        rng = random.Random(seed)
+        idx = game.MAZE_INDEX[maze_index]
+        open_tiles = [(r, c) for r in range(idx.rows) for c in range(idx.cols) if idx.grid[r][c] != 1]
+        sids, expected = [], {}
+        for n in range(sessions):
+            sid = game.new_session(maze_index, "batch", enemies=0, seed=n)
+            with game.SESSIONS.locked(sid) as s:
+                # few player tiles, so sessions share fields; some enemies start caught
+                s.player = rng.choice(open_tiles[:8] if n % 2 else open_tiles)
+                s.enemies = [rng.choice(open_tiles) for _ in range(rng.randint(1, 6))]
+                if n % 5 == 0:
+                    s.enemies.append(s.player)
+                twin = game.Session.unpack(s.pack())
+            game.world_step(twin)
+            sids.append(sid)
+            expected[sid] = twin
+        res = game.batch_tick(sids)
+        self.assertEqual(res["applied"], sessions)
+        for sid in sids:
+            s, want = game.SESSIONS[sid], expected[sid]
+            self.assertEqual((s.enemies, s.player, s.score, s.tick),
+                             (want.enemies, want.player, want.score, want.tick), sid)
+            game.SESSIONS.pop(sid)
+
+    def test_stock_mazes(self):
+        for i in range(game.MAZE_INDEX.builtin):
+            self.check_maze(i, seed=i)
+
+    def test_generated_mazes(self):
+        for braid in (0.0, 0.5):
+            m = game.generate_maze(41, 41, 7, braid)
+            with scratch_maze(m["name"] + " test", m["grid"]) as i:
+                self.check_maze(i, sessions=60, seed=int(braid * 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Binary maze catalogue: 2-bit cell packing, write_catalogue/MazeCatalogue
+round trips, grid validation, and catalogue.py imports.
+"""
+import contextlib, io, json, os, random, unittest
+
+import catalogue
+from tests.support import TMP, game
+
+
+def grid_of(idx):
+    return [list(row) for row in idx.grid]
+
+
+def random_grid(rng, rows, cols):
+    grid = [[rng.randrange(4) for _ in range(cols)] for _ in range(rows)]
+    grid[0][0] = 0
+    return grid
+
+
+class PackTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(5)
+        for n in range(0, 40):
+            flat = bytes(rng.randrange(4) for _ in range(n))
+            packed = game.pack_cells(flat)
+            self.assertEqual(len(packed), (n + 3) // 4)
+            self.assertEqual(game.unpack_cells(packed, n), flat)
+
+
+class CatalogueTest(unittest.TestCase):
+    def path(self, name):
+        path = os.path.join(TMP, "%s-%s.cat" % (self._testMethodName, name))
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    def test_write_and_read_back(self):
+        rng = random.Random(2)
+        mazes = [("m%d" % n, random_grid(rng, rng.randint(1, 9), rng.randint(1, 9))) for n in range(12)]
+        mazes.append(("café", [[0]]))
+        path = self.path("cat")
+        game.write_catalogue(path, [game.catalogue_entry(name, grid) for name, grid in mazes])
+        cat = game.MazeCatalogue(path, cache_size=2)
+        self.assertEqual(cat.names(), [name for name, _ in mazes])
+        for i, (name, grid) in enumerate(mazes):
+            self.assertEqual(cat.dims(i), (len(grid), len(grid[0])))
+            self.assertEqual(cat.find(name), i)
+            self.assertEqual(grid_of(cat[i]), grid)
+            self.assertEqual(bytes(cat.packed(i)), game.catalogue_entry(name, grid)[3])
+        self.assertIs(cat[len(mazes) - 1], cat[-1])
+        self.assertEqual(cat.stats()["decoded"], 2)
+        self.assertEqual((cat.hits, cat.misses), (2, len(mazes)))
+
+    def test_seed_mazes(self):
+        for i, m in enumerate(game.SEED_MAZES):
+            self.assertEqual(game.MAZE_INDEX.name(i), m["name"])
+            self.assertEqual(grid_of(game.MAZE_INDEX[i]), m["grid"])
+
+    def test_rejects_bad_grids(self):
+        for grid in ([], [[]], [[0, 1], [0]], [[0, 4]], [[0, True]], [[1, 2, 3]]):
+            with self.assertRaises(ValueError, msg=grid):
+                game.catalogue_entry("bad", grid)
+        with self.assertRaises(ValueError):
+            game.write_catalogue(self.path("short"), [("short", 3, 3, b"\0")])
+        path = self.path("junk")
+        with open(path, "wb") as f:
+            f.write(b"not a catalogue at all")
+        with self.assertRaises(ValueError):
+            game.MazeCatalogue(path)
+
+    def test_catalogue_tool(self):
+        path = self.path("tool")
+        mazes = os.path.join(TMP, "import.json")
+
+        def run(*argv):
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                return catalogue.main(["--catalogue", path] + list(argv))
+
+        def load(items):
+            with open(mazes, "w") as f:
+                json.dump([{"name": n, "grid": g} for n, g in items], f)
+            return run("import", mazes)
+
+        self.assertEqual(load([("a", [[0, 1]]), ("b", [[0], [2]])]), 0)
+        self.assertEqual(load([("b", [[0]]), ("c", [[3, 0]])]), 0)
+        cat = game.MazeCatalogue(path)
+        self.assertEqual(cat.names(), ["a", "b", "c"])
+        self.assertEqual(grid_of(cat[1]), [[0], [2]])
+        with open(path, "rb") as f:
+            before = f.read()
+        self.assertEqual(load([("d", [[0]]), ("e", [[0, 1], [1]])]), 1)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(run("generate", "9x9", "--seeds", "1-2"), 0)
+        self.assertEqual(len(game.MazeCatalogue(path)), 5)
+        self.assertEqual(run("list"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
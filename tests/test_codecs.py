@@ -0,0 +1,129 @@
+"""
+Round-trip checks for app.py's byte codecs: the 2-bit cell packing, packed
+sessions, and the binary wire format (against the offsets the JS client in
+INDEX_HTML reads).
+"""
+import re, struct, unittest
+
+from tests.support import game, scratch_maze
+
+
+def decode_state(buf):
+    # Python twin of decodeState in INDEX_HTML
+    (magic, fmt, flags, status, version, score, elapsed, applied,
+     pr, pc, n_enemies, n_oil) = game.WIRE_HEAD.unpack_from(buf)
+    o = game.WIRE_HEAD.size
+    coords = struct.unpack_from("<%dH" % (2 * (n_enemies + n_oil)), buf, o)
+    o += 4 * (n_enemies + n_oil)
+    pairs = [tuple(coords[i:i + 2]) for i in range(0, len(coords), 2)]
+    (n_name,) = struct.unpack_from("<H", buf, o)
+    st = {"magic": magic, "format": fmt, "flags": flags, "status": status, "version": version,
+          "score": score, "elapsed": elapsed, "applied": applied, "player": (pr, pc),
+          "enemies": pairs[:n_enemies], "oil": pairs[n_enemies:],
+          "player_name": buf[o + 2:o + 2 + n_name].decode("utf-8")}
+    o += 2 + n_name
+    if flags & game.WIRE_FULL:
+        rows, cols, n = struct.unpack_from("<HHI", buf, o)
+        body = buf[o + 8:o + 8 + n]
+        if flags & game.WIRE_RLE:
+            flat = b"".join(bytes([b >> 6]) * ((b & 63) + 1) for b in body)
+        else:
+            flat = game.unpack_cells(body, rows * cols)
+        st["maze"] = [flat[r * cols:(r + 1) * cols] for r in range(rows)]
+        o += 8 + n
+    st["end"] = o
+    return st
+
+
+class CellPackingTest(unittest.TestCase):
+    def test_round_trip(self):
+        for n in range(0, 21):
+            flat = bytes((i * 7 + n) % 4 for i in range(n))
+            packed = game.pack_cells(flat)
+            self.assertEqual(len(packed), (n + 3) // 4)
+            self.assertEqual(game.unpack_cells(packed, n), flat)
+
+    def test_first_cell_in_low_bits(self):
+        self.assertEqual(game.pack_cells(bytes([1, 2, 3, 0, 3])), bytes([0b00111001, 0b11]))
+
+
+class SessionPackTest(unittest.TestCase):
+    def test_round_trip(self):
+        idx = game.MAZE_INDEX[0]
+        s = game.Session(0, "Zoë", idx.start, [(1, 2), (3, 4)], seed=12345, level="hard")
+        s.score, s.tick, s.room = 75, 9, "abcd1234"
+        s.collected = set(list(idx.oil)[:2])
+        s.finished, s.finish_time = True, s.start_time + 12.5
+        for i, d in enumerate(["up", "left", None, "sideways", "right", "down"]):
+            s.record(d, s.start_time + i / 10.0, player_only=(i == 4))
+        s.pending.extend(b"\x00\x03")
+        t = game.Session.unpack(s.pack())
+        for slot in game.Session.__slots__:
+            self.assertEqual(getattr(t, slot), getattr(s, slot), slot)
+
+    def test_stale_format_refused(self):
+        data = bytearray(game.Session(0, "p", (0, 0), []).pack())
+        data[3] ^= 0xff
+        with self.assertRaises(game.StaleRecord):
+            game.Session.unpack(bytes(data))
+
+
+class WireFormatTest(unittest.TestCase):
+    def session(self, maze_index):
+        sid = game.new_session(maze_index, "wire", seed=7)
+        return game.SESSIONS[sid]
+
+    def check_full(self, s):
+        buf = game.pack_state(s, {"status": "win", "elapsed": 3.25, "applied": 2}, None, None)
+        st = decode_state(buf)
+        self.assertEqual(st["end"], len(buf))
+        self.assertEqual((st["magic"], st["format"]), (b"CM", 1))
+        self.assertTrue(st["flags"] & game.WIRE_FULL and st["flags"] & game.WIRE_ELAPSED)
+        self.assertEqual((st["status"], st["elapsed"], st["applied"]), (1, 3.25, 2))
+        self.assertEqual((st["version"], st["score"], st["player"]), (s.tick, s.score, s.player))
+        self.assertEqual(st["enemies"], list(s.enemies))
+        self.assertEqual(set(st["oil"]), s.collected)
+        self.assertEqual(st["player_name"], s.player_name)
+        self.assertEqual(st["maze"], list(game.MAZE_INDEX[s.maze_index].grid))
+        return st["flags"]
+
+    def test_full_reply_packed(self):
+        s = self.session(0)
+        s.collected = set(list(game.MAZE_INDEX[0].oil)[:1])
+        self.assertFalse(self.check_full(s) & game.WIRE_RLE)
+
+    def test_full_reply_rle(self):
+        # a big open room has long runs, so the run-length encoding wins
+        grid = [[1] * 80] + [[1] + [0] * 78 + [1] for _ in range(78)] + [[1] * 80]
+        grid[1][2], grid[78][78] = 2, 3
+        with scratch_maze("test-open-room", grid) as i:
+            self.assertTrue(self.check_full(self.session(i)) & game.WIRE_RLE)
+
+    def test_delta_reply(self):
+        s = self.session(0)
+        removed = [(1, 1)]
+        st = decode_state(game.pack_state(s, {}, s.tick, s.tick, removed))
+        self.assertFalse(st["flags"] & (game.WIRE_FULL | game.WIRE_ELAPSED))
+        self.assertEqual(st["oil"], removed)
+        self.assertNotIn("maze", st)
+
+    def test_js_offsets_match_header(self):
+        # every fixed offset decodeState reads must be the WIRE_HEAD field of that type
+        js_types = {"Uint8": "B", "Uint16": "H", "Uint32": "I", "Int32": "i", "Float64": "d"}
+        fields, off = {}, 0
+        for code in re.findall(r"\d*[a-zA-Z?]", game.WIRE_HEAD.format.lstrip("<")):
+            fields[off] = code[-1]
+            off += struct.calcsize("<" + code)
+        self.assertEqual(game.WIRE_HEAD.size, 31)
+        self.assertEqual(off, game.WIRE_HEAD.size)
+        js = game.INDEX_HTML[game.INDEX_HTML.index("function decodeState"):]
+        js = js[:js.index("\n}\n")]
+        reads = re.findall(r"v\.get(\w+)\((\d+)", js)
+        self.assertGreaterEqual(len(reads), 10)
+        for kind, at in reads:
+            self.assertEqual(fields.get(int(at)), js_types[kind], "decodeState reads %s at %s" % (kind, at))
+        self.assertIn("let o = %d;" % game.WIRE_HEAD.size, js)
+
+
+if __name__ == "__main__":
+    unittest.main()
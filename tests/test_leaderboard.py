@@ -0,0 +1,77 @@
+"""
+In-memory leaderboard: Ranking order, caps and pages, and the Leaderboard's
+warm-up and cross-worker sync against the (SQLite) score table.
+"""
+import unittest
+
+from tests.support import game
+
+
+def row(player, score, time, maze="m"):
+    return {"player": player, "maze": maze, "score": score, "time": time}
+
+
+class RankingTest(unittest.TestCase):
+    def ranking(self, cap=100):
+        r = game.Ranking(cap)
+        for seq, (p, score, t) in enumerate([("a", 100, 9.0), ("b", 300, 5.0), ("c", 300, 4.0),
+                                             ("a", 250, 3.0), ("d", 50, 1.0)]):
+            r.add((-score, t, seq), row(p, score, t))
+        return r
+
+    def test_order_and_pages(self):
+        r = self.ranking()
+        self.assertEqual([x["player"] for x in r.rows], ["c", "b", "a", "a", "d"])
+        self.assertEqual([x["player"] for x in r.page(1, 2)], ["c", "b"])
+        self.assertEqual([x["player"] for x in r.page(3, 2)], ["d"])
+        self.assertEqual(r.page(4, 2), [])
+
+    def test_rank_is_best_entry(self):
+        r = self.ranking()
+        self.assertEqual(r.rank("a"), (3, row("a", 250, 3.0)))
+        self.assertIsNone(r.rank("nobody"))
+
+    def test_cap_drops_tail_and_its_best(self):
+        r = self.ranking(cap=3)
+        self.assertEqual(len(r.rows), 3)
+        self.assertIsNone(r.rank("d"))
+        self.assertEqual(r.rank("a")[0], 3)
+
+
+class LeaderboardSyncTest(unittest.TestCase):
+    def setUp(self):
+        with game.get_db() as conn:
+            conn.execute("DELETE FROM leaderboard")
+            conn.commit()
+
+    def board(self):
+        lb = game.Leaderboard(cap=100)
+        self.assertTrue(lb.ready(5))
+        return lb
+
+    def test_warm_loads_existing_rows(self):
+        game.write_scores([row("a", 100, 2.0), row("b", 200, 3.0)])
+        lb = self.board()
+        self.assertEqual([r["player"] for r in lb.page()["entries"]], ["b", "a"])
+
+    def test_sync_picks_up_other_workers_rows_once(self):
+        lb = self.board()
+        mine = row("me", 150, 1.5)
+        lb.add(mine)
+        # our own row comes back from the DB along with another worker's
+        game.write_scores([mine, row("other", 400, 2.0)])
+        lb.sync()
+        lb.sync()
+        self.assertEqual([r["player"] for r in lb.page()["entries"]], ["other", "me"])
+        self.assertEqual(lb.rank("other")["rank"], 1)
+
+    def test_version_moves_with_synced_rows(self):
+        lb = self.board()
+        v = lb.version
+        game.write_scores([row("x", 10, 9.0)])
+        lb.sync()
+        self.assertGreater(lb.version, v)
+
+
+if __name__ == "__main__":
+    unittest.main()
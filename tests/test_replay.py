@@ -0,0 +1,67 @@
+"""
+Run logs and replay verification: a played run replays to the same result,
+survives export through /run and replay.py, and tampered records fail.
+"""
+import contextlib, io, json, os, random, unittest
+
+import replay
+from tests.support import TMP, game
+
+
+def play(maze_index, dirs, enemies=None, seed=7):
+    sid = game.new_session(maze_index, "replay", enemies=enemies, seed=seed)
+    with game.SESSIONS.locked(sid) as s:
+        for n, d in enumerate(dirs):
+            if s.finished:
+                break
+            game.apply_move(s, d, s.start_time + 0.05 * (n + 1))
+    return sid
+
+
+class ReplayTest(unittest.TestCase):
+    def tearDown(self):
+        for sid in game.SESSIONS.keys():
+            game.SESSIONS.pop(sid)
+
+    def record(self, sid):
+        return json.loads(game.app.test_client().get("/run/%s" % sid).get_data())
+
+    def test_finished_run_verifies(self):
+        sid = play(0, game.solve_route(0)["dirs"], enemies=0)
+        s = game.SESSIONS[sid]
+        self.assertTrue(s.finished)
+        self.assertEqual(game.verify_session(s)["error"], None)
+        res = game.verify_run(self.record(sid))
+        self.assertTrue(res["ok"], res)
+        self.assertEqual(res["score"], s.score)
+
+    def test_runs_with_enemies_verify(self):
+        rng = random.Random(1)
+        for i in range(game.MAZE_INDEX.builtin):
+            dirs = [rng.choice(["up", "down", "left", "right", "none"]) for _ in range(300)]
+            res = game.verify_run(self.record(play(i, dirs, seed=i)))
+            self.assertTrue(res["ok"], res)
+
+    def test_tampered_records_fail(self):
+        rec = self.record(play(0, game.solve_route(0)["dirs"], enemies=0))
+        for change in ({"score": rec["score"] + 10}, {"elapsed": rec["elapsed"] - 1},
+                       {"finished": False}, {"tick": rec["tick"] + 1},
+                       {"log_t": rec["log_t"][:-8]}, {"log": ""}, {"seed": "x"},
+                       {"maze": "nowhere", "maze_index": None}):
+            res = game.verify_run(dict(rec, **change))
+            self.assertFalse(res["ok"], change)
+            self.assertTrue(res["error"], change)
+
+    def test_replay_script(self):
+        good = self.record(play(0, game.solve_route(0)["dirs"], enemies=0))
+        path = os.path.join(TMP, "runs.jsonl")
+        for recs, code in (([good], 0), ([good, dict(good, score=good["score"] + 1)], 1)):
+            with open(path, "w") as f:
+                f.write("".join(json.dumps(r) + "\n" for r in recs))
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(replay.main([path, "-j", "1"]), code)
+            self.assertIn("%d runs verified" % len(recs), out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
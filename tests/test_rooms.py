@@ -0,0 +1,105 @@
+"""
+Race rooms through the HTTP routes: open -> racing -> complete, verified
+submissions and standings, early starts, timeouts, quick_join, and the
+events room subscribers see.
+"""
+import json, unittest
+
+from tests.support import game
+
+
+def finish(sid, step):
+    # drive the session to the exit along the oil route, step seconds per move
+    with game.SESSIONS.locked(sid) as s:
+        for n, d in enumerate(game.solve_route(s.maze_index)["dirs"]):
+            game.apply_move(s, d, s.start_time + step * (n + 1))
+        assert s.finished
+
+
+def events(q):
+    out = []
+    while not q.empty():
+        msg = q.get_nowait()
+        out.append(msg and msg.split("\n")[0][len("event: "):])
+    return out
+
+
+class RoomTest(unittest.TestCase):
+    def setUp(self):
+        self.client = game.app.test_client()
+
+    def tearDown(self):
+        for store in (game.SESSIONS, game.ROOMS):
+            for key in store.keys():
+                store.pop(key)
+        with game.LOCK:
+            game.OPEN_ROOMS.clear()
+
+    def post(self, path, status=200, **data):
+        r = self.client.post(path, json=data)
+        self.assertEqual(r.status_code, status, r.get_data(as_text=True))
+        return json.loads(r.get_data())
+
+    def room(self, rid):
+        return json.loads(self.client.get("/room/%s" % rid).get_data())
+
+    def open_room(self, capacity=2):
+        return self.post("/create_room", maze_index=0, enemies=0, capacity=capacity)["room"]
+
+    def test_race_lifecycle(self):
+        rid = self.open_room()
+        q = game.room_subscribe(rid)
+        a = self.post("/join_room", room=rid, maze_index=0, player_name="a")["session_id"]
+        self.assertEqual([r["room"] for r in json.loads(self.client.get("/rooms?maze=0").get_data())], [rid])
+        self.post("/join_room", 400, room=rid, maze_index=1)
+        b = self.post("/join_room", room=rid, maze_index=0, player_name="b")["session_id"]
+        self.assertEqual(self.room(rid)["state"], "racing")
+        self.assertEqual(json.loads(self.client.get("/rooms?maze=0").get_data()), [])
+        self.assertEqual(self.post("/join_room", 400, room=rid, maze_index=0)["error"], "Room is not open")
+        self.assertEqual(len(game.SESSIONS), 2)
+
+        self.post("/submit_race", 400, room=rid, session_id=a)      # not finished yet
+        finish(b, 0.1)
+        finish(a, 0.05)
+        self.assertEqual(self.post("/submit_race", room=rid, session_id=b)["status"], "waiting")
+        res = self.post("/submit_race", room=rid, session_id=a)
+        self.assertEqual(res["status"], "complete")
+        self.assertEqual([(r["player"], r["rank"]) for r in res["results"]], [("a", 1), ("b", 2)])
+        self.assertEqual(self.post("/submit_race", room=rid, session_id=a)["results"], res["results"])
+        self.assertEqual(events(q), ["joined", "joined", "racing", "result", "result", "standings", None])
+        self.assertTrue(game.room_done(game.ROOMS[rid]))
+
+    def test_submission_must_replay(self):
+        rid = self.open_room(capacity=1)
+        sid = self.post("/join_room", room=rid, maze_index=0)["session_id"]
+        finish(sid, 0.05)
+        with game.SESSIONS.locked(sid) as s:
+            s.score += 100
+        res = self.post("/submit_race", 400, room=rid, session_id=sid)
+        self.assertEqual(res["error"], "run failed verification")
+        self.assertEqual(self.room(rid)["results"], [])
+
+    def test_early_start_and_timeout(self):
+        rid = self.open_room(capacity=4)
+        sid = self.post("/join_room", room=rid, maze_index=0)["session_id"]
+        self.post("/start_room", 400, room=rid, session_id="someone else")
+        self.assertEqual(self.post("/start_room", room=rid, session_id=sid)["state"], "racing")
+        game.close_overdue_rooms()
+        self.assertEqual(self.room(rid)["state"], "racing")
+        with game.ROOMS.locked(rid) as room:
+            room["started"] -= game.RACE_TIMEOUT + 1
+        game.close_overdue_rooms()
+        self.assertEqual(self.room(rid)["state"], "complete")
+
+    def test_quick_join_fills_matching_rooms(self):
+        first = self.post("/quick_join", maze_index=0, difficulty="easy")
+        other = self.post("/quick_join", maze_index=0, difficulty="hard")
+        self.assertNotEqual(other["room"], first["room"])
+        second = self.post("/quick_join", maze_index=0, difficulty="easy")
+        self.assertEqual(second["room"], first["room"])
+        self.assertEqual(self.room(first["room"])["state"], "racing")
+        self.assertNotEqual(self.post("/quick_join", maze_index=0, difficulty="easy")["room"], first["room"])
+
+
+if __name__ == "__main__":
+    unittest.main()
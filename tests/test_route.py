@@ -0,0 +1,74 @@
+"""
+Oil route solver: the bitmask DP against brute force over every collection
+order, and routes (exact or 2-opt) that really walk the maze.
+"""
+import itertools, random, unittest
+
+from tests.support import game, scratch_maze
+
+STEP = {"up": (-1, 0), "down": (1, 0), "left": (0, -1), "right": (0, 1)}
+
+
+def route_cost(D, n, order):
+    path = [n] + list(order) + [n + 1]
+    return sum(D[a][b] for a, b in zip(path, path[1:]))
+
+
+def brute_force(D, n):
+    return min(route_cost(D, n, p) for p in itertools.permutations(range(n)))
+
+
+class RouteTest(unittest.TestCase):
+    def walk(self, idx, route):
+        # follow the moves from the start: every step open, all reachable oil, ends on the exit
+        pos, seen = idx.start, set()
+        for d in route["dirs"]:
+            pos = (pos[0] + STEP[d][0], pos[1] + STEP[d][1])
+            self.assertTrue(0 <= pos[0] < idx.rows and 0 <= pos[1] < idx.cols)
+            self.assertNotEqual(idx.grid[pos[0]][pos[1]], 1)
+            seen.add(pos)
+        self.assertEqual(pos, idx.exit)
+        self.assertEqual(route["steps"], len(route["dirs"]))
+        self.assertEqual(len(route["order"]), route["oil_total"] - route["oil_unreachable"])
+        self.assertTrue({tuple(t) for t in route["order"]} <= seen)
+
+    def pairwise(self, idx):
+        C = idx.cols
+        exit_field = game.distance_field(idx, idx.exit)
+        oil = sorted(t for t in idx.oil if exit_field[t[0] * C + t[1]] >= 0)
+        nodes = oil + [idx.start, idx.exit]
+        fields = [game.distance_field(idx, t) for t in nodes]
+        return [[fields[b][a[0] * C + a[1]] for b in range(len(nodes))] for a in nodes], len(oil)
+
+    def test_dp_matches_brute_force_on_random_tables(self):
+        rng = random.Random(3)
+        for n in range(0, 8):
+            D = [[0 if a == b else rng.randint(1, 30) for b in range(n + 2)] for a in range(n + 2)]
+            order = game.route_order_exact(D, n)
+            self.assertEqual(sorted(order), list(range(n)))
+            self.assertEqual(route_cost(D, n, order), brute_force(D, n))
+
+    def test_stock_mazes_are_optimal(self):
+        for i in range(game.MAZE_INDEX.builtin):
+            idx = game.MAZE_INDEX[i]
+            route = game.solve_route(i)
+            self.assertTrue(route["exact"])
+            D, n = self.pairwise(idx)
+            self.assertEqual(route["steps"], brute_force(D, n), idx.name)
+            self.walk(idx, route)
+
+    def test_heuristic_route_is_valid(self):
+        m = game.generate_maze(31, 31, 3, 0.3, oil=game.ROUTE_EXACT_MAX_OIL + 7)
+        with scratch_maze(m["name"], m["grid"]) as i:
+            route = game.solve_route(i)
+            self.assertFalse(route["exact"])
+            self.walk(game.MAZE_INDEX[i], route)
+
+    def test_too_much_oil_is_refused(self):
+        m = game.generate_maze(41, 41, 3, 0.0, oil=game.ROUTE_MAX_OIL + 1)
+        with scratch_maze(m["name"], m["grid"]) as i:
+            self.assertIn("too many oil tiles", game.solve_route(i)["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
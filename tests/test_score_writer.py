@@ -0,0 +1,59 @@
+"""
+ScoreWriter: batches are retried with backoff, then dropped and counted; a
+full queue drops instead of writing on the caller's thread.
+"""
+import threading, unittest
+
+from tests.support import game
+
+
+class ScoreWriterTest(unittest.TestCase):
+    def writer(self, write, **kw):
+        w = game.ScoreWriter(write, backoff=0, **kw)
+        self.addCleanup(w.stop, 1)
+        return w
+
+    def test_batches_and_retries(self):
+        written, failures = [], [2]
+        def write(entries):
+            if failures[0]:
+                failures[0] -= 1
+                raise OSError("db down")
+            written.extend(entries)
+        w = self.writer(write, retries=3)
+        for n in range(5):
+            w.submit({"player": "p%d" % n})
+        self.assertTrue(w.flush(5))
+        self.assertEqual(sorted(e["player"] for e in written), ["p%d" % n for n in range(5)])
+        self.assertEqual(w.stats()["dropped"], 0)
+
+    def test_drops_after_retries(self):
+        calls = []
+        def write(entries):
+            calls.append(len(entries))
+            raise OSError("db down")
+        w = self.writer(write, retries=2)
+        w.submit({"player": "p"})
+        self.assertTrue(w.flush(5))
+        self.assertEqual(calls, [1, 1, 1])
+        self.assertEqual(w.stats()["dropped"], 1)
+
+    def test_full_queue_drops_without_writing_inline(self):
+        release, callers = threading.Event(), []
+        def write(entries):
+            callers.append(threading.current_thread().name)
+            release.wait(5)
+        w = self.writer(write, capacity=1, batch=1)
+        w.submit({"player": "a"})           # taken by the writer, which then blocks
+        while not callers:
+            release.wait(0.01)
+        w.submit({"player": "b"})           # fills the queue
+        w.submit({"player": "c"})           # no room: dropped, not written here
+        self.assertEqual(w.stats()["dropped"], 1)
+        release.set()
+        self.assertTrue(w.flush(5))
+        self.assertEqual(set(callers), {"score-writer"})
+
+
+if __name__ == "__main__":
+    unittest.main()
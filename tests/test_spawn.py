@@ -0,0 +1,54 @@
+"""
+Difficulty levels and seeded enemy spawns: validation of level tables, and
+placements that are reproducible, distinct, empty and far enough out.
+"""
+import unittest
+
+from tests.support import game
+
+
+class DifficultyLevelsTest(unittest.TestCase):
+    def check(self, level):
+        game.check_difficulty_levels({"x": level}, "x")
+
+    def test_defaults_are_valid(self):
+        game.check_difficulty_levels(game.DIFFICULTY_LEVELS, game.DEFAULT_DIFFICULTY)
+
+    def test_rejects_bad_levels(self):
+        for level in ({"enemies": 2}, {"enemies": -1, "min_dist": 0}, {"enemies": True, "min_dist": 0},
+                      {"enemies": 2, "min_dist": 0, "weight": "nearest"},
+                      {"enemies": game.MAX_LEVEL_ENEMIES + 1, "min_dist": 0}, "hard"):
+            with self.assertRaises(ValueError, msg=level):
+                self.check(level)
+        with self.assertRaises(ValueError):
+            game.check_difficulty_levels({"x": {"enemies": 1, "min_dist": 0}}, "y")
+
+    def test_most_enemies_still_pack(self):
+        level = {"enemies": game.MAX_LEVEL_ENEMIES, "min_dist": 0}
+        self.check(level)
+        s = game.Session(0, "p", (0, 0), [(1, 1)] * level["enemies"], seed=1)
+        self.assertEqual(len(game.Session.unpack(s.pack()).enemies), game.MAX_LEVEL_ENEMIES)
+
+
+class SpawnTest(unittest.TestCase):
+    def test_seeded_distinct_and_far_enough(self):
+        for i in range(game.MAZE_INDEX.builtin):
+            idx = game.MAZE_INDEX[i]
+            safety = idx.safety
+            for name, level in game.DIFFICULTY_LEVELS.items():
+                tiles = game.place_enemies(idx, level["enemies"], 42, name)
+                self.assertEqual(tiles, game.place_enemies(idx, level["enemies"], 42, name))
+                self.assertEqual(len(set(tiles)), len(tiles))
+                for r, c in tiles:
+                    self.assertEqual(idx.grid[r][c], 0)
+                    self.assertGreaterEqual(safety.dist[r * idx.cols + c], safety.min_dist(level))
+
+    def test_more_enemies_than_candidates(self):
+        idx = game.MAZE_INDEX[0]
+        tiles = game.place_enemies(idx, 10000, 1, "normal")
+        self.assertEqual(len(set(tiles)), len(tiles))
+        self.assertLess(len(tiles), 10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
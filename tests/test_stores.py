@@ -0,0 +1,114 @@
+"""
+Session/room stores, in memory and SQLite: LRU cap, idle and done TTLs,
+eviction callbacks, and the SQLite store's shared, transactional updates.
+"""
+import json, os, time, unittest
+
+from tests.support import TMP, game
+
+
+def ttl_store(cap=3, idle_ttl=60, done_ttl=5):
+    evicted = []
+    store = game.TTLStore(cap, idle_ttl, done_ttl, is_done=lambda v: v.get("done"),
+                          nbytes=lambda v: 10, on_evict=lambda k, v: evicted.append(k))
+    return store, evicted
+
+
+class TTLStoreTest(unittest.TestCase):
+    def test_cap_drops_least_recently_used(self):
+        s, evicted = ttl_store()
+        for k in "abc":
+            s[k] = {}
+        s["a"]                          # a is now the most recent
+        s["d"] = {}
+        self.assertEqual(evicted, ["b"])
+        self.assertEqual(s.keys(), ["c", "a", "d"])
+        self.assertEqual(s.stats(), {"live": 3, "cap": 3, "evicted": 1, "bytes": 30})
+
+    def test_sweep_idle_and_done(self):
+        s, evicted = ttl_store()
+        s["live"], s["done"] = {}, {"done": True}
+        now = time.time()
+        self.assertEqual(s.sweep(now + 1), 0)
+        self.assertEqual(s.sweep(now + 10), 1)
+        self.assertEqual(evicted, ["done"])
+        self.assertEqual(s.sweep(now + 120), 1)
+        self.assertEqual(len(s), 0)
+        self.assertEqual(s.evicted, 2)
+
+    def test_untouched_lock_keeps_idle_clock(self):
+        s, _ = ttl_store()
+        s["a"] = {"n": 0}
+        s._d["a"][1] -= 100
+        with s.locked("a", touch=False) as v:
+            v["n"] += 1
+        self.assertEqual(s.sweep(), 1)
+        s["b"] = {}
+        s._d["b"][1] -= 100
+        with s.locked("b") as v:
+            self.assertIsNotNone(v)
+        self.assertEqual(s.sweep(), 0)
+
+    def test_missing_key(self):
+        s, _ = ttl_store()
+        with s.locked("nope") as v:
+            self.assertIsNone(v)
+        self.assertIsNone(s.get("nope"))
+        self.assertEqual(s.pop("nope", 1), 1)
+
+
+def load(data):
+    value = json.loads(data)
+    if value.get("old"):
+        raise game.StaleRecord("test format")
+    return value
+
+
+class SQLiteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.path = os.path.join(TMP, "store-%s.db" % self._testMethodName)
+        self.s = game.SQLiteStore(self.path, "things", json.dumps, load, cap=2, idle_ttl=60, done_ttl=5,
+                                  is_done=lambda v: v.get("done"),
+                                  on_evict=lambda k, v: self.evicted.append(k))
+
+    def test_shared_between_handles(self):
+        self.s["a"] = {"n": 1}
+        with self.s.locked("a") as v:
+            v["n"] += 1
+        other = game.SQLiteStore(self.path, "things", json.dumps, load, 2, 60, 5, lambda v: False)
+        self.assertEqual(other["a"], {"n": 2})
+        self.assertEqual(other.pop("a"), {"n": 2})
+        self.assertNotIn("a", self.s)
+
+    def test_failed_update_rolls_back(self):
+        self.s["a"] = {"n": 1}
+        with self.assertRaises(RuntimeError):
+            with self.s.locked("a") as v:
+                v["n"] = 99
+                raise RuntimeError
+        self.assertEqual(self.s["a"], {"n": 1})
+
+    def test_sweep_ttls_and_cap(self):
+        now = time.time()
+        for k in "abc":
+            self.s[k] = {}
+        # over the cap the oldest write goes; done entries go after done_ttl
+        self.assertEqual(self.s.sweep(now + 1), 1)
+        self.assertEqual(self.evicted, ["a"])
+        with self.s.locked("b") as v:
+            v["done"] = True
+        self.assertEqual(self.s.sweep(now + 10), 1)
+        self.assertEqual(self.s.keys(), ["c"])
+        self.assertEqual(self.s.sweep(now + 120), 1)
+        self.assertEqual(self.s.stats()["live"], 0)
+
+    def test_stale_rows_are_dropped(self):
+        self.s["a"] = {"old": True}
+        self.assertIsNone(self.s.get("a"))
+        self.assertEqual(len(self.s), 0)
+        self.assertEqual(self.s.evicted, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()